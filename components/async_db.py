@@ -0,0 +1,173 @@
+"""Async Database Module
+
+Asynchronous write path for the detectors built on psycopg 3. A scored batch
+(history rows, activity counters, missing profiles, fraud upserts, anomaly
+rollups and the processed counter) is sent in pipeline mode, so statements go
+out without waiting on each round-trip and the batch commits once.
+
+AsyncBatchWriter runs the store on an event loop in a background thread, so
+the (synchronous) enhanced detector can hand off a batch's writes with
+ASYNC_DB=1 and score the next batch while they are in flight; the detector
+commits a batch's offsets only once its writes have landed.
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+import psycopg
+
+from components.db_connection import conninfo as db_conninfo, FRAUD_UPSERT, STATS_INCREMENT
+from components.rollups import aggregate, ROLLUP_UPSERT, HISTOGRAM_UPSERT
+from components.user_profile_manager import history_record
+
+# Inserts a whole batch of history rows in one statement and bumps the
+# activity counters of the rows that were actually inserted
+HISTORY_BATCH_INSERT = """
+    WITH inserted AS (
+        INSERT INTO transaction_history (
+            transaction_id, user_id, amount, currency, location, timestamp,
+            transaction_type, merchant_category, payment_method, device_type,
+            is_anomalous
+        )
+        SELECT * FROM unnest(
+            %s::text[], %s::int[], %s::float8[], %s::text[], %s::text[], %s::float8[],
+            %s::text[], %s::text[], %s::text[], %s::text[], %s::bool[]
+        )
+        ON CONFLICT (transaction_id, timestamp) DO NOTHING
+        RETURNING user_id, timestamp
+    )
+    INSERT INTO user_activity (user_id, transaction_count, since_last_fit, last_seen)
+    SELECT user_id, COUNT(*), COUNT(*), MAX(timestamp) FROM inserted GROUP BY user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        transaction_count = user_activity.transaction_count + EXCLUDED.transaction_count,
+        since_last_fit = user_activity.since_last_fit + EXCLUDED.since_last_fit,
+        last_seen = GREATEST(user_activity.last_seen, EXCLUDED.last_seen)
+"""
+
+PROFILE_BATCH_INSERT = """
+    INSERT INTO user_profiles (user_id)
+    SELECT unnest(%s::int[])
+    ON CONFLICT (user_id) DO NOTHING
+"""
+
+def fraud_record(txn):
+    """Return the frauds column values for a scored transaction"""
+    merchant = txn.get('merchant') if isinstance(txn.get('merchant'), dict) else {}
+    device = txn.get('device_info') if isinstance(txn.get('device_info'), dict) else {}
+    return (
+        txn.get('transaction_id') or f"AUTOGEN-{int(time.time())}-{txn['user_id']}",
+        int(txn['user_id']),
+        float(txn['amount']),
+        txn.get('currency', 'USD'),
+        txn.get('location'),
+        float(txn.get('timestamp', 0)),
+        txn.get('transaction_type', 'unknown'),
+        merchant.get('merchant_id', 'unknown'),
+        merchant.get('name', 'unknown'),
+        merchant.get('category', 'unknown'),
+        txn.get('payment_method', 'unknown'),
+        device.get('type', 'unknown'),
+        device.get('ip_address', 'unknown'),
+        float(txn.get('detection_score', 0)),
+        str(txn.get('risk_level', 'medium')),
+        json.dumps(txn.get('detection_features', {})),
+        txn.get('model_used', 'global'),
+    )
+
+class AsyncDetectorStore:
+    """Pipelined, batch-at-a-time persistence for scored transactions"""
+
+    def __init__(self, conninfo=None):
+        self.conninfo = conninfo or db_conninfo()
+        self.conn = None
+
+    async def connect(self):
+        self.conn = await psycopg.AsyncConnection.connect(self.conninfo)
+        return self
+
+    async def close(self):
+        if self.conn is not None:
+            await self.conn.close()
+            self.conn = None
+
+    async def persist_batch(self, transactions, store_history=True, scored=None, notifications=()):
+        """Write one batch in a single pipelined transaction
+
+        All transactions go to transaction_history (unless store_history is
+        False) and count towards total_transactions_processed. Of the scored
+        ones (scored, or else transactions), those flagged with anomaly == 1
+        are upserted into frauds. notifications are (channel, payload) pairs
+        sent with pg_notify, so they are delivered on commit.
+
+        Returns the newly inserted anomalies (for the rollups' format, plus
+        user_id).
+        """
+        if not transactions:
+            return []
+        if self.conn is None or self.conn.closed:
+            await self.connect()
+
+        scored = transactions if scored is None else scored
+        frauds = [fraud_record(t) for t in scored if t.get('anomaly') == 1]
+        new_anomalies = []
+
+        try:
+            async with self.conn.transaction():
+                async with self.conn.pipeline():
+                    async with self.conn.cursor() as cur:
+                        if store_history:
+                            rows = [history_record(t) for t in transactions]
+                            columns = [list(col) for col in zip(*rows)]
+                            await cur.execute(PROFILE_BATCH_INSERT, (sorted(set(columns[1])),))
+                            await cur.execute(HISTORY_BATCH_INSERT, columns)
+                        if frauds:
+                            await cur.executemany(FRAUD_UPSERT, frauds, returning=True)
+                            for fraud in frauds:
+                                if (await cur.fetchone())[0]:
+                                    new_anomalies.append({
+                                        'user_id': fraud[1],
+                                        'timestamp': fraud[5],
+                                        'amount': fraud[2],
+                                        'detection_score': fraud[13],
+                                        'model_used': fraud[16],
+                                        'risk_level': fraud[14],
+                                    })
+                                cur.nextset()
+                            rollups, histograms = aggregate(new_anomalies)
+                            if rollups:
+                                await cur.executemany(ROLLUP_UPSERT, rollups)
+                                await cur.executemany(HISTOGRAM_UPSERT, histograms)
+                        await cur.execute(STATS_INCREMENT, (len(transactions),))
+                        for channel, payload in notifications:
+                            await cur.execute("SELECT pg_notify(%s, %s)", (channel, payload))
+        except psycopg.OperationalError:
+            # Connection lost: drop it so the next batch reconnects
+            await self.close()
+            raise
+        return new_anomalies
+
+class AsyncBatchWriter:
+    """Runs an AsyncDetectorStore on an event loop in a background thread
+
+    submit() hands a batch's writes to the loop and returns at once with a
+    concurrent.futures.Future of persist_batch()'s result, so a synchronous
+    consume loop can score the next batch while the writes are in flight.
+    """
+
+    def __init__(self, store=None):
+        self.store = store or AsyncDetectorStore()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="async-db-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, transactions, **kwargs):
+        return asyncio.run_coroutine_threadsafe(self.store.persist_batch(transactions, **kwargs), self.loop)
+
+    def close(self, timeout=10):
+        try:
+            asyncio.run_coroutine_threadsafe(self.store.close(), self.loop).result(timeout)
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout)
@@ -0,0 +1,320 @@
+"""Cohort Model Module
+
+Clusters users with similar profiles (amount range, locations, merchant
+categories, active hours) into cohorts and trains one model per cohort, so
+memory and training time grow with the number of cohorts instead of the
+number of users, and users with little history still get a behavioural model.
+"""
+
+import time
+import numpy as np
+import pandas as pd
+import psycopg2.extras
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.preprocessing import StandardScaler
+
+from components.user_profile_manager import (
+    HISTORY_COLUMNS, build_user_features, fit_user_model,
+    load_model_bundle, save_model_bundle, score_results
+)
+
+PROFILE_COLUMNS = [
+    'user_id', 'usual_locations', 'usual_merchants', 'typical_min_amount',
+    'typical_max_amount', 'avg_transaction_amount', 'typical_transaction_times'
+]
+
+def _as_list(value):
+    return value if isinstance(value, list) else []
+
+def profile_feature_matrix(profiles):
+    """Build the clustering matrix from a user_profiles frame (PROFILE_COLUMNS)"""
+    locations = profiles['usual_locations'].map(_as_list)
+    merchants = profiles['usual_merchants'].map(_as_list)
+    hours = profiles['typical_transaction_times'].map(_as_list)
+
+    amounts = np.log1p(np.column_stack([
+        profiles['typical_min_amount'].fillna(5.0).astype(float),
+        profiles['typical_max_amount'].fillna(1000.0).astype(float),
+        profiles['avg_transaction_amount'].fillna(100.0).astype(float),
+    ]))
+
+    def multi_hot(values, vocab):
+        index = {v: i for i, v in enumerate(vocab)}
+        matrix = np.zeros((len(values), len(vocab)))
+        for row, items in enumerate(values):
+            for item in items:
+                matrix[row, index[item]] = 1.0
+        return matrix
+
+    location_vocab = sorted({v for items in locations for v in items})
+    merchant_vocab = sorted({v for items in merchants for v in items})
+
+    # Share of the user's usual hours falling in each hour of the day
+    hour_matrix = np.zeros((len(hours), 24))
+    for row, items in enumerate(hours):
+        for hour in items:
+            hour_matrix[row, int(hour) % 24] += 1.0
+        if items:
+            hour_matrix[row] /= len(items)
+
+    return np.hstack([
+        amounts,
+        multi_hot(locations, location_vocab),
+        multi_hot(merchants, merchant_vocab),
+        hour_matrix,
+    ])
+
+def cluster_profiles(profiles, n_cohorts=20, random_state=42):
+    """Assign every profile to a cohort; returns a Series of cohort ids indexed like profiles"""
+    n_cohorts = max(1, min(n_cohorts, len(profiles)))
+    matrix = StandardScaler().fit_transform(profile_feature_matrix(profiles))
+    kmeans = MiniBatchKMeans(n_clusters=n_cohorts, batch_size=4096, n_init=3, random_state=random_state)
+    return pd.Series(kmeans.fit_predict(matrix), index=profiles.index)
+
+def summarize_history_profiles(history):
+    """Derive user_profiles-like rows from a history frame with a user_id column
+
+    Mirrors UserProfileManager.update_user_profile for users that don't have a
+    stored profile yet (and for offline benchmarks).
+    """
+    def frequent(values):
+        counts = values[values != 'Unknown'].value_counts()
+        return sorted(counts[counts >= 2].index.tolist())
+
+    rows = []
+    for user_id, group in history.groupby('user_id', sort=False):
+        amounts = group['amount'].astype(float)
+        hours = group['hour_of_day'].astype(int)
+        hour_counts = hours.value_counts()
+        rows.append({
+            'user_id': user_id,
+            'usual_locations': frequent(group['location']),
+            'usual_merchants': frequent(group['merchant_category']),
+            'typical_min_amount': float(max(5, np.percentile(amounts, 5))),
+            'typical_max_amount': float(np.percentile(amounts, 95)),
+            'avg_transaction_amount': float(amounts.mean()),
+            'typical_transaction_times': sorted(int(h) for h in hour_counts[hour_counts >= 2].index),
+        })
+    return pd.DataFrame(rows, columns=PROFILE_COLUMNS)
+
+def fit_cohort_models(history, cohorts, min_transactions=20):
+    """Fit one model per cohort
+
+    history has a user_id column plus HISTORY_COLUMNS; cohorts maps user_id to
+    cohort id. Returns {cohort_id: (model, scaler, feature_columns)}.
+    """
+    cohort_ids = history['user_id'].map(cohorts)
+    models = {}
+    for cohort_id, group in history[cohort_ids.notna()].groupby(cohort_ids.dropna().astype(int)):
+        if len(group) < min_transactions:
+            continue
+        models[int(cohort_id)] = fit_user_model(group[HISTORY_COLUMNS])
+    return models
+
+def calibration_offsets(history, cohorts, models):
+    """Per-user offset = user's median raw score minus their cohort's median
+
+    Subtracting the offset at scoring time centres each user's normal
+    behaviour on the cohort's, so a user who is consistently a little unusual
+    for their cohort isn't flagged for it.
+    """
+    cohort_ids = history['user_id'].map(cohorts)
+    offsets = {}
+    for cohort_id, group in history[cohort_ids.notna()].groupby(cohort_ids.dropna().astype(int)):
+        if cohort_id not in models:
+            continue
+        model, scaler, feature_columns = models[cohort_id]
+        raw = pd.Series(
+            model.decision_function(build_user_features(group, scaler, feature_columns)),
+            index=group.index
+        )
+        user_medians = raw.groupby(group['user_id']).median()
+        offsets.update((user_medians - raw.median()).to_dict())
+    return offsets
+
+def score_cohort_frame(df, assignments, models):
+    """Score a history frame (with user_id) against cohort models
+
+    assignments maps user_id to (cohort_id, calibration_offset); models maps
+    cohort_id to a loaded bundle or is a callable returning one. Returns a list
+    aligned with df's rows, None where the user has no cohort model.
+    """
+    results = [None] * len(df)
+    get_model = models if callable(models) else models.get
+
+    user_ids = df['user_id'].tolist()
+    cohort_ids = np.array([assignments.get(u, (-1, 0.0))[0] for u in user_ids])
+    offsets = np.array([assignments.get(u, (-1, 0.0))[1] or 0.0 for u in user_ids], dtype=float)
+
+    for cohort_id in np.unique(cohort_ids):
+        if cohort_id < 0:
+            continue
+        loaded = get_model(int(cohort_id))
+        if loaded is None:
+            continue
+        model, scaler, feature_columns = loaded
+
+        positions = np.flatnonzero(cohort_ids == cohort_id)
+        features = build_user_features(df.iloc[positions], scaler, feature_columns)
+        scores = model.decision_function(features) - offsets[positions]
+        for position, result in zip(positions, score_results(model, scores)):
+            results[position] = result
+    return results
+
+class CohortModelManager:
+    """Assigns users to cohorts and trains, stores and scores cohort models"""
+
+    def __init__(self, conn, models_dir, refresh_interval=300):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.models_dir = models_dir
+        self.refresh_interval = refresh_interval
+
+        # user_id -> (cohort_id, calibration_offset)
+        self.assignments = {}
+        self._loaded_at = 0
+        self._model_cache = {}
+
+    def ensure_schema(self):
+        """Create the user_cohorts table if needed"""
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS user_cohorts (
+                user_id INT PRIMARY KEY,
+                cohort_id INT NOT NULL,
+                calibration_offset FLOAT DEFAULT 0,
+                assigned_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+            )
+        """)
+        self.conn.commit()
+
+    def load_assignments(self):
+        """Load cohort assignments and calibration offsets from the database"""
+        try:
+            self.cursor.execute("SELECT user_id, cohort_id, calibration_offset FROM user_cohorts")
+            self.assignments = {row[0]: (row[1], row[2] or 0.0) for row in self.cursor.fetchall()}
+            self.conn.commit()
+        except Exception as e:
+            print(f"Error loading cohort assignments: {e}")
+            self.conn.rollback()
+        self._loaded_at = time.time()
+        return len(self.assignments)
+
+    def load_cohort_model(self, cohort_id):
+        return load_model_bundle(self.models_dir, f"cohort_{cohort_id}", self._model_cache)
+
+    def assign_cohorts(self, n_cohorts=20):
+        """Cluster all stored profiles into cohorts and persist the assignment"""
+        self.cursor.execute(f"""
+            SELECT {', '.join(PROFILE_COLUMNS)}
+            FROM user_profiles
+            WHERE usual_locations IS NOT NULL
+        """)
+        profiles = pd.DataFrame(self.cursor.fetchall(), columns=PROFILE_COLUMNS)
+        if profiles.empty:
+            print("No user profiles available for cohort assignment")
+            return {}
+
+        cohorts = cluster_profiles(profiles, n_cohorts)
+        assignment = dict(zip(profiles['user_id'].astype(int), cohorts.astype(int)))
+
+        psycopg2.extras.execute_values(self.cursor, """
+            INSERT INTO user_cohorts (user_id, cohort_id, calibration_offset, assigned_at)
+            VALUES %s
+            ON CONFLICT (user_id) DO UPDATE SET
+                cohort_id = EXCLUDED.cohort_id,
+                calibration_offset = 0,
+                assigned_at = NOW()
+        """, [(u, c, 0.0) for u, c in assignment.items()], template="(%s, %s, %s, NOW())", page_size=5000)
+        self.conn.commit()
+        print(f"Assigned {len(assignment)} users to {cohorts.nunique()} cohorts")
+        return assignment
+
+    def _cohort_histories(self, cohorts, per_user_limit, archive=None, chunk_size=50000):
+        """Yield (cohort_id, history frame with user_id) for each cohort
+
+        From the database the rows come from a named (server-side) cursor
+        ordered by cohort, so only one cohort's history is held at a time.
+        """
+        if archive is not None:
+            history = archive.training_histories(list(cohorts), per_user_limit)
+            cohort_ids = history['user_id'].map(cohorts)
+            for cohort_id, group in history[cohort_ids.notna()].groupby(cohort_ids.dropna().astype(int)):
+                yield int(cohort_id), group
+            return
+
+        cursor = self.conn.cursor(name="cohort_history_stream")
+        cursor.itersize = chunk_size
+        try:
+            cursor.execute("""
+                SELECT cohort_id, user_id, amount, location, transaction_type, merchant_category,
+                       payment_method, device_type, timestamp,
+                       EXTRACT(HOUR FROM to_timestamp(timestamp)) as hour_of_day,
+                       EXTRACT(DOW FROM to_timestamp(timestamp)) as day_of_week
+                FROM (
+                    SELECT c.cohort_id, h.*, ROW_NUMBER() OVER (
+                        PARTITION BY h.user_id ORDER BY h.timestamp DESC
+                    ) AS rn
+                    FROM transaction_history h
+                    JOIN user_cohorts c ON c.user_id = h.user_id
+                    WHERE h.is_anomalous = FALSE
+                ) recent
+                WHERE rn <= %s
+                ORDER BY cohort_id
+            """, (per_user_limit,))
+
+            cohort_id, rows = None, []
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                for row in chunk:
+                    if row[0] != cohort_id and rows:
+                        yield int(cohort_id), pd.DataFrame(rows, columns=['user_id'] + HISTORY_COLUMNS)
+                        rows = []
+                    cohort_id = row[0]
+                    rows.append(row[1:])
+                if not chunk:
+                    break
+            if rows:
+                yield int(cohort_id), pd.DataFrame(rows, columns=['user_id'] + HISTORY_COLUMNS)
+        finally:
+            cursor.close()
+            self.conn.rollback()
+
+    def train(self, per_user_limit=50, calibrate=True, archive=None):
+        """Train one model per cohort from the latest normal history of its members
+
+        History is read and fitted one cohort at a time. archive (a
+        HistoryArchive) reads it from Parquet instead of the database.
+        """
+        self.load_assignments()
+        cohorts = {u: c for u, (c, _) in self.assignments.items()}
+
+        trained = 0
+        transactions = 0
+        offsets = {}
+        for _, history in self._cohort_histories(cohorts, per_user_limit, archive):
+            transactions += len(history)
+            models = fit_cohort_models(history, cohorts)
+            for cohort_id, (model, scaler, feature_columns) in models.items():
+                save_model_bundle(self.models_dir, f"cohort_{cohort_id}", model, scaler, feature_columns)
+                trained += 1
+            if calibrate and models:
+                offsets.update(calibration_offsets(history, cohorts, models))
+        print(f"Trained {trained} cohort models from {transactions} transactions")
+
+        if offsets:
+            psycopg2.extras.execute_values(self.cursor, """
+                UPDATE user_cohorts c SET calibration_offset = v.calibration
+                FROM (VALUES %s) AS v(user_id, calibration)
+                WHERE c.user_id = v.user_id
+            """, [(int(u), float(o)) for u, o in offsets.items()], page_size=5000)
+            self.conn.commit()
+            print(f"Stored calibration offsets for {len(offsets)} users")
+
+        self.load_assignments()
+        return trained
+
+    def score_frame(self, df):
+        """Score a history frame (with user_id) against the users' cohort models"""
+        if time.time() - self._loaded_at > self.refresh_interval:
+            self.load_assignments()
+        return score_cohort_frame(df, self.assignments, self.load_cohort_model)
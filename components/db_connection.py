@@ -1,22 +1,371 @@
 """Database Connection Module
 Contributors:
 Priyanshu Patel: Led the development and integration of the end-to-end system. Integrated PostgreSQL for real-time persistence, and built the Docker-based orchestration system.
+
+Single place for PostgreSQL connection settings and connections. Settings come
+from the same DB_* environment variables the frontend uses. Every module gets
+its connections from the process-wide pool returned by get_pool(); one-off
+scripts can use connect(), which retries with exponential backoff while the
+database is starting up. The hot INSERT/UPSERT statements of the detectors are
+prepared once per connection and run with execute_prepared().
+get_data_chunks() streams the frauds table in constant memory.
 """
 
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
 import pandas as pd
 import psycopg2
+from psycopg2 import extensions, sql
+
+DB_CONFIG = {
+    "dbname": os.environ.get("DB_NAME", "anomalies"),
+    "user": os.environ.get("DB_USER", "user"),
+    "password": os.environ.get("DB_PASSWORD", "pass"),
+    "host": os.environ.get("DB_HOST", "localhost"),
+    "port": os.environ.get("DB_PORT", "5432"),
+    "connect_timeout": int(os.environ.get("DB_CONNECT_TIMEOUT", 10)),
+}
+DB_CONNECT_RETRIES = int(os.environ.get("DB_CONNECT_RETRIES", 5))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", 10))
+
+# Statements run for (almost) every transaction; prepared per connection so
+# the server parses and plans them once. FRAUD_UPSERT returns whether the row
+# was newly inserted (rather than updated), which the rollups rely on.
+HISTORY_INSERT = """
+    INSERT INTO transaction_history (
+        transaction_id, user_id, amount, currency, location, timestamp,
+        transaction_type, merchant_category, payment_method, device_type,
+        is_anomalous
+    )
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (transaction_id, timestamp) DO NOTHING
+"""
 
-def get_data():
-    conn = psycopg2.connect(
-        dbname="anomalies",
-        user="user",
-        password="pass",
-        host="localhost",
-        port="5432"
+ACTIVITY_INCREMENT = """
+    INSERT INTO user_activity (user_id, transaction_count, since_last_fit, last_seen)
+    VALUES (%s, 1, 1, %s)
+    ON CONFLICT (user_id) DO UPDATE SET
+        transaction_count = user_activity.transaction_count + 1,
+        since_last_fit = user_activity.since_last_fit + 1,
+        last_seen = GREATEST(user_activity.last_seen, EXCLUDED.last_seen)
+"""
+
+FRAUD_UPSERT = """
+    INSERT INTO frauds (
+        transaction_id, user_id, amount, currency, location, timestamp,
+        transaction_type, merchant_id, merchant_name, merchant_category,
+        payment_method, device_type, ip_address, detection_score, risk_level,
+        detection_features, model_used
     )
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (transaction_id, timestamp) DO UPDATE SET
+        detection_score = EXCLUDED.detection_score,
+        risk_level = EXCLUDED.risk_level,
+        detection_features = EXCLUDED.detection_features,
+        detection_time = NOW(),
+        model_used = EXCLUDED.model_used
+    RETURNING (xmax = 0) AS inserted
+"""
+
+STATS_INCREMENT = """
+    UPDATE processing_stats
+    SET count_value = count_value + %s,
+        last_updated_timestamp = NOW()
+    WHERE counter_name = 'total_transactions_processed'
+"""
+
+PREPARED_STATEMENTS = {
+    "insert_history": HISTORY_INSERT,
+    "increment_activity": ACTIVITY_INCREMENT,
+    "upsert_fraud": FRAUD_UPSERT,
+    "increment_processed": STATS_INCREMENT,
+}
+
+def conninfo(**overrides):
+    """Return the settings as a libpq connection string (for psycopg 3)"""
+    params = dict(DB_CONFIG, **overrides)
+    return " ".join(f"{key}={value}" for key, value in params.items())
+
+def connect(retries=None, backoff=1.0, max_backoff=30.0, autocommit=False, **overrides):
+    """Open a new connection, retrying with exponential backoff
+
+    Raises the last psycopg2.OperationalError once all retries have failed.
+    """
+    retries = DB_CONNECT_RETRIES if retries is None else retries
+    params = dict(DB_CONFIG, **overrides)
+    attempt = 0
+    while True:
+        try:
+            conn = psycopg2.connect(**params)
+            conn.set_session(autocommit=autocommit)
+            return conn
+        except psycopg2.OperationalError as e:
+            if attempt >= retries:
+                raise
+            delay = min(backoff * 2 ** attempt, max_backoff)
+            attempt += 1
+            print(f"Database connection failed (attempt {attempt}/{retries + 1}): {e}")
+            print(f"Retrying in {delay:.0f} seconds...")
+            time.sleep(delay)
+
+def _positional(sql):
+    """Turn %s placeholders into PREPARE's $1, $2, ..."""
+    parts = sql.split("%s")
+    return "".join(part + (f"${i + 1}" if i < len(parts) - 1 else "") for i, part in enumerate(parts))
+
+# connection -> names of the statements prepared in its session. psycopg2
+# connections don't take new attributes, so this is kept beside them and
+# forgotten along with the connection.
+_prepared = weakref.WeakKeyDictionary()
+
+def execute_prepared(cursor, name, params=()):
+    """Execute one of PREPARED_STATEMENTS, preparing it on first use
+
+    Prepared statements live as long as the server session, so the set of
+    statements already prepared is remembered per connection.
+    """
+    prepared = _prepared.setdefault(cursor.connection, set())
+    if name not in prepared:
+        cursor.execute(f"PREPARE {name} AS {_positional(PREPARED_STATEMENTS[name])}")
+        prepared.add(name)
+    if params:
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cursor.execute(f"EXECUTE {name}")
+
+def is_healthy(conn):
+    """Check a connection with a round-trip, leaving it idle"""
+    if conn.closed:
+        return False
     try:
-        df = pd.read_sql("SELECT * FROM frauds ORDER BY timestamp DESC", conn)
-        df["datetime"] = pd.to_datetime(df["timestamp"], unit="s")
-        return df
-    finally:
-        conn.close()
+        if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections
+
+    At most maxconn connections are checked out at once; getconn() blocks
+    until one is returned. Connections that sat idle for longer than
+    check_idle_after seconds are health-checked on checkout and replaced if
+    they no longer work.
+    """
+
+    def __init__(self, minconn=1, maxconn=DB_POOL_MAX, check_idle_after=30.0, **overrides):
+        self.maxconn = maxconn
+        self.check_idle_after = check_idle_after
+        self.overrides = overrides
+        self._idle = []  # (connection, returned at)
+        self._checked_out = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        for _ in range(minconn):
+            self._idle.append((connect(**overrides), time.time()))
+
+    def getconn(self, timeout=None):
+        with self._cond:
+            if self._closed:
+                raise psycopg2.InterfaceError("connection pool is closed")
+            if not self._cond.wait_for(lambda: self._idle or self._checked_out < self.maxconn, timeout):
+                raise psycopg2.OperationalError(f"no free connection after {timeout}s")
+            self._checked_out += 1
+            conn, returned_at = self._idle.pop() if self._idle else (None, None)
+
+        try:
+            if conn is not None and (conn.closed or (
+                    time.time() - returned_at > self.check_idle_after and not is_healthy(conn))):
+                self._discard(conn)
+                conn = None
+            return conn if conn is not None else connect(**self.overrides)
+        except Exception:
+            self._release_slot()
+            raise
+
+    def putconn(self, conn, close=False):
+        """Return a connection; open transactions are rolled back"""
+        if not close and not conn.closed and not self._closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                close = True
+        if close or conn.closed or self._closed:
+            self._discard(conn)
+            self._release_slot()
+            return
+        with self._cond:
+            self._idle.append((conn, time.time()))
+            self._checked_out -= 1
+            self._cond.notify()
+
+    def check(self, conn):
+        """Return conn if it still works, otherwise a fresh connection in its place
+
+        Keeps the same pool slot, so callers holding a connection for their
+        whole lifetime (the detectors) can call this after database errors.
+        """
+        if is_healthy(conn):
+            return conn
+        print("Database connection lost, reconnecting...")
+        self._discard(conn)
+        return connect(**self.overrides)
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def _release_slot(self):
+        with self._cond:
+            self._checked_out -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            if not conn.closed:
+                conn.close()
+        except psycopg2.Error:
+            pass
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+# Pools inherited across fork are kept referenced but never used or closed:
+# closing them would end the parent's sessions
+_inherited_pools = []
+
+def get_pool():
+    """Return the process-wide connection pool, creating it on first use
+
+    A forked child gets its own pool instead of sharing the parent's sockets.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            if _pool is not None:
+                _inherited_pools.append(_pool)
+            _pool = ConnectionPool(minconn=0)
+            _pool_pid = os.getpid()
+        return _pool
+
+# Columns of the frauds table that can be selected and filtered on
+FRAUD_COLUMNS = [
+    "transaction_id", "user_id", "amount", "currency", "location", "timestamp",
+    "transaction_type", "merchant_id", "merchant_name", "merchant_category",
+    "payment_method", "device_type", "ip_address", "is_confirmed_fraud",
+    "detection_score", "risk_level", "detection_time", "detection_features",
+    "notes", "model_used",
+]
+JSON_COLUMNS = {"detection_features"}
+
+def _epoch(value):
+    """Accept epoch seconds, datetimes or date strings for time filters"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    return pd.Timestamp(value).timestamp()
+
+def _fraud_query(start_time=None, end_time=None, user_ids=None, min_score=None,
+                 max_score=None, columns=None, json_as_text=False):
+    columns = list(columns or FRAUD_COLUMNS)
+    unknown = [c for c in columns if c not in FRAUD_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown frauds columns: {unknown}")
+
+    select = [
+        sql.SQL("{}::text AS {}").format(sql.Identifier(c), sql.Identifier(c))
+        if json_as_text and c in JSON_COLUMNS else sql.Identifier(c)
+        for c in columns
+    ]
+    conditions, params = [], []
+    if start_time is not None:
+        conditions.append(sql.SQL("timestamp >= %s"))
+        params.append(_epoch(start_time))
+    if end_time is not None:
+        conditions.append(sql.SQL("timestamp < %s"))
+        params.append(_epoch(end_time))
+    if user_ids is not None:
+        conditions.append(sql.SQL("user_id = ANY(%s)"))
+        params.append([int(u) for u in user_ids])
+    if min_score is not None:
+        conditions.append(sql.SQL("detection_score >= %s"))
+        params.append(float(min_score))
+    if max_score is not None:
+        conditions.append(sql.SQL("detection_score <= %s"))
+        params.append(float(max_score))
+
+    query = sql.SQL("SELECT {} FROM frauds").format(sql.SQL(", ").join(select))
+    if conditions:
+        query += sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conditions)
+    query += sql.SQL(" ORDER BY timestamp DESC")
+    return query, params, columns
+
+def get_data_chunks(start_time=None, end_time=None, user_ids=None, min_score=None,
+                    max_score=None, columns=None, chunk_size=10000, as_arrow=False):
+    """Stream the frauds table, newest first, in chunks of chunk_size rows
+
+    Filters and the column projection are applied in SQL, and rows come from
+    a named (server-side) cursor, so memory use doesn't depend on table size.
+    start_time/end_time take epoch seconds or anything pd.Timestamp accepts.
+    Yields pandas DataFrames (with a datetime column when timestamp is
+    selected), or pyarrow RecordBatches with as_arrow=True, in which case
+    JSON columns are returned as text.
+    """
+    if as_arrow:
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("as_arrow=True requires pyarrow (pip install pyarrow)")
+
+    query, params, columns = _fraud_query(start_time, end_time, user_ids, min_score,
+                                          max_score, columns, json_as_text=as_arrow)
+    with get_pool().connection() as conn:
+        cursor = conn.cursor(name="fraud_data_stream")
+        cursor.itersize = chunk_size
+        try:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                df = pd.DataFrame(rows, columns=columns)
+                if as_arrow:
+                    yield pa.RecordBatch.from_pandas(df, preserve_index=False)
+                    continue
+                if "timestamp" in df.columns:
+                    df["datetime"] = pd.to_datetime(df["timestamp"], unit="s")
+                yield df
+        finally:
+            cursor.close()
+
+def get_data(**filters):
+    """Load the (filtered) frauds table into one DataFrame
+
+    Accepts the same filters as get_data_chunks; prefer iterating over
+    get_data_chunks for large tables.
+    """
+    chunks = list(get_data_chunks(**filters))
+    if not chunks:
+        columns = list(filters.get("columns") or FRAUD_COLUMNS)
+        return pd.DataFrame(columns=columns + (["datetime"] if "timestamp" in columns else []))
+    return pd.concat(chunks, ignore_index=True)
@@ -0,0 +1,172 @@
+"""Dead Letter Module
+
+Per-record validation for the detectors' decode stage. A message that can't
+be decoded or is missing what scoring needs (a numeric amount and timestamp,
+a user id, dict-shaped merchant and device info) is set aside in a
+dead-letter queue together with the error, and the rest of the batch carries
+on.
+
+Dead letters go to the Kafka topic in DLQ_TOPIC when it is set, otherwise
+they are appended as JSON lines to DLQ_FILE (default
+dead_letters/transactions.jsonl). The detectors count them in
+processing_stats under 'dead_lettered_transactions'.
+"""
+
+import base64
+import json
+import math
+import os
+import time
+
+from components.wire import decode
+
+DLQ_FILE = os.environ.get(
+    "DLQ_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dead_letters", "transactions.jsonl")
+)
+
+DEAD_LETTER_INCREMENT = """
+    INSERT INTO processing_stats (counter_name, count_value, last_updated_timestamp)
+    VALUES ('dead_lettered_transactions', %s, NOW())
+    ON CONFLICT (counter_name) DO UPDATE
+    SET count_value = processing_stats.count_value + EXCLUDED.count_value,
+        last_updated_timestamp = NOW()
+"""
+
+class InvalidRecord(ValueError):
+    """A message that can't be scored; reason is a short category for metrics"""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+def _number(txn, key):
+    value = txn.get(key)
+    if isinstance(value, bool) or value is None:
+        raise InvalidRecord(f"bad_{key}", f"{key} is missing or not a number: {value!r}")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise InvalidRecord(f"bad_{key}", f"{key} is not a number: {value!r}")
+    if not math.isfinite(number):
+        raise InvalidRecord(f"bad_{key}", f"{key} is not finite: {value!r}")
+    return number
+
+def validate_transaction(txn):
+    """Check (and normalise in place) a decoded transaction
+
+    Numeric strings are accepted for user_id, amount and timestamp and
+    converted. Raises InvalidRecord for anything the detectors can't score.
+    """
+    if not isinstance(txn, dict):
+        raise InvalidRecord("not_an_object", f"message is a {type(txn).__name__}, not an object")
+
+    user_id = txn.get("user_id")
+    try:
+        if isinstance(user_id, bool) or int(user_id) != float(user_id) or int(user_id) <= 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        raise InvalidRecord("bad_user_id", f"user_id is missing or not a positive integer: {user_id!r}")
+    txn["user_id"] = int(user_id)
+
+    txn["amount"] = _number(txn, "amount")
+    timestamp = _number(txn, "timestamp")
+    # Milliseconds or nonsense rather than epoch seconds
+    if not 0 < timestamp < 1e10:
+        raise InvalidRecord("bad_timestamp", f"timestamp is not epoch seconds: {timestamp!r}")
+    txn["timestamp"] = timestamp
+
+    for key in ("merchant", "device_info"):
+        if key in txn and not isinstance(txn[key], dict):
+            raise InvalidRecord(f"bad_{key}", f"{key} is not an object: {txn[key]!r}")
+    for key in ("transaction_id", "location", "currency", "transaction_type", "payment_method"):
+        value = txn.get(key)
+        if value is not None and not isinstance(value, str):
+            raise InvalidRecord(f"bad_{key}", f"{key} is not a string: {value!r}")
+    return txn
+
+def parse_message(value):
+    """Decode and validate a raw message value, raising InvalidRecord"""
+    try:
+        txn = decode(value)
+    except Exception as e:
+        raise InvalidRecord("undecodable", f"could not decode message: {e}")
+    return validate_transaction(txn)
+
+class DeadLetterQueue:
+    """Writes rejected messages to a Kafka topic or a JSON-lines file and
+    keeps counts per reason"""
+
+    def __init__(self, topic=None, path=DLQ_FILE, bootstrap_servers="localhost:9092"):
+        self.topic = topic or None
+        self.path = path
+        self.producer = None
+        if self.topic:
+            from kafka import KafkaProducer
+            self.producer = KafkaProducer(
+                bootstrap_servers=bootstrap_servers,
+                value_serializer=lambda record: json.dumps(record).encode("utf-8"),
+            )
+        self.counts = {}
+        self.total = 0
+        self._unreported = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(topic=os.environ.get("DLQ_TOPIC"))
+
+    def record(self, msg, error):
+        """Dead-letter a consumed Kafka message with the error that rejected
+        it; returns False if the dead letter couldn't be written"""
+        reason = getattr(error, "reason", "invalid")
+        value = msg.value
+        if isinstance(value, bytes):
+            try:
+                value = value.decode("utf-8")
+                encoding = "text"
+            except UnicodeDecodeError:
+                value = base64.b64encode(value).decode("ascii")
+                encoding = "base64"
+        else:
+            encoding = "json"
+        record = {
+            "topic": msg.topic,
+            "partition": msg.partition,
+            "offset": msg.offset,
+            "key": msg.key.decode("utf-8", "replace") if isinstance(msg.key, bytes) else msg.key,
+            "value": value,
+            "value_encoding": encoding,
+            "reason": reason,
+            "error": str(error),
+            "dead_lettered_at": time.time(),
+        }
+        self.counts[reason] = self.counts.get(reason, 0) + 1
+        self.total += 1
+        self._unreported += 1
+        print(f"Dead-lettered message at {msg.topic}[{msg.partition}]@{msg.offset}: {error}")
+
+        try:
+            if self.producer is not None:
+                key = msg.key if isinstance(msg.key, bytes) else None
+                # Wait for the ack: the message's offset is committed next
+                self.producer.send(self.topic, record, key=key).get(timeout=10)
+            else:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+            return True
+        except Exception as e:
+            print(f"Failed to write dead letter: {e}")
+            return False
+
+    def report(self, cursor):
+        """Add the dead letters since the last report to processing_stats
+        (caller commits)"""
+        if self._unreported:
+            cursor.execute(DEAD_LETTER_INCREMENT, (self._unreported,))
+            self._unreported = 0
+
+    def close(self):
+        if self.producer is not None:
+            self.producer.flush()
+            self.producer.close()
@@ -0,0 +1,207 @@
+"""Dedupe Module
+
+Suppresses redelivered transactions (after rebalances, restarts or producer
+retries) before they are stored, featurized and scored again. Seen
+transaction ids go into a rotating pair of Bloom filters:
+
+  - generations are aligned to wall-clock slots of half the window, so an id
+    is remembered for between half a window and a whole window
+  - memory is bounded by the capacity per generation, whatever the traffic;
+    past it the false-positive rate climbs, which shows up as the fill
+    ratio on /health
+
+An id only goes into the filters once its batch has been committed to the
+database (confirm()); until then it is pending, which still suppresses
+copies within the same batch. A batch that fails is release()d, so its
+redelivery is processed rather than dropped as a duplicate, and checkpoints
+never contain ids whose transactions weren't stored.
+
+At checkpoints the filters are OR-ed into seen_transaction_filters in
+Postgres, one row per consumer group and generation, and read back on startup and after
+rebalances. Since every detector in the group merges into the same rows, a
+detector that takes over partitions also knows the ids their previous owner
+processed.
+
+A false positive drops a transaction that was never seen, at the configured
+error rate (0.1% by default).
+"""
+
+import hashlib
+import math
+import time
+
+import numpy as np
+
+DUPLICATE_INCREMENT = """
+    INSERT INTO processing_stats (counter_name, count_value, last_updated_timestamp)
+    VALUES ('duplicate_transactions_suppressed', %s, NOW())
+    ON CONFLICT (counter_name) DO UPDATE
+    SET count_value = processing_stats.count_value + EXCLUDED.count_value,
+        last_updated_timestamp = NOW()
+"""
+
+class BloomFilter:
+    """A Bloom filter over byte strings using double hashing of a blake2b digest"""
+
+    def __init__(self, num_bits, num_hashes, bits=None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bytearray(bits) if bits is not None else bytearray((num_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate):
+        num_bits = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return cls(num_bits, num_hashes)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key, digest_size=8).digest()
+        m = self.num_bits
+        h1 = int.from_bytes(digest[:4], "little") % m
+        h2 = (int.from_bytes(digest[4:], "little") | 1) % m
+        return [(h1 + i * h2) % m for i in range(self.num_hashes)]
+
+    def add(self, key, positions=None):
+        bits = self.bits
+        for p in positions or self._positions(key):
+            bits[p >> 3] |= 1 << (p & 7)
+
+    def contains(self, key, positions=None):
+        """Membership test; positions from _positions() can be passed to
+        reuse one hash across filters of the same size"""
+        bits = self.bits
+        for p in positions or self._positions(key):
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    __contains__ = contains
+
+    def merge(self, other_bits):
+        """OR another filter's bits (same size and hashes) into this one"""
+        ours = np.frombuffer(self.bits, dtype=np.uint8)
+        np.bitwise_or(ours, np.frombuffer(other_bits, dtype=np.uint8), out=ours)
+
+    def fill_ratio(self):
+        return int(np.unpackbits(np.frombuffer(self.bits, dtype=np.uint8)).sum()) / self.num_bits
+
+class SeenFilter:
+    """Time-windowed set of seen transaction ids"""
+
+    def __init__(self, name, window_seconds=3600, capacity=1_000_000, error_rate=0.001):
+        """name identifies the stored filters, normally the consumer group"""
+        self.name = name
+        self.slot_seconds = max(1, window_seconds // 2)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        # generation number -> BloomFilter; at most the current and previous
+        self.generations = {}
+        # key -> (filter shape, Bloom positions) of ids in batches not yet
+        # committed
+        self.pending = {}
+        self.suppressed = 0
+        self._unreported = 0
+        self.last_checkpoint = time.time()
+
+    def _current(self, now=None):
+        generation = int((time.time() if now is None else now) // self.slot_seconds)
+        if generation not in self.generations:
+            self.generations[generation] = BloomFilter.for_capacity(self.capacity, self.error_rate)
+            for old in [g for g in self.generations if g < generation - 1]:
+                del self.generations[old]
+        return generation
+
+    def check_and_add(self, transaction_id):
+        """True if transaction_id was seen within the window or is pending
+        in an uncommitted batch (counted as a suppressed duplicate);
+        otherwise hold it as pending and return False"""
+        if not transaction_id:
+            return False
+        key = str(transaction_id).encode("utf-8")
+        if key in self.pending:
+            self.suppressed += 1
+            self._unreported += 1
+            return True
+        newest = self.generations[self._current()]
+        positions = newest._positions(key)
+        for bloom in self.generations.values():
+            same_shape = (bloom.num_bits, bloom.num_hashes) == (newest.num_bits, newest.num_hashes)
+            if bloom.contains(key, positions if same_shape else None):
+                self.suppressed += 1
+                self._unreported += 1
+                return True
+        self.pending[key] = ((newest.num_bits, newest.num_hashes), positions)
+        return False
+
+    def confirm(self, transaction_ids):
+        """Remember the pending ids of a batch that has been committed"""
+        newest = self.generations[self._current()]
+        for transaction_id in transaction_ids:
+            if transaction_id:
+                key = str(transaction_id).encode("utf-8")
+                shape, positions = self.pending.pop(key, (None, None))
+                newest.add(key, positions if shape == (newest.num_bits, newest.num_hashes) else None)
+
+    def release(self, transaction_ids):
+        """Forget the pending ids of a batch that wasn't persisted, so its
+        redelivery is processed"""
+        for transaction_id in transaction_ids:
+            if transaction_id:
+                self.pending.pop(str(transaction_id).encode("utf-8"), None)
+
+    def fill_ratio(self):
+        return self.generations[self._current()].fill_ratio()
+
+    def create_table(self, cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS seen_transaction_filters (
+                name TEXT NOT NULL,
+                generation BIGINT NOT NULL,
+                slot_seconds INT NOT NULL,
+                num_bits BIGINT NOT NULL,
+                num_hashes INT NOT NULL,
+                bits BYTEA NOT NULL,
+                updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+                PRIMARY KEY (name, generation)
+            )
+        """)
+
+    def _merge_stored(self, cursor, lock=False):
+        current = self._current()
+        cursor.execute(f"""
+            SELECT generation, slot_seconds, num_bits, num_hashes, bits
+            FROM seen_transaction_filters
+            WHERE name = %s AND generation >= %s
+            {'FOR UPDATE' if lock else ''}
+        """, (self.name, current - 1))
+        for generation, slot_seconds, num_bits, num_hashes, bits in cursor.fetchall():
+            if slot_seconds != self.slot_seconds:
+                continue
+            bloom = self.generations.get(generation)
+            if bloom is None:
+                bloom = self.generations[generation] = BloomFilter(num_bits, num_hashes)
+            if (bloom.num_bits, bloom.num_hashes) == (num_bits, num_hashes):
+                bloom.merge(bytes(bits))
+
+    def restore(self, cursor):
+        """Merge the stored filters into this one (caller commits)"""
+        self._merge_stored(cursor)
+
+    def checkpoint(self, cursor):
+        """Merge with the stored filters, store the union and add the
+        suppressed count to processing_stats (caller commits)"""
+        self._merge_stored(cursor, lock=True)
+        for generation, bloom in self.generations.items():
+            cursor.execute("""
+                INSERT INTO seen_transaction_filters (name, generation, slot_seconds, num_bits, num_hashes, bits, updated_at)
+                VALUES (%s, %s, %s, %s, %s, %s, NOW())
+                ON CONFLICT (name, generation) DO UPDATE
+                SET slot_seconds = EXCLUDED.slot_seconds, num_bits = EXCLUDED.num_bits,
+                    num_hashes = EXCLUDED.num_hashes, bits = EXCLUDED.bits, updated_at = NOW()
+            """, (self.name, generation, self.slot_seconds, bloom.num_bits, bloom.num_hashes, bytes(bloom.bits)))
+        cursor.execute("DELETE FROM seen_transaction_filters WHERE name = %s AND generation < %s",
+                       (self.name, self._current() - 1))
+        if self._unreported:
+            cursor.execute(DUPLICATE_INCREMENT, (self._unreported,))
+            self._unreported = 0
+        self.last_checkpoint = time.time()
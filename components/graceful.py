@@ -0,0 +1,139 @@
+"""Graceful Shutdown Module
+
+Lets a detector drain on SIGTERM/SIGINT instead of dying mid-batch:
+
+  - the signal only sets a flag; poll_messages() stops handing out messages
+    and yields a final None so the loop scores and persists its partial batch
+  - offsets are committed manually (enable_auto_commit=False) and only for
+    messages whose batch has been persisted, so anything not yet processed
+    is redelivered to the next consumer
+  - if draining takes longer than the deadline the process exits anyway;
+    a second signal exits straight away
+"""
+
+import os
+import signal
+
+from kafka import ConsumerRebalanceListener
+from kafka.structs import OffsetAndMetadata, TopicPartition
+
+class GracefulShutdown:
+    """Turns SIGTERM/SIGINT into a drain request with a hard deadline"""
+
+    def __init__(self, deadline_seconds=20):
+        self.deadline_seconds = deadline_seconds
+        self.requested = False
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._handle)
+        signal.signal(signal.SIGALRM, self._expired)
+
+    def _handle(self, signum, frame):
+        if self.requested:
+            print("Second shutdown signal, exiting without draining")
+            os._exit(1)
+        self.requested = True
+        print(f"Received {signal.Signals(signum).name}, draining "
+              f"(deadline {self.deadline_seconds:.0f}s)...")
+        if self.deadline_seconds:
+            signal.setitimer(signal.ITIMER_REAL, self.deadline_seconds)
+
+    def _expired(self, signum, frame):
+        print(f"Drain did not finish within {self.deadline_seconds:.0f}s, exiting")
+        os._exit(1)
+
+    def finish(self):
+        """Cancel the deadline once the drain has completed"""
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+def poll_messages(consumer, shutdown, timeout_ms=1000, on_poll=None):
+    """Yield consumed messages until a shutdown is requested, then None once
+
+    Polling with a timeout (instead of iterating the consumer) also lets
+    on_poll run, e.g. a health heartbeat, while the topic is idle.
+    """
+    while not shutdown.requested:
+        records = consumer.poll(timeout_ms=timeout_ms)
+        if on_poll is not None:
+            on_poll()
+        for messages in records.values():
+            for msg in messages:
+                if shutdown.requested:
+                    break
+                yield msg
+    yield None
+
+class OffsetTracker(ConsumerRebalanceListener):
+    """Offsets to commit per partition, advanced only past persisted batches
+
+    track() notes each consumed message and take() hands over the offsets
+    of the batch being cut. Once that batch is in the database, persisted()
+    makes them committable. If it can't be persisted, failed() holds its
+    partitions at the batch's first offset: later batches on them are no
+    longer committed past it, so it is redelivered after a restart or
+    rebalance, and the hold lifts once it has been persisted.
+
+    It doubles as the rebalance listener of a consumer that has no other:
+    revoked partitions are forgotten, since whoever consumes them next
+    starts from their committed offsets.
+    """
+
+    def __init__(self):
+        # partition -> (first offset, next offset) since the last take()
+        self.pending = {}
+        # partition -> next offset to commit
+        self.offsets = {}
+        # partition -> first offset of a batch that couldn't be persisted
+        self.held = {}
+
+    def track(self, msg):
+        tp = TopicPartition(msg.topic, msg.partition)
+        first, _ = self.pending.get(tp, (msg.offset, None))
+        self.pending[tp] = (min(first, msg.offset), msg.offset + 1)
+
+    def take(self):
+        """The offsets of the messages tracked since the last take()"""
+        batch, self.pending = self.pending, {}
+        return batch
+
+    def persisted(self, batch):
+        """Make a batch's offsets committable once it is in the database"""
+        for tp, (first, next_offset) in batch.items():
+            held = self.held.get(tp)
+            if held is not None:
+                if held < first:
+                    continue
+                if held < next_offset:
+                    del self.held[tp]
+            self.offsets[tp] = max(next_offset, self.offsets.get(tp, 0))
+
+    def failed(self, batch):
+        """Hold the batch's partitions at its first offsets"""
+        for tp, (first, _) in batch.items():
+            self.held[tp] = min(first, self.held.get(tp, first))
+
+    def forget(self, partitions):
+        """Drop everything tracked for the given TopicPartitions"""
+        for tp in partitions:
+            self.pending.pop(tp, None)
+            self.offsets.pop(tp, None)
+            self.held.pop(tp, None)
+
+    def on_partitions_revoked(self, revoked):
+        self.forget(revoked)
+
+    def on_partitions_assigned(self, assigned):
+        pass
+
+    def commit(self, consumer):
+        """Commit the persisted offsets; returns False if the commit failed
+        (e.g. the partitions were reassigned, so they'll be redelivered)"""
+        if not self.offsets:
+            return True
+        try:
+            consumer.commit({tp: OffsetAndMetadata(offset, None, -1) for tp, offset in self.offsets.items()})
+            self.offsets = {}
+            return True
+        except Exception as e:
+            print(f"Failed to commit offsets: {e}")
+            self.offsets = {}
+            return False
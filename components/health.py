@@ -0,0 +1,90 @@
+"""Health Endpoint Module
+
+Small HTTP server that runs in a background thread and exposes a detector's
+liveness and readiness:
+
+  GET /health  200 while the process is alive and its loop keeps beating
+  GET /ready   200 once start-up warm-up has finished, 503 before
+
+Both return a JSON body with the current status and any published stats.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class HealthServer:
+    """Background HTTP server reporting liveness and readiness"""
+
+    def __init__(self, port, host="0.0.0.0", max_heartbeat_age=None):
+        """max_heartbeat_age (seconds) makes /health fail when the main loop
+        hasn't called heartbeat() for that long; None disables the check."""
+        self.port = port
+        self.host = host
+        self.max_heartbeat_age = max_heartbeat_age
+        self.ready = False
+        self.started_at = time.time()
+        self.last_heartbeat = time.time()
+        self.stats = {}
+        self._server = None
+
+    def set_ready(self, ready=True):
+        self.ready = ready
+
+    def heartbeat(self):
+        self.last_heartbeat = time.time()
+
+    def update_stats(self, **stats):
+        self.stats.update(stats)
+
+    def status(self):
+        heartbeat_age = time.time() - self.last_heartbeat
+        alive = self.max_heartbeat_age is None or heartbeat_age <= self.max_heartbeat_age
+        return {
+            "alive": alive,
+            "ready": self.ready,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "heartbeat_age_seconds": round(heartbeat_age, 1),
+            "stats": dict(self.stats),
+        }
+
+    def start(self):
+        """Start serving; returns False if the port can't be bound"""
+        health = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status = health.status()
+                if self.path.startswith("/health"):
+                    ok = status["alive"]
+                elif self.path.startswith("/ready"):
+                    ok = status["alive"] and status["ready"]
+                else:
+                    self.send_error(404)
+                    return
+                body = json.dumps(status).encode("utf-8")
+                self.send_response(200 if ok else 503)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            print(f"Health endpoint disabled, could not bind port {self.port}: {e}")
+            return False
+
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="health-server", daemon=True).start()
+        print(f"Health endpoint listening on http://{self.host}:{self.port}/health")
+        return True
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
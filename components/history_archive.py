@@ -0,0 +1,226 @@
+"""History Archive Module
+
+Columnar copy of transaction_history as Parquet files, so model training and
+analytics can read history locally instead of querying the live database.
+
+Files are hive-partitioned by transaction date (UTC) and user bucket
+(user_id % USER_BUCKETS):
+
+  <archive>/date=2024-05-01/user_bucket=7/part-<run>-0.parquet
+
+export() appends the rows inserted since the last run (tracked by created_at
+in _state.json). Each run is noted in the state before it writes, so the
+files of a run that dies before saving its watermark are removed by the next
+run, which exports those rows again, rather than archived twice.
+
+The read functions push user, time and column filters down into the Parquet
+scan, so only the matching partitions and row groups are read. Requires
+pyarrow.
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from components.user_profile_manager import HISTORY_COLUMNS
+
+ARCHIVE_DIR = os.environ.get(
+    "HISTORY_ARCHIVE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "archive", "transaction_history")
+)
+USER_BUCKETS = 16
+
+ARCHIVE_COLUMNS = [
+    "transaction_id", "user_id", "amount", "currency", "location", "timestamp",
+    "transaction_type", "merchant_category", "payment_method", "device_type",
+    "is_anomalous",
+]
+
+# Rows committed by transactions that started before an export can carry a
+# created_at older than the export's cut-off, so each run stops this many
+# seconds short of NOW()
+EXPORT_LAG_SECONDS = 60
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+    except ImportError:
+        raise ImportError("The history archive requires pyarrow (pip install pyarrow)")
+    return pa, ds
+
+def _epoch(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    return pd.Timestamp(value).timestamp()
+
+class HistoryArchive:
+    """Partitioned Parquet archive of transaction_history"""
+
+    def __init__(self, path=ARCHIVE_DIR, buckets=USER_BUCKETS):
+        self.path = os.path.abspath(path)
+        self.buckets = buckets
+        self.state_path = os.path.join(self.path, "_state.json")
+
+    def _partitioning(self):
+        pa, ds = _pyarrow()
+        return ds.partitioning(
+            pa.schema([("date", pa.string()), ("user_bucket", pa.int32())]), flavor="hive"
+        )
+
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                return json.load(f)
+        return {"exported_until": None, "rows": 0}
+
+    def _save_state(self, state):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _remove_run(self, run_id):
+        """Delete the files written by an export run"""
+        prefix = f"part-{run_id}-"
+        removed = 0
+        for directory, _, files in os.walk(self.path):
+            for name in files:
+                if name.startswith(prefix):
+                    os.remove(os.path.join(directory, name))
+                    removed += 1
+        return removed
+
+    def exists(self):
+        return os.path.isdir(self.path) and any(
+            name.startswith("date=") for name in os.listdir(self.path)
+        )
+
+    def export(self, conn, chunk_size=100000):
+        """Append history rows inserted since the previous export
+
+        Rows are streamed from a named cursor and written chunk by chunk, so
+        the first (full) export doesn't need the table in memory. Returns the
+        number of rows written.
+        """
+        pa, ds = _pyarrow()
+        os.makedirs(self.path, exist_ok=True)
+        state = self._load_state()
+
+        cursor = conn.cursor()
+        cursor.execute("SELECT EXTRACT(EPOCH FROM NOW()) - %s", (EXPORT_LAG_SECONDS,))
+        until = float(cursor.fetchone()[0])
+        since = state["exported_until"]
+
+        conditions = ["created_at <= to_timestamp(%s)"]
+        params = [until]
+        if since is not None:
+            conditions.append("created_at > to_timestamp(%s)")
+            params.append(since)
+
+        # A run still noted in the state didn't finish: its rows are
+        # exported again below, so its files go
+        unfinished = state.pop("running", None)
+        if unfinished is not None:
+            removed = self._remove_run(unfinished)
+            print(f"Removed {removed} files of unfinished export run {unfinished}")
+        run_id = int(time.time())
+        state["running"] = run_id
+        self._save_state(state)
+
+        stream = conn.cursor(name="history_archive_export")
+        stream.itersize = chunk_size
+        written = 0
+        try:
+            stream.execute(
+                f"SELECT {', '.join(ARCHIVE_COLUMNS)} FROM transaction_history "
+                f"WHERE {' AND '.join(conditions)}",
+                params
+            )
+            part = 0
+            while True:
+                rows = stream.fetchmany(chunk_size)
+                if not rows:
+                    break
+                df = pd.DataFrame(rows, columns=ARCHIVE_COLUMNS)
+                df["user_id"] = df["user_id"].astype(np.int64)
+                df["timestamp"] = df["timestamp"].astype(float)
+                df["date"] = pd.to_datetime(df["timestamp"], unit="s", utc=True).dt.strftime("%Y-%m-%d")
+                df["user_bucket"] = (df["user_id"] % self.buckets).astype(np.int32)
+                ds.write_dataset(
+                    pa.Table.from_pandas(df, preserve_index=False),
+                    self.path,
+                    format="parquet",
+                    partitioning=self._partitioning(),
+                    basename_template=f"part-{run_id}-{part}-{{i}}.parquet",
+                    existing_data_behavior="overwrite_or_ignore",
+                    file_options=ds.ParquetFileFormat().make_write_options(compression="zstd"),
+                )
+                written += len(df)
+                part += 1
+        finally:
+            stream.close()
+            conn.rollback()
+
+        del state["running"]
+        state["exported_until"] = until
+        state["rows"] = state.get("rows", 0) + written
+        self._save_state(state)
+        return written
+
+    def read(self, user_ids=None, start_time=None, end_time=None, columns=None, normal_only=False):
+        """Read archived history as a DataFrame
+
+        user_ids prunes user_bucket partitions and start_time/end_time (epoch
+        seconds or anything pd.Timestamp accepts) prune date partitions; the
+        rest of each filter is applied to Parquet row groups.
+        """
+        pa, ds = _pyarrow()
+        columns = list(columns or ARCHIVE_COLUMNS)
+        if not self.exists():
+            return pd.DataFrame(columns=columns)
+
+        dataset = ds.dataset(self.path, format="parquet", partitioning=self._partitioning())
+        condition = None
+
+        def both(expr):
+            return expr if condition is None else condition & expr
+
+        if user_ids is not None:
+            user_ids = [int(u) for u in user_ids]
+            buckets = sorted({u % self.buckets for u in user_ids})
+            condition = both(ds.field("user_bucket").isin(buckets) & ds.field("user_id").isin(user_ids))
+        if start_time is not None:
+            start = _epoch(start_time)
+            day = pd.Timestamp(start, unit="s", tz="UTC").strftime("%Y-%m-%d")
+            condition = both((ds.field("date") >= day) & (ds.field("timestamp") >= start))
+        if end_time is not None:
+            end = _epoch(end_time)
+            day = pd.Timestamp(end, unit="s", tz="UTC").strftime("%Y-%m-%d")
+            condition = both((ds.field("date") <= day) & (ds.field("timestamp") < end))
+        if normal_only:
+            condition = both(ds.field("is_anomalous") == False)
+
+        return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+    def training_histories(self, user_ids, limit=200):
+        """Latest ``limit`` normal transactions per user, shaped like
+        UserProfileManager.get_training_histories (user_id + HISTORY_COLUMNS)"""
+        df = self.read(
+            user_ids=user_ids,
+            columns=["user_id"] + [c for c in HISTORY_COLUMNS if c in ARCHIVE_COLUMNS],
+            normal_only=True
+        )
+        if df.empty:
+            return pd.DataFrame(columns=['user_id'] + HISTORY_COLUMNS)
+
+        df = df.sort_values(["user_id", "timestamp"], ascending=[True, False])
+        df = df[df.groupby("user_id").cumcount() < limit]
+        times = pd.to_datetime(df["timestamp"], unit="s", utc=True)
+        df["hour_of_day"] = times.dt.hour.astype(float)
+        # Sunday = 0, matching Postgres EXTRACT(DOW)
+        df["day_of_week"] = ((times.dt.dayofweek + 1) % 7).astype(float)
+        return df[['user_id'] + HISTORY_COLUMNS].reset_index(drop=True)
@@ -0,0 +1,332 @@
+"""Table Partitioning Module
+
+transaction_history and frauds are range-partitioned by their timestamp
+column (epoch seconds) into monthly partitions named <table>_yYYYYmMM, plus a
+<table>_default partition for rows outside every month range. Primary keys
+include the partition key, so inserts use ON CONFLICT (transaction_id,
+timestamp); tables created before partitioning get a matching unique index.
+
+create_table() is the single definition of both tables (and their indexes)
+used by the schema setup and the detectors; migrate_indexes() brings the
+indexes of an existing database up to date without blocking writes,
+rebuilding any left INVALID by an interrupted build. create_partitions()
+and expire_partitions() are run periodically by `maintain.py --partitions`
+to keep future months ready and to detach or drop months past the retention
+period.
+"""
+
+import re
+from datetime import datetime, timezone
+
+TABLE_COLUMNS = {
+    "transaction_history": """
+        transaction_id TEXT NOT NULL,
+        user_id INT NOT NULL,
+        amount FLOAT NOT NULL,
+        currency TEXT,
+        location TEXT,
+        timestamp FLOAT NOT NULL,
+        transaction_type TEXT,
+        merchant_category TEXT,
+        payment_method TEXT,
+        device_type TEXT,
+        is_anomalous BOOLEAN DEFAULT FALSE,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    """,
+    "frauds": """
+        transaction_id TEXT NOT NULL,
+        user_id INT,
+        amount FLOAT,
+        currency TEXT,
+        location TEXT,
+        timestamp FLOAT NOT NULL,
+        transaction_type TEXT,
+        merchant_id TEXT,
+        merchant_name TEXT,
+        merchant_category TEXT,
+        payment_method TEXT,
+        device_type TEXT,
+        ip_address TEXT,
+        is_confirmed_fraud BOOLEAN DEFAULT FALSE,
+        detection_score FLOAT,
+        risk_level TEXT,
+        detection_time TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+        detection_features JSONB,
+        notes TEXT,
+        model_used TEXT DEFAULT 'global'
+    """,
+}
+
+# (name, definition) of each table's secondary indexes, matched to the hot
+# queries: per-user "latest N normal transactions" reads for profiles and
+# training, timestamp/created_at ranges on the append-mostly history (BRIN,
+# since rows arrive roughly in time order), and the dashboard's frauds
+# filters on time, user and score
+TABLE_INDEXES = {
+    "transaction_history": [
+        ("idx_txn_history_user_ts", "(user_id, timestamp DESC)"),
+        ("idx_txn_history_user_ts_normal", "(user_id, timestamp DESC) WHERE is_anomalous = FALSE"),
+        ("idx_txn_history_ts_brin", "USING brin (timestamp)"),
+        ("idx_txn_history_created_brin", "USING brin (created_at)"),
+    ],
+    "frauds": [
+        ("idx_frauds_timestamp", "(timestamp DESC)"),
+        ("idx_frauds_user_ts", "(user_id, timestamp DESC)"),
+        ("idx_frauds_score", "(detection_score)"),
+    ],
+}
+
+# Indexes made redundant by TABLE_INDEXES, dropped by migrate_indexes()
+SUPERSEDED_INDEXES = {
+    "transaction_history": ["idx_txn_history_user_id", "idx_txn_history_timestamp"],
+    "frauds": [],
+}
+
+MONTHS_AHEAD = 3
+PARTITION_NAME = re.compile(r"_y(\d{4})m(\d{2})$")
+
+def month_start(value):
+    """First instant (UTC) of the month containing an epoch timestamp or datetime"""
+    if not isinstance(value, datetime):
+        value = datetime.fromtimestamp(float(value), tz=timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+def partition_name(table, month):
+    return f"{table}_y{month.year:04d}m{month.month:02d}"
+
+def is_partitioned(cursor, table):
+    """True/False for an existing table, None if it doesn't exist"""
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return row[0] == "p"
+
+def ensure_conflict_index(cursor, table):
+    """Unique index backing ON CONFLICT (transaction_id, timestamp) on an
+    unpartitioned table"""
+    cursor.execute(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_txn_ts_key ON {table}(transaction_id, timestamp)"
+    )
+
+def create_table(cursor, table, months_ahead=MONTHS_AHEAD, with_indexes=True):
+    """Create a partitioned table with its current and upcoming partitions
+
+    An existing unpartitioned table is left as it is (see
+    migrate_to_partitioned) apart from getting the conflict index.
+    Indexes are only built here on a new or empty table, where the build
+    is instant; on a table with rows it would block writes, so missing
+    ones are reported and left to migrate_indexes().
+    """
+    partitioned = is_partitioned(cursor, table)
+    if partitioned is False:
+        ensure_conflict_index(cursor, table)
+    else:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                {TABLE_COLUMNS[table].strip()},
+                PRIMARY KEY (transaction_id, timestamp)
+            ) PARTITION BY RANGE (timestamp)
+        """)
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT")
+        create_partitions(cursor, table, months_ahead)
+    if with_indexes:
+        if partitioned is None or is_empty(cursor, table):
+            create_indexes(cursor, table)
+        else:
+            missing = missing_indexes(cursor, table)
+            if missing:
+                print(f"{table}: missing or invalid indexes {', '.join(missing)}; "
+                      f"build them with `python scripts/maintain.py --indexes`")
+
+def is_empty(cursor, table):
+    cursor.execute(f"SELECT NOT EXISTS (SELECT 1 FROM {table})")
+    return cursor.fetchone()[0]
+
+def index_is_valid(cursor, name):
+    """True/False for an existing index, None if it doesn't exist"""
+    cursor.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (name,))
+    row = cursor.fetchone()
+    return None if row is None else row[0]
+
+def missing_indexes(cursor, table):
+    """Names of the table's TABLE_INDEXES that don't exist or are INVALID"""
+    return [name for name, _ in TABLE_INDEXES[table] if not index_is_valid(cursor, name)]
+
+def create_indexes(cursor, table, concurrently=False):
+    """Create the table's missing TABLE_INDEXES; returns the names built
+
+    An INVALID index, left by a concurrent build that failed or was
+    interrupted, is dropped and built again. With concurrently=True (the
+    cursor's connection must be in autocommit mode) writes are not blocked
+    while the indexes build: on a partitioned table the index is created ON
+    ONLY the parent, then built concurrently on each partition and attached;
+    the parent only becomes valid once every partition's index is attached.
+    Only indexes that end up valid are returned.
+    """
+    partitioned = is_partitioned(cursor, table)
+    built = []
+    for name, definition in TABLE_INDEXES[table]:
+        valid = index_is_valid(cursor, name)
+        if valid:
+            continue
+        if not concurrently:
+            if valid is False:
+                cursor.execute(f"DROP INDEX {name}")
+            cursor.execute(f"CREATE INDEX {name} ON {table} {definition}")
+        elif partitioned:
+            if valid is None:
+                cursor.execute(f"CREATE INDEX {name} ON ONLY {table} {definition}")
+            for partition in child_tables(cursor, table):
+                child = f"{name}_{partition[len(table) + 1:]}"
+                if index_is_valid(cursor, child) is False:
+                    cursor.execute(f"DROP INDEX CONCURRENTLY {child}")
+                cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child} ON {partition} {definition}")
+                cursor.execute(f"ALTER INDEX {name} ATTACH PARTITION {child}")
+        else:
+            if valid is False:
+                cursor.execute(f"DROP INDEX CONCURRENTLY {name}")
+            cursor.execute(f"CREATE INDEX CONCURRENTLY {name} ON {table} {definition}")
+        if index_is_valid(cursor, name):
+            built.append(name)
+    return built
+
+def migrate_indexes(cursor, table, concurrently=True):
+    """Bring an existing table's indexes up to TABLE_INDEXES and drop the
+    superseded ones; returns (built, dropped, invalid), invalid being the
+    indexes still missing or INVALID afterwards"""
+    built = create_indexes(cursor, table, concurrently)
+    dropped = []
+    for name in SUPERSEDED_INDEXES[table]:
+        if index_is_valid(cursor, name) is None:
+            continue
+        # DROP INDEX CONCURRENTLY doesn't support partitioned indexes
+        if concurrently and not is_partitioned(cursor, table):
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        else:
+            cursor.execute(f"DROP INDEX IF EXISTS {name}")
+        dropped.append(name)
+    return built, dropped, missing_indexes(cursor, table)
+
+def child_tables(cursor, table):
+    """Names of all partitions of a table, including the default one"""
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+    """, (table,))
+    return [name for (name,) in cursor.fetchall()]
+
+def list_partitions(cursor, table):
+    """Return [(partition name, month start)] of the monthly partitions"""
+    partitions = []
+    for name in child_tables(cursor, table):
+        match = PARTITION_NAME.search(name)
+        if match:
+            partitions.append((name, datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)))
+    return sorted(partitions, key=lambda p: p[1])
+
+def create_partition(cursor, table, month):
+    """Create the partition for one month; returns False if it already exists
+
+    Rows for that month that landed in the default partition are moved into
+    the new partition before it is attached.
+    """
+    name = partition_name(table, month)
+    if is_partitioned(cursor, name) is not None:
+        return False
+    lower = month.timestamp()
+    upper = add_months(month, 1).timestamp()
+
+    cursor.execute(
+        f"SELECT EXISTS (SELECT 1 FROM {table}_default WHERE timestamp >= %s AND timestamp < %s)",
+        (lower, upper)
+    )
+    if cursor.fetchone()[0]:
+        cursor.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {table}_default WHERE timestamp >= %s AND timestamp < %s RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved",
+            (lower, upper)
+        )
+        cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ({lower}) TO ({upper})")
+    else:
+        cursor.execute(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM ({lower}) TO ({upper})")
+    return True
+
+def create_partitions(cursor, table, months_ahead=MONTHS_AHEAD, now=None):
+    """Make sure partitions exist from the current month to months_ahead
+    months ahead; returns the names created"""
+    current = month_start(now or datetime.now(timezone.utc))
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if create_partition(cursor, table, month):
+            created.append(partition_name(table, month))
+    return created
+
+def expire_partitions(cursor, table, retention_months, drop=False, now=None):
+    """Detach (or drop) monthly partitions entirely older than the retention
+    period; returns the names expired. Detached partitions stay as ordinary
+    tables until dropped."""
+    cutoff = add_months(month_start(now or datetime.now(timezone.utc)), -retention_months)
+    expired = []
+    for name, month in list_partitions(cursor, table):
+        if add_months(month, 1) <= cutoff:
+            cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+            if drop:
+                cursor.execute(f"DROP TABLE {name}")
+            expired.append(name)
+    return expired
+
+def migrate_to_partitioned(cursor, table, months_ahead=MONTHS_AHEAD):
+    """Convert an existing unpartitioned table into a partitioned one
+
+    Rows are copied into monthly partitions for every month that has data,
+    in the caller's transaction (which holds an exclusive lock on the table
+    until it commits). Returns the number of rows moved, or None if
+    the table is already partitioned or missing.
+    """
+    if is_partitioned(cursor, table) is not False:
+        return None
+    legacy = f"{table}_unpartitioned"
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+    # Free the index names for the new table
+    cursor.execute("""
+        SELECT indexname FROM pg_indexes
+        WHERE tablename = %s AND schemaname = current_schema()
+    """, (legacy,))
+    for (index,) in cursor.fetchall():
+        cursor.execute(f"ALTER INDEX {index} RENAME TO {index}_unpartitioned")
+
+    create_table(cursor, table, months_ahead, with_indexes=False)
+    cursor.execute(f"""
+        SELECT DISTINCT date_trunc('month', to_timestamp(timestamp) AT TIME ZONE 'UTC')
+        FROM {legacy} WHERE timestamp > 0
+    """)
+    for (month,) in cursor.fetchall():
+        create_partition(cursor, table, month.replace(tzinfo=timezone.utc))
+
+    columns = [line.split()[0] for line in TABLE_COLUMNS[table].strip().splitlines()]
+    cursor.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = %s AND table_schema = current_schema()
+    """, (legacy,))
+    existing = {row[0] for row in cursor.fetchall()}
+    columns = [c for c in columns if c in existing]
+    # Rows without a timestamp go to the default partition as epoch 0
+    select = [f"COALESCE({c}, 0)" if c == "timestamp" else c for c in columns]
+    cursor.execute(f"""
+        INSERT INTO {table} ({', '.join(columns)})
+        SELECT {', '.join(select)} FROM {legacy}
+        ON CONFLICT DO NOTHING
+    """)
+    moved = cursor.rowcount
+    cursor.execute(f"DROP TABLE {legacy}")
+    create_indexes(cursor, table)
+    return moved
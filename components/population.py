@@ -0,0 +1,257 @@
+"""Population Module
+
+Synthetic user populations as NumPy arrays, so the producer, the history
+tables and the detectors can be exercised with millions of users. Each
+user's usual locations, merchant categories, payment methods and active hours
+are stored as bitmasks over the vocabularies below, which keeps a population
+at about 30 bytes per user.
+
+Populations are saved as .npz or .parquet files and bulk-loaded into
+user_profiles with COPY (scripts/generate_population.py). ProfileArrays and
+transaction_columns() generate transactions for a population in batches for
+the load generator and the scenario generator.
+"""
+
+import io
+import json
+import uuid
+
+import numpy as np
+
+MERCHANT_CATEGORIES = ["Retail", "Restaurant", "Travel", "Entertainment", "Grocery", "Electronics", "Healthcare", "Utilities", "Education", "Other"]
+PAYMENT_METHODS = ["Credit Card", "Debit Card", "Bank Transfer", "Digital Wallet", "Cryptocurrency"]
+DEVICE_TYPES = ["Mobile", "Desktop", "Tablet", "ATM", "POS Terminal"]
+TRANSACTION_TYPES = ["purchase", "withdrawal", "refund", "transfer", "payment", "deposit"]
+LOCATIONS = ["US", "IN", "UK", "CA", "AU", "JP", "DE", "FR", "BR", "SG"]
+ANOMALOUS_LOCATIONS = ["RU", "NG", "CN", "MX", "ZA"]
+HOURS = list(range(24))
+
+# Bitmask field -> vocabulary
+MASK_FIELDS = {
+    "location_mask": LOCATIONS,
+    "merchant_mask": MERCHANT_CATEGORIES,
+    "payment_mask": PAYMENT_METHODS,
+    "hour_mask": HOURS,
+}
+
+POPULATION_FIELDS = ["user_ids", "min_amount", "max_amount"] + list(MASK_FIELDS)
+
+def _random_masks(rng, n, size, low, high):
+    """Bitmasks with low..high distinct bits set out of size"""
+    counts = rng.integers(low, high + 1, n)
+    ranks = rng.random((n, size)).argsort(axis=1).argsort(axis=1)
+    bits = ranks < counts[:, None]
+    return (bits * (1 << np.arange(size, dtype=np.int64))).sum(axis=1)
+
+def generate_population(num_users, seed=None, first_user_id=1):
+    """Generate num_users profiles with the producer's distributions
+
+    Returns a dict of arrays: user_ids, min_amount, max_amount and one
+    bitmask per MASK_FIELDS entry.
+    """
+    rng = np.random.default_rng(seed)
+    # Active hours are 3-8 hours between 8:00 and 22:00
+    hours = _random_masks(rng, num_users, 15, 3, 8) << 8
+    return {
+        "user_ids": np.arange(first_user_id, first_user_id + num_users, dtype=np.int64),
+        "min_amount": np.round(rng.uniform(5, 200, num_users), 2).astype(np.float32),
+        "max_amount": np.round(rng.uniform(300, 2000, num_users), 2).astype(np.float32),
+        "location_mask": _random_masks(rng, num_users, len(LOCATIONS), 1, 3).astype(np.uint16),
+        "merchant_mask": _random_masks(rng, num_users, len(MERCHANT_CATEGORIES), 2, 5).astype(np.uint16),
+        "payment_mask": _random_masks(rng, num_users, len(PAYMENT_METHODS), 1, 3).astype(np.uint16),
+        "hour_mask": hours.astype(np.uint32),
+    }
+
+def mask_bits(masks, size):
+    """Boolean (n, size) matrix of the bits set in each mask"""
+    return (np.asarray(masks, dtype=np.int64)[:, None] >> np.arange(size)) & 1 == 1
+
+def save_population(path, population):
+    """Write a population to .npz or .parquet (chosen by extension)"""
+    if str(path).endswith(".parquet"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        pq.write_table(pa.table({field: population[field] for field in POPULATION_FIELDS}), path,
+                       compression="zstd")
+    else:
+        np.savez_compressed(path, **{field: population[field] for field in POPULATION_FIELDS})
+
+def load_population(path):
+    """Read a population written by save_population"""
+    if str(path).endswith(".parquet"):
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+        return {field: table.column(field).to_numpy() for field in POPULATION_FIELDS}
+    with np.load(path) as data:
+        return {field: data[field] for field in POPULATION_FIELDS}
+
+def _padded(masks, size):
+    """Indices of each mask's set bits (padded with unset ones) and bit counts"""
+    bits = mask_bits(masks, size)
+    counts = bits.sum(axis=1)
+    matrix = np.argsort(~bits, axis=1, kind="stable")[:, :max(1, int(counts.max()))]
+    return matrix, counts
+
+class ProfileArrays:
+    """A population indexed for generating transactions in batches"""
+
+    def __init__(self, population):
+        self.user_ids = population["user_ids"]
+        self.min_amount = population["min_amount"].astype(np.float64)
+        self.max_amount = population["max_amount"].astype(np.float64)
+        self.locations, self.location_counts = _padded(population["location_mask"], len(LOCATIONS))
+        self.merchants, self.merchant_counts = _padded(population["merchant_mask"], len(MERCHANT_CATEGORIES))
+        self.payments, self.payment_counts = _padded(population["payment_mask"], len(PAYMENT_METHODS))
+        self.usual_merchant_mask = mask_bits(population["merchant_mask"], len(MERCHANT_CATEGORIES))
+        self.hour_mask = mask_bits(population["hour_mask"], len(HOURS))
+
+def _names(vocabulary, indices):
+    return np.array(vocabulary, dtype=object)[indices]
+
+def transaction_columns(profiles, users, rng):
+    """Columns of normal transactions for the users at the given positions
+    of the population: amounts within the user's range at one of their usual
+    locations, merchant categories and payment methods"""
+    n = len(users)
+
+    def pick(matrix, counts):
+        return matrix[users, (rng.random(n) * counts[users]).astype(np.int64)]
+
+    low, high = profiles.min_amount[users], profiles.max_amount[users]
+    merchants = _names(MERCHANT_CATEGORIES, pick(profiles.merchants, profiles.merchant_counts))
+    ip = rng.integers(1, 256, (n, 2)).astype(str)
+    return {
+        "user_id": profiles.user_ids[users].astype(np.int64),
+        "amount": np.round(low + rng.random(n) * (high - low), 2),
+        "location": _names(LOCATIONS, pick(profiles.locations, profiles.location_counts)),
+        "transaction_type": _names(TRANSACTION_TYPES, rng.integers(0, len(TRANSACTION_TYPES), n)),
+        "merchant_id": np.char.add("MERCH", rng.integers(1000, 10000, n).astype(str)).astype(object),
+        "merchant_category": merchants,
+        "merchant_number": rng.integers(100, 1000, n),
+        "payment_method": _names(PAYMENT_METHODS, pick(profiles.payments, profiles.payment_counts)),
+        "device_type": _names(DEVICE_TYPES, rng.integers(0, len(DEVICE_TYPES), n)),
+        "ip_address": np.char.add(np.char.add("192.168.", ip[:, 0]), np.char.add(".", ip[:, 1])).astype(object),
+    }
+
+def make_foreign_purchases(columns, rows, profiles, users, rng):
+    """Turn the selected rows into large purchases from an unusual country,
+    at a merchant category and with a payment method the user doesn't use"""
+    count = int(np.count_nonzero(rows))
+    if not count:
+        return
+    columns["location"][rows] = rng.choice(ANOMALOUS_LOCATIONS, count)
+    columns["amount"][rows] = np.round(rng.uniform(3000, 10000, count), 2)
+    scores = rng.random((count, len(MERCHANT_CATEGORIES)))
+    scores[profiles.usual_merchant_mask[users[rows]]] = -1
+    columns["merchant_category"][rows] = _names(MERCHANT_CATEGORIES, scores.argmax(axis=1))
+    columns["payment_method"][rows] = _names(PAYMENT_METHODS, rng.integers(0, len(PAYMENT_METHODS), count))
+
+def transaction_ids(rng, n):
+    """Version 4 UUID strings drawn from rng, so seeded runs repeat them"""
+    data = rng.bytes(16 * n)
+    return [str(uuid.UUID(bytes=data[i:i + 16], version=4)) for i in range(0, 16 * n, 16)]
+
+def to_messages(columns, timestamps, labels, ids=None):
+    """Build the producer's transaction messages from columns"""
+    n = len(columns["user_id"])
+    ids = ids if ids is not None else [str(uuid.uuid4()) for _ in range(n)]
+    rows = zip(
+        ids,
+        columns["user_id"].tolist(),
+        columns["amount"].tolist(),
+        columns["location"].tolist(),
+        np.asarray(timestamps, dtype=np.float64).tolist(),
+        columns["transaction_type"].tolist(),
+        columns["merchant_id"].tolist(),
+        columns["merchant_category"].tolist(),
+        columns["merchant_number"].tolist(),
+        columns["payment_method"].tolist(),
+        columns["device_type"].tolist(),
+        columns["ip_address"].tolist(),
+        np.asarray(labels, dtype=bool).tolist(),
+    )
+    return [
+        {
+            "transaction_id": transaction_id,
+            "user_id": user_id,
+            "amount": amount,
+            "currency": "USD",
+            "location": location,
+            "timestamp": timestamp,
+            "transaction_type": transaction_type,
+            "merchant": {
+                "merchant_id": merchant_id,
+                "name": f"{category}_{merchant_number}",
+                "category": category
+            },
+            "payment_method": payment_method,
+            "device_info": {
+                "type": device_type,
+                "ip_address": ip_address
+            },
+            "_anomalous": label
+        }
+        for (transaction_id, user_id, amount, location, timestamp, transaction_type, merchant_id,
+             category, merchant_number, payment_method, device_type, ip_address, label) in rows
+    ]
+
+def _mask_json(masks, vocabulary):
+    """JSON array text for each mask, built once per distinct mask value"""
+    values, inverse = np.unique(masks, return_inverse=True)
+    texts = np.array([
+        json.dumps([vocabulary[i] for i in np.flatnonzero(bits)])
+        for bits in mask_bits(values, len(vocabulary))
+    ], dtype=object)
+    return texts[inverse]
+
+def copy_profiles(conn, population, chunk_size=100000):
+    """Bulk-load a population into user_profiles with COPY (caller commits)
+
+    Rows are copied into a temporary staging table and then upserted, so
+    existing profiles for the same user ids are replaced. Returns the number
+    of profiles written.
+    """
+    columns = [
+        "user_id", "usual_locations", "usual_merchants", "typical_min_amount",
+        "typical_max_amount", "typical_payment_methods", "typical_transaction_times",
+        "avg_transaction_amount", "merchant_categories", "device_types",
+    ]
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        CREATE TEMP TABLE population_staging AS
+        SELECT {', '.join(columns)} FROM user_profiles WITH NO DATA
+    """)
+
+    total = len(population["user_ids"])
+    for start in range(0, total, chunk_size):
+        part = {field: values[start:start + chunk_size] for field, values in population.items()}
+        merchants = _mask_json(part["merchant_mask"], MERCHANT_CATEGORIES)
+        rows = zip(
+            part["user_ids"].tolist(),
+            _mask_json(part["location_mask"], LOCATIONS),
+            merchants,
+            np.round(part["min_amount"].astype(np.float64), 2).tolist(),
+            np.round(part["max_amount"].astype(np.float64), 2).tolist(),
+            _mask_json(part["payment_mask"], PAYMENT_METHODS),
+            _mask_json(part["hour_mask"], HOURS),
+            np.round((part["min_amount"].astype(np.float64) + part["max_amount"]) / 2, 2).tolist(),
+        )
+        # The vocabularies contain no tabs, newlines or backslashes, so the
+        # JSON text can go into COPY's text format as it is
+        buffer = io.StringIO()
+        buffer.writelines(
+            f"{user_id}\t{locations}\t{merchants}\t{low}\t{high}\t{payments}\t{hours}\t{avg}\t{merchants}\t[]\n"
+            for user_id, locations, merchants, low, high, payments, hours, avg in rows
+        )
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY population_staging ({', '.join(columns)}) FROM STDIN", buffer)
+
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in columns[1:])
+    cursor.execute(f"""
+        INSERT INTO user_profiles ({', '.join(columns)}, last_updated)
+        SELECT {', '.join(columns)}, NOW() FROM population_staging
+        ON CONFLICT (user_id) DO UPDATE SET {updates}, last_updated = NOW()
+    """)
+    written = cursor.rowcount
+    cursor.execute("DROP TABLE population_staging")
+    return written
@@ -0,0 +1,235 @@
+"""Profile Rules Module
+
+Vectorized rule stage that checks a whole batch against the users' stored
+profiles (usual locations, merchants, payment methods, hours and amount
+range). Profiles are held in an array-backed table indexed by user_id with the
+categorical sets packed into bitmasks, so a batch is evaluated with a handful
+of NumPy operations. Clearly normal transactions can skip model scoring and
+blatant violations can be flagged immediately.
+"""
+
+import time
+import numpy as np
+import pandas as pd
+
+# Decisions returned by ProfileRules.evaluate
+NORMAL = -1
+UNCERTAIN = 0
+VIOLATION = 1
+
+# Categorical checks: (profile field, history frame column, risk weight)
+CATEGORICAL_CHECKS = [
+    ('usual_locations', 'location', 0.25),
+    ('usual_merchants', 'merchant_category', 0.15),
+    ('typical_payment_methods', 'payment_method', 0.10),
+]
+HOUR_WEIGHT = 0.10
+ABOVE_MAX_WEIGHT = 0.20
+FAR_ABOVE_MAX_WEIGHT = 0.20  # added on top of ABOVE_MAX_WEIGHT
+# Amounts under the usual range, e.g. small card-testing charges; on its own
+# enough to keep a transaction from being cleared by the rules
+BELOW_MIN_WEIGHT = 0.15
+
+# Bitmask width: the most common values of each field get a bit, rarer ones
+# are left unchecked
+MASK_BITS = 64
+
+PROFILE_QUERY = """
+    SELECT user_id, usual_locations, usual_merchants, typical_payment_methods,
+           typical_transaction_times, typical_min_amount, typical_max_amount
+    FROM user_profiles
+    WHERE usual_locations IS NOT NULL
+"""
+
+def _as_list(value):
+    return value if isinstance(value, list) else []
+
+class ProfileTable:
+    """Columnar in-memory copy of user_profiles, sorted by user_id"""
+
+    def __init__(self, user_ids, min_amount, max_amount, hour_mask, masks, vocabularies, overflow):
+        self.user_ids = user_ids
+        self.min_amount = min_amount
+        self.max_amount = max_amount
+        self.hour_mask = hour_mask
+        # field -> uint64 array of bitmasks; field -> {value: bit}; field ->
+        # values seen in profiles that didn't get a bit
+        self.masks = masks
+        self.vocabularies = vocabularies
+        self.overflow = overflow
+        self.loaded_at = time.time()
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    @property
+    def nbytes(self):
+        """Memory held by the column arrays"""
+        arrays = [self.user_ids, self.min_amount, self.max_amount, self.hour_mask] + list(self.masks.values())
+        return sum(a.nbytes for a in arrays)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from (user_id, locations, merchants, payment_methods, hours, min, max) rows"""
+        return cls.from_chunks([rows])
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        """Build from an iterable of row chunks without holding all rows at once
+
+        Each chunk is converted straight into compact column arrays. Bits are
+        assigned to categorical values in order of first appearance; values
+        beyond MASK_BITS are recorded as uncheckable.
+        """
+        vocabularies = {field: {} for field, _, _ in CATEGORICAL_CHECKS}
+        overflow = {field: set() for field, _, _ in CATEGORICAL_CHECKS}
+        columns = {'user_ids': [], 'min_amount': [], 'max_amount': [], 'hour_mask': []}
+        mask_columns = {field: [] for field, _, _ in CATEGORICAL_CHECKS}
+
+        for rows in chunks:
+            if not rows:
+                continue
+            n = len(rows)
+            columns['user_ids'].append(np.fromiter((r[0] for r in rows), dtype=np.int64, count=n))
+            columns['min_amount'].append(np.array([r[5] if r[5] is not None else np.nan for r in rows], dtype=np.float32))
+            columns['max_amount'].append(np.array([r[6] if r[6] is not None else np.nan for r in rows], dtype=np.float32))
+
+            hour_mask = np.zeros(n, dtype=np.uint32)
+            for i, r in enumerate(rows):
+                bits = 0
+                for hour in _as_list(r[4]):
+                    bits |= 1 << (int(hour) % 24)
+                hour_mask[i] = bits
+            columns['hour_mask'].append(hour_mask)
+
+            for column, (field, _, _) in zip((1, 2, 3), CATEGORICAL_CHECKS):
+                vocab = vocabularies[field]
+                mask = np.zeros(n, dtype=np.uint64)
+                for i, r in enumerate(rows):
+                    bits = 0
+                    for item in _as_list(r[column]):
+                        bit = vocab.get(item)
+                        if bit is None and item not in overflow[field]:
+                            if len(vocab) < MASK_BITS:
+                                bit = vocab[item] = len(vocab)
+                            else:
+                                overflow[field].add(item)
+                        if bit is not None:
+                            bits |= 1 << bit
+                    mask[i] = bits
+                mask_columns[field].append(mask)
+
+        def concat(parts, dtype):
+            return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+
+        user_ids = concat(columns['user_ids'], np.int64)
+        order = np.argsort(user_ids, kind='stable')
+        return cls(
+            user_ids[order],
+            concat(columns['min_amount'], np.float32)[order],
+            concat(columns['max_amount'], np.float32)[order],
+            concat(columns['hour_mask'], np.uint32)[order],
+            {field: concat(parts, np.uint64)[order] for field, parts in mask_columns.items()},
+            vocabularies,
+            {field: list(values) for field, values in overflow.items()},
+        )
+
+    @classmethod
+    def load(cls, conn, chunk_size=50000, owns=None):
+        """Stream every stored profile from the database in one query
+
+        Uses a named (server-side) cursor so rows arrive in chunks and are
+        packed into column arrays as they come, instead of materialising the
+        whole table as Python tuples. When owns(user_id) is given only the
+        profiles of the users it accepts are kept.
+        """
+        cursor = conn.cursor(name="profile_table_load")
+        cursor.itersize = chunk_size
+        try:
+            cursor.execute(PROFILE_QUERY + " ORDER BY user_id")
+
+            def chunks():
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        return
+                    if owns is not None:
+                        rows = [row for row in rows if owns(row[0])]
+                    yield rows
+
+            return cls.from_chunks(chunks())
+        finally:
+            cursor.close()
+
+    def lookup(self, user_ids):
+        """Return (row positions, found mask) for an array of user ids"""
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        if len(self.user_ids) == 0:
+            return np.zeros(len(user_ids), dtype=np.int64), np.zeros(len(user_ids), dtype=bool)
+        positions = np.searchsorted(self.user_ids, user_ids)
+        positions = np.minimum(positions, len(self.user_ids) - 1)
+        return positions, self.user_ids[positions] == user_ids
+
+class ProfileRules:
+    """Evaluates profile rules for a batch and decides which rows need a model"""
+
+    def __init__(self, table, normal_below=0.15, violation_at=0.7, far_above_factor=3.0):
+        self.table = table
+        self.normal_below = normal_below
+        self.violation_at = violation_at
+        self.far_above_factor = far_above_factor
+
+    def evaluate(self, df):
+        """Evaluate a history frame (see transactions_to_history_frame)
+
+        Returns (risk, decision): risk is a 0-1 float array, decision holds
+        NORMAL, UNCERTAIN or VIOLATION per row. Users without a profile are
+        always UNCERTAIN, and a row is only NORMAL when every check could be
+        made (a new user's profile has empty sets, which check nothing).
+        """
+        table = self.table
+        n = len(df)
+        if len(table) == 0:
+            return np.zeros(n), np.full(n, UNCERTAIN, dtype=np.int8)
+        user_ids = pd.to_numeric(df['user_id'], errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+        positions, found = table.lookup(user_ids)
+
+        risk = np.zeros(n)
+        checked = found.copy()
+        for field, column, weight in CATEGORICAL_CHECKS:
+            user_mask = table.masks[field][positions]
+            bits = df[column].map(table.vocabularies[field]).to_numpy(dtype=float)
+            known = ~np.isnan(bits)
+            shifted = np.where(known, bits, 0).astype(np.uint64)
+            in_profile = ((user_mask >> shifted) & np.uint64(1)).astype(bool)
+            # Values no profile has are never usual; values that didn't get a
+            # bit and empty profile fields can't be checked
+            uncheckable = df[column].isin(table.overflow[field]).to_numpy()
+            unusual = (user_mask != 0) & ~(known & in_profile) & ~uncheckable
+            risk += weight * unusual
+            checked &= (user_mask != 0) & ~uncheckable
+
+        hour_mask = table.hour_mask[positions]
+        hours = df['hour_of_day'].to_numpy(dtype=np.int64) % 24
+        unusual_hour = (hour_mask != 0) & (((hour_mask >> hours.astype(np.uint32)) & 1) == 0)
+        risk += HOUR_WEIGHT * unusual_hour
+        checked &= hour_mask != 0
+
+        # The profile amounts are float32; compare at the same precision so
+        # an amount equal to a bound isn't outside it
+        amount = df['amount'].to_numpy(dtype=np.float32)
+        max_amount = table.max_amount[positions]
+        has_max = ~np.isnan(max_amount)
+        risk += ABOVE_MAX_WEIGHT * (has_max & (amount > max_amount))
+        risk += FAR_ABOVE_MAX_WEIGHT * (has_max & (amount > max_amount * self.far_above_factor))
+        min_amount = table.min_amount[positions]
+        has_min = ~np.isnan(min_amount)
+        risk += BELOW_MIN_WEIGHT * (has_min & (amount < min_amount))
+
+        risk = np.where(found, np.minimum(risk, 1.0), 0.0)
+        decision = np.full(n, UNCERTAIN, dtype=np.int8)
+        # Only fully populated profiles with a known amount range can clear
+        # a transaction
+        decision[checked & has_min & has_max & (risk < self.normal_below)] = NORMAL
+        decision[found & (risk >= self.violation_at)] = VIOLATION
+        return risk, decision
@@ -0,0 +1,155 @@
+"""Rollups Module
+
+Pre-aggregated anomaly counts for the dashboard, maintained by the detectors
+in the same commit as the fraud inserts, so metrics queries read a handful of
+bucket rows instead of scanning frauds:
+
+  anomaly_rollups     anomaly count, amount sum and score sum per minute, hour
+                      and day bucket (UTC epoch start), model and risk level
+  anomaly_histograms  per-day histograms of amount (width_bucket(amount, 0,
+                      5000, 10), as the score-distribution chart) and
+                      detection score (width_bucket(score, 0, 1, 10))
+
+Only newly inserted frauds are counted, so redelivered transactions don't
+inflate the rollups.
+"""
+
+import math
+
+import psycopg2.extras
+
+GRANULARITIES = {"minute": 60, "hour": 3600, "day": 86400}
+
+# Minute buckets are only needed for the last day of the dashboard
+MINUTE_RETENTION_SECONDS = 2 * 86400
+
+AMOUNT_HISTOGRAM = (0.0, 5000.0, 10)
+SCORE_HISTOGRAM = (0.0, 1.0, 10)
+
+ROLLUP_UPSERT = """
+    INSERT INTO anomaly_rollups (granularity, bucket_start, model_used, risk_level,
+                                 anomaly_count, amount_sum, score_sum)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (granularity, bucket_start, model_used, risk_level) DO UPDATE SET
+        anomaly_count = anomaly_rollups.anomaly_count + EXCLUDED.anomaly_count,
+        amount_sum = anomaly_rollups.amount_sum + EXCLUDED.amount_sum,
+        score_sum = anomaly_rollups.score_sum + EXCLUDED.score_sum
+"""
+
+HISTOGRAM_UPSERT = """
+    INSERT INTO anomaly_histograms (day_start, histogram, bucket, anomaly_count)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (day_start, histogram, bucket) DO UPDATE SET
+        anomaly_count = anomaly_histograms.anomaly_count + EXCLUDED.anomaly_count
+"""
+
+def width_bucket(value, low, high, count):
+    """Python equivalent of Postgres width_bucket()"""
+    if value < low:
+        return 0
+    if value >= high:
+        return count + 1
+    return int((value - low) / (high - low) * count) + 1
+
+def create_rollup_tables(cursor):
+    """Create the rollup tables, backfilling them from frauds the first time"""
+    cursor.execute("SELECT to_regclass('anomaly_rollups') IS NOT NULL")
+    exists = cursor.fetchone()[0]
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS anomaly_rollups (
+            granularity TEXT NOT NULL,
+            bucket_start FLOAT NOT NULL,
+            model_used TEXT NOT NULL,
+            risk_level TEXT NOT NULL,
+            anomaly_count BIGINT NOT NULL DEFAULT 0,
+            amount_sum FLOAT NOT NULL DEFAULT 0,
+            score_sum FLOAT NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularity, bucket_start, model_used, risk_level)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS anomaly_histograms (
+            day_start FLOAT NOT NULL,
+            histogram TEXT NOT NULL,
+            bucket INT NOT NULL,
+            anomaly_count BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (day_start, histogram, bucket)
+        )
+    """)
+    if exists:
+        return
+
+    cursor.execute("SELECT to_regclass('frauds') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return
+    print("Backfilling anomaly rollups from frauds...")
+    for granularity, seconds in GRANULARITIES.items():
+        if granularity == "minute":
+            continue
+        cursor.execute("""
+            INSERT INTO anomaly_rollups (granularity, bucket_start, model_used, risk_level,
+                                         anomaly_count, amount_sum, score_sum)
+            SELECT %s, floor(timestamp / %s) * %s, COALESCE(model_used, 'global'),
+                   COALESCE(risk_level, 'unknown'), COUNT(*),
+                   COALESCE(SUM(amount), 0), COALESCE(SUM(detection_score), 0)
+            FROM frauds
+            WHERE timestamp IS NOT NULL
+            GROUP BY 2, 3, 4
+        """, (granularity, seconds, seconds))
+    for histogram, column, (low, high, count) in (("amount", "amount", AMOUNT_HISTOGRAM),
+                                                  ("score", "detection_score", SCORE_HISTOGRAM)):
+        cursor.execute(f"""
+            INSERT INTO anomaly_histograms (day_start, histogram, bucket, anomaly_count)
+            SELECT floor(timestamp / 86400) * 86400, %s, width_bucket({column}, %s, %s, %s), COUNT(*)
+            FROM frauds
+            WHERE timestamp IS NOT NULL AND {column} IS NOT NULL
+            GROUP BY 1, 3
+        """, (histogram, low, high, count))
+
+def aggregate(anomalies):
+    """Aggregate anomaly dicts into (rollup rows, histogram rows)
+
+    Each anomaly needs timestamp, amount, detection_score, model_used and
+    risk_level.
+    """
+    rollups = {}
+    histograms = {}
+    for anomaly in anomalies:
+        timestamp = float(anomaly.get("timestamp") or 0)
+        amount = float(anomaly.get("amount") or 0)
+        score = float(anomaly.get("detection_score") or 0)
+        if math.isnan(score):
+            score = 0.0
+        model_used = str(anomaly.get("model_used") or "global")
+        risk_level = str(anomaly.get("risk_level") or "unknown")
+
+        for granularity, seconds in GRANULARITIES.items():
+            key = (granularity, math.floor(timestamp / seconds) * seconds, model_used, risk_level)
+            count, amount_sum, score_sum = rollups.get(key, (0, 0.0, 0.0))
+            rollups[key] = (count + 1, amount_sum + amount, score_sum + score)
+
+        day = math.floor(timestamp / 86400) * 86400
+        for histogram, value, bounds in (("amount", amount, AMOUNT_HISTOGRAM), ("score", score, SCORE_HISTOGRAM)):
+            key = (day, histogram, width_bucket(value, *bounds))
+            histograms[key] = histograms.get(key, 0) + 1
+
+    return (
+        [key + values for key, values in rollups.items()],
+        [key + (count,) for key, count in histograms.items()],
+    )
+
+def record_anomalies(cursor, anomalies):
+    """Add newly inserted anomalies to the rollups (caller commits)"""
+    rollups, histograms = aggregate(anomalies)
+    if rollups:
+        psycopg2.extras.execute_batch(cursor, ROLLUP_UPSERT, rollups)
+    if histograms:
+        psycopg2.extras.execute_batch(cursor, HISTOGRAM_UPSERT, histograms)
+
+def prune_minute_rollups(cursor, older_than=MINUTE_RETENTION_SECONDS):
+    """Delete minute buckets older than older_than seconds; returns rows deleted"""
+    cursor.execute("""
+        DELETE FROM anomaly_rollups
+        WHERE granularity = 'minute' AND bucket_start < EXTRACT(EPOCH FROM NOW()) - %s
+    """, (older_than,))
+    return cursor.rowcount
@@ -0,0 +1,254 @@
+"""Scenarios Module
+
+Deterministic transaction streams for reproducible benchmarks and detector
+comparisons. A scenario is described by a JSON-compatible dict (see
+DEFAULT_SCENARIO) and generated entirely from its seed. That covers the user
+population, a diurnal load curve and normal traffic, plus the injected fraud
+patterns:
+
+  foreign_purchase  single large purchases from an unusual country (the
+                    producer's original anomaly)
+  burst             a run of purchases near or above the user's maximum
+                    within a few minutes
+  account_takeover  a user suddenly transacting from a new country, device
+                    and payment method with inflated amounts
+  card_testing      a string of tiny charges followed by one large purchase
+  drift             a user's amounts growing steadily over the scenario;
+                    labelled once they pass label_above times the original
+
+Rows carry ground-truth labels (_anomalous) and the pattern that produced
+them. Scenarios are written as Parquet (flat columns) or gzipped JSONL (one
+producer message per line) and replayed with `produce.py --replay`.
+"""
+
+import copy
+import gzip
+import json
+
+import numpy as np
+import pandas as pd
+
+from components.population import (
+    ANOMALOUS_LOCATIONS, DEVICE_TYPES, PAYMENT_METHODS,
+    ProfileArrays, generate_population, load_population, make_foreign_purchases,
+    to_messages, transaction_columns, transaction_ids
+)
+
+DEFAULT_SCENARIO = {
+    "seed": 42,
+    "users": 10000,
+    # Population file to draw users from instead of generating "users"
+    "population": None,
+    # 2026-01-05 00:00 UTC, so default scenarios are identical run to run
+    "start": 1767571200,
+    "duration_hours": 24,
+    # Mean transactions/sec; the rate follows a daily cosine around it
+    "base_rate": 20,
+    "diurnal_amplitude": 0.6,
+    "peak_hour": 14,
+    "patterns": {
+        "foreign_purchase": {"share": 0.005},
+        "burst": {"count": 50, "size": [5, 20], "window_seconds": 300},
+        "account_takeover": {"count": 20, "size": [3, 10], "window_seconds": 3600},
+        "card_testing": {"count": 30, "size": [10, 40], "window_seconds": 600},
+        "drift": {"count": 20, "factor": 3.0, "label_above": 1.5},
+    },
+}
+
+FRAME_COLUMNS = [
+    "transaction_id", "user_id", "amount", "location", "timestamp", "transaction_type",
+    "merchant_id", "merchant_category", "merchant_number", "payment_method", "device_type",
+    "ip_address", "_anomalous", "pattern",
+]
+
+def load_config(path=None, overrides=None):
+    """DEFAULT_SCENARIO updated from a JSON file and/or a dict of overrides"""
+    config = copy.deepcopy(DEFAULT_SCENARIO)
+    from_file = None
+    if path:
+        with open(path) as f:
+            from_file = json.load(f)
+    for update in (from_file, overrides):
+        if not update:
+            continue
+        patterns = update.get("patterns")
+        config.update({k: v for k, v in update.items() if k != "patterns"})
+        if patterns is not None:
+            config["patterns"] = patterns
+    return config
+
+def diurnal_timestamps(config, rng):
+    """Poisson arrivals whose per-minute rate follows the diurnal curve"""
+    start = float(config["start"])
+    minutes = int(config["duration_hours"] * 60)
+    minute_starts = start + 60.0 * np.arange(minutes)
+    hours = (minute_starts % 86400) / 3600
+    rate = config["base_rate"] * (
+        1 + config["diurnal_amplitude"] * np.cos(2 * np.pi * (hours - config["peak_hour"]) / 24)
+    )
+    counts = rng.poisson(np.maximum(rate, 0) * 60)
+    return np.repeat(minute_starts, counts) + rng.random(int(counts.sum())) * 60
+
+def _active_users(profiles, timestamps, rng):
+    """Pick a user for each timestamp among those active at that hour"""
+    users = rng.integers(0, len(profiles.user_ids), len(timestamps))
+    hours = ((timestamps % 86400) // 3600).astype(np.int64)
+    for hour in np.unique(hours):
+        active = np.flatnonzero(profiles.hour_mask[:, hour])
+        if len(active):
+            rows = np.flatnonzero(hours == hour)
+            users[rows] = active[rng.integers(0, len(active), len(rows))]
+    return users
+
+def _frame(profiles, users, timestamps, rng, pattern, labels=True):
+    columns = transaction_columns(profiles, users, rng)
+    columns["timestamp"] = np.asarray(timestamps, dtype=np.float64)
+    columns["_anomalous"] = np.broadcast_to(labels, len(users)).copy()
+    columns["pattern"] = pattern
+    return pd.DataFrame(columns)
+
+def _episodes(config, params, rng, profiles):
+    """(user position, timestamps) for each fraud episode of a pattern"""
+    start = float(config["start"])
+    end = start + config["duration_hours"] * 3600
+    window = params["window_seconds"]
+    low, high = params["size"]
+    for _ in range(params["count"]):
+        user = int(rng.integers(0, len(profiles.user_ids)))
+        first = rng.uniform(start, max(start, end - window))
+        size = int(rng.integers(low, high + 1))
+        yield user, np.sort(first + rng.random(size) * window)
+
+def _bursts(config, params, profiles, rng):
+    frames = []
+    for user, timestamps in _episodes(config, params, rng, profiles):
+        users = np.full(len(timestamps), user)
+        frame = _frame(profiles, users, timestamps, rng, "burst")
+        frame["amount"] = np.round(profiles.max_amount[user] * rng.uniform(0.8, 2.0, len(users)), 2)
+        frames.append(frame)
+    return frames
+
+def _account_takeovers(config, params, profiles, rng):
+    frames = []
+    for user, timestamps in _episodes(config, params, rng, profiles):
+        users = np.full(len(timestamps), user)
+        frame = _frame(profiles, users, timestamps, rng, "account_takeover")
+        # The attacker keeps one country, device, payment method and address
+        frame["location"] = rng.choice(ANOMALOUS_LOCATIONS)
+        frame["device_type"] = rng.choice(DEVICE_TYPES)
+        frame["payment_method"] = rng.choice(PAYMENT_METHODS)
+        frame["ip_address"] = f"10.{rng.integers(0, 256)}.{rng.integers(0, 256)}.{rng.integers(1, 255)}"
+        frame["amount"] = np.round(
+            profiles.max_amount[user] * rng.uniform(1.0, 3.0, len(users)), 2
+        )
+        frames.append(frame)
+    return frames
+
+def _card_testing(config, params, profiles, rng):
+    frames = []
+    for user, timestamps in _episodes(config, params, rng, profiles):
+        users = np.full(len(timestamps), user)
+        frame = _frame(profiles, users, timestamps, rng, "card_testing")
+        frame["amount"] = np.round(rng.uniform(0.5, 5.0, len(users)), 2)
+        frame["merchant_category"] = "Other"
+        frame["transaction_type"] = "purchase"
+        # The card works: cash out with one large purchase
+        frame.loc[frame.index[-1], ["amount", "merchant_category"]] = [
+            round(float(rng.uniform(1000, 5000)), 2), "Electronics"
+        ]
+        frames.append(frame)
+    return frames
+
+def _drift(config, params, profiles, frame, rng):
+    """Scale the amounts of some users' normal traffic up over the scenario"""
+    users = rng.choice(profiles.user_ids, min(params["count"], len(profiles.user_ids)), replace=False)
+    rows = (frame["user_id"].isin(users) & (frame["pattern"] == "normal")).to_numpy()
+    progress = (frame["timestamp"].to_numpy()[rows] - float(config["start"])) / (config["duration_hours"] * 3600)
+    factor = 1 + (params["factor"] - 1) * np.clip(progress, 0, 1)
+    frame.loc[rows, "amount"] = np.round(frame["amount"].to_numpy()[rows] * factor, 2)
+    frame.loc[rows, "pattern"] = "drift"
+    frame.loc[rows, "_anomalous"] = factor >= params["label_above"]
+
+def generate_scenario(config):
+    """Generate a scenario as a DataFrame of FRAME_COLUMNS, ordered by time"""
+    rng = np.random.default_rng(config["seed"])
+    if config.get("population"):
+        population = load_population(config["population"])
+    else:
+        population = generate_population(config["users"], config["seed"])
+    profiles = ProfileArrays(population)
+    patterns = config.get("patterns", {})
+
+    timestamps = diurnal_timestamps(config, rng)
+    users = _active_users(profiles, timestamps, rng)
+    normal = _frame(profiles, users, timestamps, rng, "normal", labels=False)
+
+    if "foreign_purchase" in patterns:
+        rows = rng.random(len(normal)) < patterns["foreign_purchase"]["share"]
+        columns = {c: normal[c].to_numpy().copy() for c in ("location", "amount", "merchant_category", "payment_method")}
+        make_foreign_purchases(columns, rows, profiles, users, rng)
+        for column, values in columns.items():
+            normal[column] = values
+        normal.loc[rows, "_anomalous"] = True
+        normal.loc[rows, "pattern"] = "foreign_purchase"
+    if "drift" in patterns:
+        _drift(config, patterns["drift"], profiles, normal, rng)
+
+    frames = [normal]
+    for name, build in (("burst", _bursts), ("account_takeover", _account_takeovers),
+                        ("card_testing", _card_testing)):
+        if name in patterns:
+            frames.extend(build(config, patterns[name], profiles, rng))
+
+    frame = pd.concat(frames, ignore_index=True)
+    frame = frame.sort_values("timestamp", kind="stable", ignore_index=True)
+    frame.insert(0, "transaction_id", transaction_ids(rng, len(frame)))
+    return frame[FRAME_COLUMNS]
+
+def write_scenario(frame, path, config=None):
+    """Write a scenario to .parquet or .jsonl.gz (chosen by extension)
+
+    Parquet files keep the config in their metadata.
+    """
+    if str(path).endswith(".parquet"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        if config is not None:
+            table = table.replace_schema_metadata({
+                **(table.schema.metadata or {}), b"scenario": json.dumps(config).encode()
+            })
+        pq.write_table(table, path, compression="zstd")
+        return
+    with gzip.open(path, "wt") as f:
+        for chunk in range(0, len(frame), 100000):
+            part = frame.iloc[chunk:chunk + 100000]
+            messages = frame_to_messages(part)
+            for message, pattern in zip(messages, part["pattern"].tolist()):
+                message["_pattern"] = pattern
+                f.write(json.dumps(message) + "\n")
+
+def frame_to_messages(frame):
+    """Producer messages for scenario rows"""
+    columns = {c: frame[c].to_numpy() for c in FRAME_COLUMNS}
+    return to_messages(columns, columns["timestamp"], columns["_anomalous"],
+                       ids=columns["transaction_id"].tolist())
+
+def read_scenario(path, batch_size=10000):
+    """Yield the producer messages of a scenario file in batches"""
+    if str(path).endswith(".parquet"):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+            yield frame_to_messages(batch.to_pandas())
+        return
+    with gzip.open(path, "rt") as f:
+        batch = []
+        for line in f:
+            message = json.loads(line)
+            message.pop("_pattern", None)
+            batch.append(message)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
@@ -0,0 +1,112 @@
+"""Scored Stream Module
+
+Publishes every transaction the detectors score (not only the anomalies that
+land in frauds) so live views can subscribe instead of polling:
+
+  Postgres NOTIFY  on SCORED_CHANNEL (default "scored_transactions"). The rows
+                   of a batch are coalesced into JSON arrays just under the
+                   8000-byte NOTIFY payload limit, and the notifications go
+                   out when the detector's transaction commits.
+  Kafka            to SCORED_TOPIC when it is set, one message per batch.
+
+Set SCORED_CHANNEL to an empty string to turn the NOTIFY side off.
+"""
+
+import json
+import math
+import os
+
+DEFAULT_CHANNEL = "scored_transactions"
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+MAX_PAYLOAD_BYTES = 7900
+
+def scored_rows(df):
+    """Compact rows (id, user, amount, score, risk level, model...) for a
+    DataFrame of scored transactions"""
+    rows = []
+    columns = {c: df[c].tolist() if c in df.columns else [None] * len(df)
+               for c in ("transaction_id", "user_id", "amount", "location", "timestamp",
+                         "detection_score", "risk_level", "model_used", "anomaly")}
+    for values in zip(*columns.values()):
+        (transaction_id, user_id, amount, location, timestamp,
+         score, risk_level, model_used, anomaly) = values
+        score = None if score is None or (isinstance(score, float) and math.isnan(score)) else round(float(score), 4)
+        rows.append({
+            "id": transaction_id,
+            "userId": int(user_id) if user_id is not None else None,
+            "amount": float(amount) if amount is not None else None,
+            "location": location,
+            "timestamp": float(timestamp) if timestamp is not None else None,
+            "score": score,
+            "riskLevel": None if risk_level is None or risk_level != risk_level else str(risk_level),
+            "model": model_used or "global",
+            "anomaly": bool(anomaly == 1),
+        })
+    return rows
+
+def coalesce(rows, max_bytes=MAX_PAYLOAD_BYTES):
+    """Pack rows into JSON array payloads of at most max_bytes each"""
+    payloads = []
+    current, size = [], 2
+    for row in rows:
+        text = json.dumps(row, separators=(",", ":"))
+        if current and size + len(text) + 1 > max_bytes:
+            payloads.append("[" + ",".join(current) + "]")
+            current, size = [], 2
+        current.append(text)
+        size += len(text) + 1
+    if current:
+        payloads.append("[" + ",".join(current) + "]")
+    return payloads
+
+class ScoredStream:
+    """Publishes scored batches to a NOTIFY channel and/or a Kafka topic"""
+
+    def __init__(self, channel=DEFAULT_CHANNEL, topic=None, bootstrap_servers="localhost:9092"):
+        self.channel = channel or None
+        self.topic = topic or None
+        self.producer = None
+        if self.topic:
+            from kafka import KafkaProducer
+            self.producer = KafkaProducer(
+                bootstrap_servers=bootstrap_servers,
+                value_serializer=lambda rows: json.dumps(rows, separators=(",", ":")).encode("utf-8"),
+                linger_ms=50,
+            )
+        self.published = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            channel=os.environ.get("SCORED_CHANNEL", DEFAULT_CHANNEL),
+            topic=os.environ.get("SCORED_TOPIC"),
+        )
+
+    def notifications(self, rows):
+        """(channel, payload) pairs to pg_notify for the rows"""
+        if not self.channel or not rows:
+            return []
+        return [(self.channel, payload) for payload in coalesce(rows)]
+
+    def notify(self, cursor, rows):
+        """Queue NOTIFYs for the rows; they are delivered when the caller
+        commits and dropped if it rolls back"""
+        for channel, payload in self.notifications(rows):
+            cursor.execute("SELECT pg_notify(%s, %s)", (channel, payload))
+
+    def send(self, rows):
+        """Send the rows to the Kafka topic (call after the batch committed)"""
+        if not rows:
+            return
+        self.published += len(rows)
+        if self.producer is not None:
+            try:
+                self.producer.send(self.topic, rows)
+            except Exception as e:
+                print(f"Failed to publish scored transactions: {e}")
+
+    def close(self):
+        if self.producer is not None:
+            self.producer.flush()
+            self.producer.close()
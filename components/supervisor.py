@@ -0,0 +1,231 @@
+"""Supervisor Module
+
+Keeps the system's processes running for scripts/run_enhanced_system.py:
+
+  - a process that exits is restarted after an exponential backoff, which
+    resets once it has stayed up for a while, so a detector that crashes at
+    import (e.g. while the database is down) doesn't respawn in a tight loop
+  - processes with a health port are probed on /health (liveness) and
+    /ready (readiness); one that stops answering, or never becomes ready, is
+    stopped and restarted
+  - shutdown sends SIGTERM group by group (producer, then detectors, then
+    the rest) and waits for each group to drain before killing stragglers
+
+Children run in their own sessions so a Ctrl+C reaches the supervisor only
+and shutdown happens in that order.
+"""
+
+import json
+import os
+import signal
+import subprocess
+import time
+import urllib.error
+import urllib.request
+
+class ManagedProcess:
+    """A supervised child process and its restart/health state"""
+
+    def __init__(self, name, argv, cwd=None, env=None, health_port=None, group=0):
+        """group orders shutdown: lower groups are stopped and drained first"""
+        self.name = name
+        self.argv = argv
+        self.cwd = cwd
+        self.env = env
+        self.health_port = health_port
+        self.group = group
+
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.failures = 0
+        self.next_start_at = 0.0
+        self.ready = False
+        self.health_failures = 0
+        self.last_check = 0.0
+        # Set while the supervisor is stopping the process: when to SIGKILL
+        # it if it hasn't exited, and why it is being stopped
+        self.kill_at = None
+        self.stop_reason = None
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        self.process = subprocess.Popen(self.argv, cwd=self.cwd, env=self.env, start_new_session=True)
+        self.started_at = time.time()
+        self.ready = self.health_port is None
+        self.health_failures = 0
+        self.kill_at = None
+        self.stop_reason = None
+        print(f"Started {self.name} (pid {self.process.pid})")
+
+    def _signal(self, signum):
+        # Each child leads its own process group, so this also reaches
+        # anything it spawned (e.g. the dev server under npm)
+        if self.running:
+            try:
+                os.killpg(self.process.pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self):
+        self._signal(signal.SIGTERM)
+
+    def kill(self):
+        self._signal(signal.SIGKILL)
+
+    def probe(self, path, timeout):
+        """(HTTP status or None, JSON body or None) for a health endpoint"""
+        url = f"http://127.0.0.1:{self.health_port}{path}"
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                return response.status, json.loads(response.read() or b"null")
+        except urllib.error.HTTPError as e:
+            try:
+                return e.code, json.loads(e.read() or b"null")
+            except ValueError:
+                return e.code, None
+        except (OSError, ValueError):
+            return None, None
+
+class Supervisor:
+    """Runs ManagedProcesses with backoff restarts and health checks"""
+
+    def __init__(self, base_backoff=1.0, max_backoff=60.0, stable_after=60.0,
+                 check_interval=5.0, check_timeout=2.0, unhealthy_after=3,
+                 startup_grace=30.0, ready_timeout=300.0, max_heartbeat_age=None,
+                 drain_timeout=30.0):
+        """
+        stable_after: seconds a process must stay up for its backoff to reset
+        unhealthy_after: consecutive failed /health probes before a restart
+        startup_grace: seconds after a start before /health failures count
+        ready_timeout: seconds a process may take to report /ready
+        max_heartbeat_age: also restart when the reported heartbeat is older
+            (checked once the process has become ready)
+        drain_timeout: seconds each group gets to exit after SIGTERM
+        """
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.unhealthy_after = unhealthy_after
+        self.startup_grace = startup_grace
+        self.ready_timeout = ready_timeout
+        self.max_heartbeat_age = max_heartbeat_age
+        self.drain_timeout = drain_timeout
+        self.processes = []
+        self.stopping = False
+
+    def add(self, managed):
+        self.processes.append(managed)
+        return managed
+
+    def request_stop(self, signum=None, frame=None):
+        """Signal handler: ask the run loop to shut down"""
+        if not self.stopping:
+            print("\nShutting down all components...")
+        self.stopping = True
+
+    def _backoff(self, managed):
+        return min(self.base_backoff * 2 ** max(managed.failures - 1, 0), self.max_backoff)
+
+    def _schedule_restart(self, managed, reason):
+        now = time.time()
+        uptime = now - managed.started_at if managed.started_at else 0
+        managed.failures = 1 if uptime >= self.stable_after else managed.failures + 1
+        delay = self._backoff(managed)
+        managed.next_start_at = now + delay
+        managed.process = None
+        print(f"{managed.name} {reason}; restarting in {delay:.1f}s "
+              f"(attempt {managed.failures})")
+
+    def _stop_one(self, managed, reason):
+        """Send an unhealthy process SIGTERM; step() restarts it once it has
+        exited and kills it if it is still running after the drain timeout,
+        so the other processes stay supervised meanwhile"""
+        print(f"{managed.name} {reason}; stopping it")
+        managed.terminate()
+        managed.kill_at = time.time() + self.drain_timeout
+        managed.stop_reason = reason
+
+    def _check_stopping(self, managed, now):
+        if managed.process.poll() is not None:
+            self._schedule_restart(managed, managed.stop_reason)
+        elif now >= managed.kill_at:
+            print(f"{managed.name} did not drain within {self.drain_timeout:.0f}s; killing it")
+            managed.kill()
+            # Checked again after the next interval in case it lingers
+            managed.kill_at = now + self.check_interval
+
+    def _check_health(self, managed, now):
+        if managed.health_port is None or now - managed.last_check < self.check_interval:
+            return
+        managed.last_check = now
+        uptime = now - managed.started_at
+
+        if not managed.ready:
+            status, _ = managed.probe("/ready", self.check_timeout)
+            if status == 200:
+                managed.ready = True
+                print(f"{managed.name} is ready after {uptime:.0f}s")
+            elif uptime > self.ready_timeout:
+                self._stop_one(managed, f"was not ready after {self.ready_timeout:.0f}s")
+                return
+
+        status, body = managed.probe("/health", self.check_timeout)
+        healthy = status == 200
+        # The main loop only starts beating after warm-up, so the heartbeat
+        # age counts once the process has reported ready
+        if healthy and managed.ready and self.max_heartbeat_age is not None and isinstance(body, dict):
+            healthy = body.get("heartbeat_age_seconds", 0) <= self.max_heartbeat_age
+        if healthy:
+            managed.health_failures = 0
+        elif uptime > self.startup_grace:
+            managed.health_failures += 1
+            if managed.health_failures >= self.unhealthy_after:
+                self._stop_one(managed, f"failed {managed.health_failures} health checks")
+
+    def step(self):
+        """One supervision pass: restart exited processes whose backoff has
+        passed, follow up on the ones being stopped and probe the health of
+        the running ones"""
+        now = time.time()
+        for managed in self.processes:
+            if managed.process is None:
+                if now >= managed.next_start_at:
+                    if managed.started_at is not None:
+                        managed.restarts += 1
+                    managed.start()
+            elif managed.kill_at is not None:
+                self._check_stopping(managed, now)
+            elif managed.process.poll() is not None:
+                self._schedule_restart(managed, f"exited with code {managed.process.returncode}")
+            else:
+                self._check_health(managed, now)
+
+    def run(self, interval=1.0):
+        """Supervise until request_stop(), then shut down"""
+        while not self.stopping:
+            self.step()
+            time.sleep(interval)
+        self.shutdown()
+
+    def shutdown(self):
+        """SIGTERM each group in order and wait for it to drain"""
+        for group in sorted({managed.group for managed in self.processes}):
+            members = [m for m in self.processes if m.group == group and m.running]
+            for managed in members:
+                print(f"Terminating {managed.name}...")
+                managed.terminate()
+            deadline = time.time() + self.drain_timeout
+            for managed in members:
+                try:
+                    managed.process.wait(max(0.0, deadline - time.time()))
+                except subprocess.TimeoutExpired:
+                    print(f"{managed.name} did not drain within {self.drain_timeout:.0f}s; killing it")
+                    managed.kill()
+                    managed.process.wait()
+        print("All components shut down.")
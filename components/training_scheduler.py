@@ -0,0 +1,189 @@
+"""Training Scheduler Module
+
+Runs user model training in a background thread so it never blocks scoring.
+Users are queued by priority (new transactions since the last fit, recent
+anomaly activity and model staleness), duplicate requests for a user collapse
+into a single pending job, and training is throttled to a CPU budget.
+"""
+
+import heapq
+import threading
+import time
+
+class TrainingScheduler:
+    """Priority-based background scheduler for user model training"""
+
+    def __init__(self, train_fn, min_new_transactions=20, cpu_budget=0.25,
+                 stale_after=3600, anomaly_weight=10.0):
+        """Create a scheduler
+
+        train_fn is called with a user_id from the scheduler thread and should
+        return True when a model was trained. It must not share a database
+        connection with the scoring loop.
+        cpu_budget is the fraction of wall time the scheduler may spend
+        training (0.25 = at most a quarter of one core).
+        """
+        self.train_fn = train_fn
+        self.min_new_transactions = min_new_transactions
+        self.cpu_budget = min(max(cpu_budget, 0.01), 1.0)
+        self.stale_after = stale_after
+        self.anomaly_weight = anomaly_weight
+
+        # user_id -> {'new': int, 'anomalies': int, 'last_fit': float|None, 'version': int}
+        self._users = {}
+        # Entries are (-priority, version, user_id); entries whose version no
+        # longer matches the user's state are stale and skipped
+        self._heap = []
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+
+        self.trained = 0
+        self.failed = 0
+
+    def seed(self, user_id, new_transactions=0, anomalies=0, last_fit=None):
+        """Load persisted activity for a user (e.g. at startup)"""
+        with self._cond:
+            state = self._state(user_id)
+            state['new'] += new_transactions
+            state['anomalies'] += anomalies
+            if last_fit is not None:
+                state['last_fit'] = last_fit
+            self._enqueue(user_id, state)
+
+    def record_batch(self, transactions):
+        """Record a processed batch of transactions"""
+        counts = {}
+        for txn in transactions:
+            user_id = txn.get('user_id')
+            if user_id:
+                counts[user_id] = counts.get(user_id, 0) + 1
+
+        with self._cond:
+            for user_id, count in counts.items():
+                state = self._state(user_id)
+                state['new'] += count
+                self._enqueue(user_id, state)
+
+    def record_anomaly(self, user_id):
+        """Record a confirmed anomaly for a user, boosting their priority"""
+        with self._cond:
+            state = self._state(user_id)
+            state['anomalies'] += 1
+            self._enqueue(user_id, state)
+
+    def forget(self, keep):
+        """Drop the state of users keep(user_id) rejects, e.g. users whose
+        partitions moved to another detector; returns the number dropped"""
+        with self._cond:
+            dropped = [user_id for user_id in self._users if not keep(user_id)]
+            for user_id in dropped:
+                del self._users[user_id]
+            self._heap = [
+                entry for entry in self._heap
+                if entry[2] in self._users and self._users[entry[2]]['version'] == entry[1]
+            ]
+            heapq.heapify(self._heap)
+            return len(dropped)
+
+    def pending(self):
+        """Number of users currently waiting for training"""
+        with self._cond:
+            return sum(1 for s in self._users.values() if self._eligible(s))
+
+    def start(self):
+        """Start the background training thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="training-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the background thread after the current job finishes"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _state(self, user_id):
+        state = self._users.get(user_id)
+        if state is None:
+            state = {'new': 0, 'anomalies': 0, 'last_fit': None, 'version': 0}
+            self._users[user_id] = state
+        return state
+
+    def _eligible(self, state):
+        return state['new'] >= self.min_new_transactions or (state['anomalies'] > 0 and state['new'] > 0)
+
+    def _priority(self, state, now):
+        """Higher is more urgent"""
+        if state['last_fit'] is None:
+            staleness = 1.0
+        else:
+            staleness = min((now - state['last_fit']) / self.stale_after, 24.0)
+        return state['new'] / self.min_new_transactions + self.anomaly_weight * state['anomalies'] + staleness
+
+    def _enqueue(self, user_id, state):
+        # Caller holds the lock
+        state['version'] += 1
+        if not self._eligible(state):
+            return
+        heapq.heappush(self._heap, (-self._priority(state, time.time()), state['version'], user_id))
+
+        # Drop stale entries once they dominate the heap
+        if len(self._heap) > 4 * len(self._users) + 64:
+            self._heap = [
+                entry for entry in self._heap
+                if self._users[entry[2]]['version'] == entry[1]
+            ]
+            heapq.heapify(self._heap)
+        self._cond.notify()
+
+    def _next_user(self):
+        """Pop the most urgent user, or None when stopping"""
+        with self._cond:
+            while not self._stopping:
+                while self._heap:
+                    _, version, user_id = heapq.heappop(self._heap)
+                    state = self._users[user_id]
+                    if state['version'] == version and self._eligible(state):
+                        # Reset the counters now so activity arriving during
+                        # training queues a fresh job
+                        state['new'] = 0
+                        state['anomalies'] = 0
+                        state['version'] += 1
+                        return user_id
+                self._cond.wait()
+            return None
+
+    def _run(self):
+        while True:
+            user_id = self._next_user()
+            if user_id is None:
+                return
+
+            started = time.time()
+            try:
+                trained = self.train_fn(user_id)
+            except Exception as e:
+                print(f"Error training model for user {user_id}: {e}")
+                trained = False
+            elapsed = time.time() - started
+
+            with self._cond:
+                if trained:
+                    # forget() may have dropped the user during training
+                    state = self._users.get(user_id)
+                    if state is not None:
+                        state['last_fit'] = time.time()
+                    self.trained += 1
+                else:
+                    self.failed += 1
+
+                # Stay within the CPU budget by idling in proportion to the
+                # time just spent training
+                resume_at = time.time() + elapsed * (1.0 - self.cpu_budget) / self.cpu_budget
+                while not self._stopping and time.time() < resume_at:
+                    self._cond.wait(resume_at - time.time())
@@ -0,0 +1,64 @@
+"""User Partitions Module
+
+The producer keys every transaction by its user_id, so Kafka's default
+partitioner (murmur2 of the key bytes) sends all of a user's transactions to
+the same partition and so to a single detector in the consumer group. That
+lets each detector keep per-user state (profiles, cached models) for its own
+users only.
+
+UserPartitionListener tracks the detector's assignment across rebalances and
+tells it which partitions were gained or lost, so it can load state for the
+new users and evict state for the users now owned by another detector.
+"""
+
+from kafka import ConsumerRebalanceListener
+from kafka.partitioner.default import murmur2
+
+def user_key(user_id):
+    """Message key for a user's transactions"""
+    return str(user_id).encode("utf-8")
+
+def partition_for(user_id, num_partitions):
+    """The partition the default partitioner picks for a user's key"""
+    return (murmur2(user_key(user_id)) & 0x7fffffff) % num_partitions
+
+class UserPartitionListener(ConsumerRebalanceListener):
+    """Rebalance listener that keeps per-user state in step with the
+    consumer's partitions of one topic
+
+    on_change(listener, gained, lost) is called from the consumer's poll
+    after every assignment that changes the partitions.
+    """
+
+    def __init__(self, consumer, topic, on_change):
+        self.consumer = consumer
+        self.topic = topic
+        self.on_change = on_change
+        self.partitions = frozenset()
+        self.num_partitions = None
+
+    def owns(self, user_id):
+        """Whether this consumer holds the partition of user_id (all users
+        until the first assignment)"""
+        if not self.num_partitions:
+            return True
+        return partition_for(user_id, self.num_partitions) in self.partitions
+
+    def on_partitions_revoked(self, revoked):
+        # With eager rebalancing every partition is revoked before the new
+        # assignment arrives. State is only evicted once that assignment is
+        # known, so partitions kept across the rebalance stay warm.
+        pass
+
+    def on_partitions_assigned(self, assigned):
+        previous = self.partitions if self.num_partitions else frozenset()
+        self.partitions = frozenset(tp.partition for tp in assigned if tp.topic == self.topic)
+        self.num_partitions = len(self.consumer.partitions_for_topic(self.topic) or ()) or None
+        gained, lost = self.partitions - previous, previous - self.partitions
+        print(f"Assigned {self.topic} partitions {sorted(self.partitions)} "
+              f"(gained {sorted(gained)}, lost {sorted(lost)})")
+        if gained or lost:
+            try:
+                self.on_change(self, gained, lost)
+            except Exception as e:
+                print(f"Failed to update per-user state after rebalance: {e}")
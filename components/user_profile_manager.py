@@ -3,7 +3,6 @@ Contributors:
 Kenil Gopani: Implemented the enhanced anomaly detection logic with user profiling and adaptive thresholds. Optimized model performance, managed containerized deployment infrastructure, and handled scalability testing under high-load scenarios.
 """
 
-import psycopg2
 import json
 import pandas as pd
 import numpy as np
@@ -12,39 +11,335 @@ import pickle
 from sklearn.preprocessing import StandardScaler
 import os
 
+from components.db_connection import get_pool, execute_prepared
+
+# Columns of the history frame used to train and score user models
+HISTORY_COLUMNS = [
+    'amount', 'location', 'transaction_type', 'merchant_category',
+    'payment_method', 'device_type', 'timestamp', 'hour_of_day', 'day_of_week'
+]
+
+NUMERIC_FEATURES = ['amount', 'hour_of_day', 'day_of_week']
+
+CATEGORICAL_PREFIXES = [
+    ('location', 'loc'),
+    ('transaction_type', 'txn_type'),
+    ('merchant_category', 'merch'),
+    ('payment_method', 'payment'),
+    ('device_type', 'device'),
+]
+
+# Transactions per user that profiles are computed from
+PROFILE_WINDOW = 100
+
+# Computes and upserts the profiles of many users in one statement, from each
+# user's last %(window)s normal transactions. Locations, merchants, payment
+# methods and hours count as usual when seen at least twice in the window.
+# %(user_ids)s = NULL computes every user with history.
+PROFILE_UPSERT = """
+    WITH recent AS (
+        SELECT user_id, location, merchant_category, amount, payment_method, device_type,
+               EXTRACT(HOUR FROM to_timestamp(timestamp))::int AS hour
+        FROM (
+            SELECT h.*, ROW_NUMBER() OVER (
+                PARTITION BY user_id ORDER BY timestamp DESC
+            ) AS rn
+            FROM transaction_history h
+            WHERE is_anomalous = FALSE
+              AND (%(user_ids)s::int[] IS NULL OR user_id = ANY(%(user_ids)s::int[]))
+        ) ranked
+        WHERE rn <= %(window)s
+    ),
+    totals AS (
+        SELECT user_id,
+               GREATEST(5, percentile_cont(0.05) WITHIN GROUP (ORDER BY amount)) AS typical_min_amount,
+               percentile_cont(0.95) WITHIN GROUP (ORDER BY amount) AS typical_max_amount,
+               AVG(amount) AS avg_transaction_amount,
+               to_jsonb((array_agg(DISTINCT device_type)
+                         FILTER (WHERE device_type != 'Unknown'))[1:10]) AS device_types
+        FROM recent
+        GROUP BY user_id
+    ),
+    frequent AS (
+        SELECT user_id,
+               jsonb_agg(value) FILTER (WHERE attribute = 'location') AS usual_locations,
+               jsonb_agg(value) FILTER (WHERE attribute = 'merchant') AS usual_merchants,
+               jsonb_agg(value) FILTER (WHERE attribute = 'payment') AS typical_payment_methods,
+               jsonb_agg(value) FILTER (WHERE attribute = 'hour') AS typical_transaction_times
+        FROM (
+            SELECT user_id, 'location' AS attribute, to_jsonb(location) AS value
+            FROM recent WHERE location != 'Unknown'
+            GROUP BY user_id, location HAVING COUNT(*) >= 2
+            UNION ALL
+            SELECT user_id, 'merchant', to_jsonb(merchant_category)
+            FROM recent WHERE merchant_category != 'Unknown'
+            GROUP BY user_id, merchant_category HAVING COUNT(*) >= 2
+            UNION ALL
+            SELECT user_id, 'payment', to_jsonb(payment_method)
+            FROM recent WHERE payment_method != 'Unknown'
+            GROUP BY user_id, payment_method HAVING COUNT(*) >= 2
+            UNION ALL
+            SELECT user_id, 'hour', to_jsonb(hour)
+            FROM recent
+            GROUP BY user_id, hour HAVING COUNT(*) >= 2
+        ) counted
+        GROUP BY user_id
+    )
+    INSERT INTO user_profiles (
+        user_id, usual_locations, usual_merchants,
+        typical_min_amount, typical_max_amount,
+        typical_payment_methods, typical_transaction_times,
+        avg_transaction_amount, model_score, merchant_categories, device_types,
+        last_updated
+    )
+    SELECT t.user_id,
+           COALESCE(f.usual_locations, '[]'),
+           COALESCE(f.usual_merchants, '[]'),
+           t.typical_min_amount,
+           t.typical_max_amount,
+           COALESCE(f.typical_payment_methods, '[]'),
+           COALESCE(f.typical_transaction_times, '[]'),
+           t.avg_transaction_amount,
+           LEAST(COALESCE(jsonb_array_length(f.usual_locations), 0) * 0.1
+                 + COALESCE(jsonb_array_length(f.usual_merchants), 0) * 0.05 + 0.5, 1.0),
+           -- merchants double as categories for the frontend
+           COALESCE(f.usual_merchants, '[]'),
+           COALESCE(t.device_types, '[]'),
+           NOW()
+    FROM totals t
+    LEFT JOIN frequent f ON f.user_id = t.user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        usual_locations = EXCLUDED.usual_locations,
+        usual_merchants = EXCLUDED.usual_merchants,
+        typical_min_amount = EXCLUDED.typical_min_amount,
+        typical_max_amount = EXCLUDED.typical_max_amount,
+        typical_payment_methods = EXCLUDED.typical_payment_methods,
+        typical_transaction_times = EXCLUDED.typical_transaction_times,
+        avg_transaction_amount = EXCLUDED.avg_transaction_amount,
+        model_score = EXCLUDED.model_score,
+        merchant_categories = EXCLUDED.merchant_categories,
+        device_types = EXCLUDED.device_types,
+        last_updated = NOW()
+"""
+
+def history_record(transaction):
+    """Return the transaction_history column values for a transaction message
+    
+    Columns: transaction_id, user_id, amount, currency, location, timestamp,
+    transaction_type, merchant_category, payment_method, device_type,
+    is_anomalous.
+    """
+    # Extract merchant category
+    merchant_category = "Unknown"
+    if 'merchant' in transaction and isinstance(transaction['merchant'], dict):
+        merchant_category = transaction['merchant'].get('category', 'Unknown')
+    
+    # Extract device type
+    device_type = "Unknown"
+    if 'device_info' in transaction and isinstance(transaction['device_info'], dict):
+        device_type = transaction['device_info'].get('type', 'Unknown')
+    
+    return (
+        transaction['transaction_id'],
+        transaction['user_id'],
+        transaction['amount'],
+        transaction.get('currency', 'USD'),
+        transaction.get('location', 'Unknown'),
+        transaction.get('timestamp', 0),
+        transaction.get('transaction_type', 'Unknown'),
+        merchant_category,
+        transaction.get('payment_method', 'Unknown'),
+        device_type,
+        transaction.get('_anomalous', False)
+    )
+
+def transactions_to_history_frame(transactions):
+    """Convert raw transaction messages into the history frame layout
+    
+    Hour and day of week are derived the same way PostgreSQL does for the
+    training query (UTC, day of week 0 = Sunday). The user_id column is kept
+    so callers can group the frame by user.
+    """
+    df = pd.DataFrame({
+        'user_id': [t.get('user_id') for t in transactions],
+        'amount': [t.get('amount') for t in transactions],
+        'location': [t.get('location', 'Unknown') for t in transactions],
+        'transaction_type': [t.get('transaction_type', 'Unknown') for t in transactions],
+        'merchant_category': [
+            t['merchant'].get('category', 'Unknown') if isinstance(t.get('merchant'), dict) else 'Unknown'
+            for t in transactions
+        ],
+        'payment_method': [t.get('payment_method', 'Unknown') for t in transactions],
+        'device_type': [
+            t['device_info'].get('type', 'Unknown') if isinstance(t.get('device_info'), dict) else 'Unknown'
+            for t in transactions
+        ],
+        'timestamp': [t.get('timestamp', 0) for t in transactions],
+    })
+    timestamps = pd.to_datetime(df['timestamp'], unit='s', utc=True)
+    df['hour_of_day'] = timestamps.dt.hour
+    df['day_of_week'] = (timestamps.dt.dayofweek + 1) % 7
+    return df
+
+def build_user_features(df, scaler=None, feature_columns=None):
+    """Build the user model feature matrix from a history frame
+    
+    With no scaler this is the training path: a new scaler is fitted and the
+    frame, scaler and resulting column order are returned. With a scaler and
+    feature_columns the frame is aligned to the saved schema (unseen
+    categories are dropped, missing ones are zero) and a float matrix is
+    returned for scoring.
+    """
+    features = pd.DataFrame(index=df.index)
+    for col in NUMERIC_FEATURES:
+        features[col] = df[col].astype(float)
+    features['is_weekend'] = (features['day_of_week'] >= 5).astype(int)
+    
+    # One-hot encoding for categorical features
+    dummies = [pd.get_dummies(df[col], prefix=prefix) for col, prefix in CATEGORICAL_PREFIXES]
+    features = pd.concat([features] + dummies, axis=1)
+    
+    # Fill missing values
+    features = features.fillna(0)
+    
+    if scaler is None:
+        scaler = StandardScaler()
+        features[NUMERIC_FEATURES] = scaler.fit_transform(features[NUMERIC_FEATURES])
+        return features, scaler, list(features.columns)
+    
+    features[NUMERIC_FEATURES] = scaler.transform(features[NUMERIC_FEATURES])
+    features = features.reindex(columns=feature_columns, fill_value=0)
+    return features.to_numpy(dtype=float)
+
+def fit_user_model(df):
+    """Fit a user model on a history frame (see HISTORY_COLUMNS)
+    
+    Returns (model, scaler, feature_columns).
+    """
+    features, scaler, feature_columns = build_user_features(df)
+    
+    # Train the model
+    model = IForest(
+        contamination=0.05,  # Lower contamination rate for user-specific models
+        n_estimators=100,
+        max_samples='auto',
+        random_state=42
+    )
+    model.fit(features.to_numpy(dtype=float))
+    return model, scaler, feature_columns
+
+def model_bundle_paths(models_dir, name):
+    """Return the model, scaler and feature schema paths of a saved model"""
+    return (
+        os.path.join(models_dir, f"{name}_model.pkl"),
+        os.path.join(models_dir, f"{name}_scaler.pkl"),
+        os.path.join(models_dir, f"{name}_features.json"),
+    )
+
+def save_model_bundle(models_dir, name, model, scaler, feature_columns):
+    """Save a model together with its scaler and feature schema"""
+    model_path, scaler_path, features_path = model_bundle_paths(models_dir, name)
+    
+    with open(model_path, 'wb') as f:
+        pickle.dump(model, f)
+    
+    with open(scaler_path, 'wb') as f:
+        pickle.dump(scaler, f)
+    
+    # The feature schema is written last so a reader never sees a schema
+    # that is newer than the model it describes
+    with open(features_path, 'w') as f:
+        json.dump(feature_columns, f)
+
+def load_model_bundle(models_dir, name, cache):
+    """Load (model, scaler, feature_columns) for a saved model, or None
+    
+    Loaded bundles are kept in ``cache`` and reloaded when the files on disk
+    change (e.g. after a retrain by another process).
+    """
+    model_path, scaler_path, features_path = model_bundle_paths(models_dir, name)
+    try:
+        mtime = os.path.getmtime(features_path)
+    except OSError:
+        # Models saved before the feature schema was stored can't be
+        # scored reliably, so those fall back to the global model
+        cache.pop(name, None)
+        return None
+    
+    cached = cache.get(name)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    
+    with open(model_path, 'rb') as f:
+        model = pickle.load(f)
+    
+    with open(scaler_path, 'rb') as f:
+        scaler = pickle.load(f)
+    
+    with open(features_path) as f:
+        feature_columns = json.load(f)
+    
+    entry = (model, scaler, feature_columns)
+    cache[name] = (mtime, entry)
+    return entry
+
+def score_results(model, scores):
+    """Turn raw decision_function scores into per-transaction results"""
+    # Normalize to 0-1 range (higher = more anomalous): 0 at the decision
+    # threshold, 1 at the most anomalous training sample. The threshold itself
+    # sits near zero for IForest, so it can't be used as the scale.
+    spread = max(float(np.max(model.decision_scores_)) - model.threshold_, 1e-9)
+    normalized = np.clip((scores - model.threshold_) / spread, 0, 1)
+    return [
+        {
+            'score': float(score),
+            'is_anomaly': bool(raw > model.threshold_),
+            'risk_level': 'high' if score > 0.8 else 'medium' if score > 0.6 else 'low'
+        }
+        for score, raw in zip(normalized, scores)
+    ]
+
 class UserProfileManager:
     """Class to manage user profiles and transaction history for anomaly detection"""
     
-    def __init__(self):
-        """Initialize the user profile manager"""
-        self.conn = psycopg2.connect(
-            dbname="anomalies",
-            user="user",
-            password="pass",
-            host="localhost",
-            port="5432",
-            connect_timeout=10
-        )
-        self.conn.set_session(autocommit=False)
+    def __init__(self, model_mode=None, history_source=None):
+        """Initialize the user profile manager
+        
+        model_mode selects how score_batch scores transactions: 'user' (one
+        model per user, the default) or 'cohort' (shared cohort models, see
+        components.cohort_models). Defaults to the USER_MODEL_MODE env var.
+        
+        history_source selects where training reads history from: 'db' (the
+        default) or 'archive' (the Parquet archive, see
+        components.history_archive). Defaults to the TRAINING_HISTORY_SOURCE
+        env var.
+        """
+        self.pool = get_pool()
+        self.conn = self.pool.getconn()
         self.cursor = self.conn.cursor()
         
         # Create directory for storing user models if it doesn't exist
         self.models_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "models")
         os.makedirs(self.models_dir, exist_ok=True)
+        
+        # bundle name -> (schema mtime, (model, scaler, feature_columns))
+        self._model_cache = {}
+        
+        self.model_mode = model_mode or os.environ.get("USER_MODEL_MODE", "user")
+        self.cohorts = None
+        if self.model_mode == "cohort":
+            from components.cohort_models import CohortModelManager
+            self.cohorts = CohortModelManager(self.conn, self.models_dir)
+            self.cohorts.load_assignments()
+        
+        self.archive = None
+        if (history_source or os.environ.get("TRAINING_HISTORY_SOURCE", "db")) == "archive":
+            from components.history_archive import HistoryArchive
+            self.archive = HistoryArchive()
     
     def store_transaction(self, transaction):
         """Store a transaction in the history table"""
         try:
-            # Extract merchant category
-            merchant_category = "Unknown"
-            if 'merchant' in transaction and isinstance(transaction['merchant'], dict):
-                merchant_category = transaction['merchant'].get('category', 'Unknown')
-            
-            # Extract device type
-            device_type = "Unknown"
-            if 'device_info' in transaction and isinstance(transaction['device_info'], dict):
-                device_type = transaction['device_info'].get('type', 'Unknown')
-            
             # Ensure user profile exists
             user_id = transaction['user_id']
             self.cursor.execute("SELECT 1 FROM user_profiles WHERE user_id = %s", (user_id,))
@@ -59,201 +354,128 @@ class UserProfileManager:
                 self.conn.commit()
             
             # Now insert the transaction
-            self.cursor.execute("""
-                INSERT INTO transaction_history (
-                    transaction_id, user_id, amount, currency, location, timestamp,
-                    transaction_type, merchant_category, payment_method, device_type,
-                    is_anomalous
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (transaction_id) DO NOTHING
-            """, (
-                transaction['transaction_id'],
-                user_id,
-                transaction['amount'],
-                transaction.get('currency', 'USD'),
-                transaction.get('location', 'Unknown'),
-                transaction.get('timestamp', 0),
-                transaction.get('transaction_type', 'Unknown'),
-                merchant_category,
-                transaction.get('payment_method', 'Unknown'),
-                device_type,
-                transaction.get('_anomalous', False)
-            ))
+            execute_prepared(self.cursor, "insert_history", history_record(transaction))
+            
+            # Maintain the per-user activity counters in the same commit;
+            # redelivered transactions (no row inserted) are not counted again
+            if self.cursor.rowcount == 1:
+                execute_prepared(self.cursor, "increment_activity", (user_id, transaction.get('timestamp', 0)))
             self.conn.commit()
             return True
         except Exception as e:
             print(f"Error storing transaction: {e}")
+            self.reconnect()
+            return False
+    
+    def record_anomalies(self, user_ids):
+        """Increment the anomaly counters of users with detected anomalies"""
+        counts = {}
+        for user_id in user_ids:
+            counts[int(user_id)] = counts.get(int(user_id), 0) + 1
+        if not counts:
+            return True
+        try:
+            self.cursor.executemany("""
+                INSERT INTO user_activity (user_id, anomaly_count)
+                VALUES (%s, %s)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    anomaly_count = user_activity.anomaly_count + EXCLUDED.anomaly_count
+            """, list(counts.items()))
+            self.conn.commit()
+            return True
+        except Exception as e:
+            print(f"Error recording anomalies: {e}")
             self.conn.rollback()
             return False
     
-    def update_user_profile(self, user_id):
-        """Update a user's profile based on their transaction history"""
+    def mark_models_fitted(self, user_ids):
+        """Reset the since-last-fit counters of users whose models were just trained"""
         try:
-            # Get user's transaction history
             self.cursor.execute("""
-                SELECT location, merchant_category, amount, payment_method, 
-                    EXTRACT(HOUR FROM to_timestamp(timestamp)) as hour
-                FROM transaction_history
-                WHERE user_id = %s AND is_anomalous = FALSE
-                ORDER BY timestamp DESC
-                LIMIT 100
-            """, (user_id,))
-            
-            rows = self.cursor.fetchall()
-            if not rows:
-                return False
-                
-            # Extract data
-            locations = [row[0] for row in rows if row[0] != 'Unknown']
-            merchants = [row[1] for row in rows if row[1] != 'Unknown']
-            amounts = [row[2] for row in rows]
-            payment_methods = [row[3] for row in rows if row[3] != 'Unknown']
-            hours = [int(row[4]) for row in rows]
-            
-            # Calculate profile attributes
-            usual_locations = list(set([loc for loc in locations if locations.count(loc) >= 2]))
-            usual_merchants = list(set([merch for merch in merchants if merchants.count(merch) >= 2]))
-            
-            if amounts:
-                # Convert numpy values to Python native float types
-                # Using float() conversion to ensure we don't pass numpy types to SQL
-                typical_min_amount = float(max(5, np.percentile(amounts, 5)))
-                typical_max_amount = float(np.percentile(amounts, 95))
-                # Calculate average transaction amount for the frontend
-                avg_transaction_amount = float(np.mean(amounts))
-            else:
-                typical_min_amount = 5.0
-                typical_max_amount = 1000.0
-                avg_transaction_amount = 100.0
-                
-            typical_payment_methods = list(set([pm for pm in payment_methods if payment_methods.count(pm) >= 2]))
-            typical_transaction_times = list(set([h for h in hours if hours.count(h) >= 2]))
-            
-            # Generate a simple model score (placeholder)
-            model_score = float(min(len(usual_locations) * 0.1 + len(usual_merchants) * 0.05 + 0.5, 1.0))
-            
-            # Get device types for frontend
-            self.cursor.execute("""
-                SELECT DISTINCT device_type FROM transaction_history 
-                WHERE user_id = %s AND device_type != 'Unknown' 
-                LIMIT 10
-            """, (user_id,))
-            device_types = [row[0] for row in self.cursor.fetchall()]
-            
-            # Update user profile with new fields for frontend compatibility
-            self.cursor.execute("""
-                INSERT INTO user_profiles (
-                    user_id, usual_locations, usual_merchants, 
-                    typical_min_amount, typical_max_amount, 
-                    typical_payment_methods, typical_transaction_times,
-                    avg_transaction_amount, model_score, merchant_categories, device_types,
-                    last_updated
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
-                ON CONFLICT (user_id) DO UPDATE SET
-                    usual_locations = EXCLUDED.usual_locations,
-                    usual_merchants = EXCLUDED.usual_merchants,
-                    typical_min_amount = EXCLUDED.typical_min_amount,
-                    typical_max_amount = EXCLUDED.typical_max_amount,
-                    typical_payment_methods = EXCLUDED.typical_payment_methods,
-                    typical_transaction_times = EXCLUDED.typical_transaction_times,
-                    avg_transaction_amount = EXCLUDED.avg_transaction_amount,
-                    model_score = EXCLUDED.model_score,
-                    merchant_categories = EXCLUDED.merchant_categories,
-                    device_types = EXCLUDED.device_types,
-                    last_updated = NOW()
-            """, (
-                user_id,
-                json.dumps(usual_locations),
-                json.dumps(usual_merchants),
-                typical_min_amount,
-                typical_max_amount,
-                json.dumps(typical_payment_methods),
-                json.dumps(typical_transaction_times),
-                avg_transaction_amount,
-                model_score,
-                json.dumps(usual_merchants),  # reusing merchants as categories for simplicity
-                json.dumps(device_types)
-            ))
-            
+                UPDATE user_activity
+                SET since_last_fit = 0, last_model_fit = NOW()
+                WHERE user_id = ANY(%s)
+            """, ([int(u) for u in user_ids],))
             self.conn.commit()
             return True
         except Exception as e:
-            print(f"Error updating user profile: {e}")
+            print(f"Error updating model fit counters: {e}")
             self.conn.rollback()
             return False
     
+    def get_training_candidates(self, min_transactions=20):
+        """Return users with at least min_transactions stored transactions"""
+        self.cursor.execute("""
+            SELECT user_id FROM user_activity
+            WHERE transaction_count >= %s
+            ORDER BY transaction_count DESC
+        """, (min_transactions,))
+        return [row[0] for row in self.cursor.fetchall()]
+    
+    def get_activity_backlog(self):
+        """Return (user_id, since_last_fit, last_model_fit epoch) for users
+        with transactions their model hasn't been trained on"""
+        self.cursor.execute("""
+            SELECT user_id, since_last_fit, EXTRACT(EPOCH FROM last_model_fit)
+            FROM user_activity
+            WHERE since_last_fit > 0
+        """)
+        return [
+            (row[0], int(row[1]), float(row[2]) if row[2] is not None else None)
+            for row in self.cursor.fetchall()
+        ]
+    
+    def update_user_profile(self, user_id):
+        """Update a user's profile based on their transaction history"""
+        return self.update_user_profiles([user_id]) == 1
+    
+    def update_user_profiles(self, user_ids=None, window=PROFILE_WINDOW):
+        """Recompute the profiles of many users (all users with history when
+        user_ids is None) in a single statement
+        
+        Returns the number of profiles written, or None on error.
+        """
+        try:
+            self.cursor.execute(PROFILE_UPSERT, {
+                'user_ids': [int(u) for u in user_ids] if user_ids is not None else None,
+                'window': window,
+            })
+            updated = self.cursor.rowcount
+            self.conn.commit()
+            return updated
+        except Exception as e:
+            print(f"Error updating user profiles: {e}")
+            self.conn.rollback()
+            return None
+    
     def train_user_model(self, user_id, min_transactions=20):
         """Train an anomaly detection model for a specific user"""
         try:
-            # Get user's transaction history
-            self.cursor.execute("""
-                SELECT amount, location, transaction_type, merchant_category, 
-                       payment_method, device_type, timestamp,
-                       EXTRACT(HOUR FROM to_timestamp(timestamp)) as hour_of_day,
-                       EXTRACT(DOW FROM to_timestamp(timestamp)) as day_of_week
-                FROM transaction_history
-                WHERE user_id = %s AND is_anomalous = FALSE
-                ORDER BY timestamp DESC
-                LIMIT 200
-            """, (user_id,))
+            if self.archive:
+                df = self.archive.training_histories([user_id]).drop(columns='user_id')
+            else:
+                # Get user's transaction history
+                self.cursor.execute("""
+                    SELECT amount, location, transaction_type, merchant_category, 
+                           payment_method, device_type, timestamp,
+                           EXTRACT(HOUR FROM to_timestamp(timestamp)) as hour_of_day,
+                           EXTRACT(DOW FROM to_timestamp(timestamp)) as day_of_week
+                    FROM transaction_history
+                    WHERE user_id = %s AND is_anomalous = FALSE
+                    ORDER BY timestamp DESC
+                    LIMIT 200
+                """, (user_id,))
+                
+                # Convert to DataFrame for easier processing
+                df = pd.DataFrame(self.cursor.fetchall(), columns=HISTORY_COLUMNS)
             
-            rows = self.cursor.fetchall()
-            if len(rows) < min_transactions:
+            if len(df) < min_transactions:
                 print(f"Not enough transactions for user {user_id} to train a model")
                 return False
             
-            # Convert to DataFrame for easier processing
-            df = pd.DataFrame(rows, columns=[
-                'amount', 'location', 'transaction_type', 'merchant_category', 
-                'payment_method', 'device_type', 'timestamp', 'hour_of_day', 'day_of_week'
-            ])
-            
-            # Feature engineering
-            features = pd.DataFrame()
-            features['amount'] = df['amount']
-            features['hour_of_day'] = df['hour_of_day']
-            features['day_of_week'] = df['day_of_week']
-            features['is_weekend'] = (df['day_of_week'] >= 5).astype(int)
-            
-            # One-hot encoding for categorical features
-            location_dummies = pd.get_dummies(df['location'], prefix='loc')
-            txn_type_dummies = pd.get_dummies(df['transaction_type'], prefix='txn_type')
-            merchant_dummies = pd.get_dummies(df['merchant_category'], prefix='merch')
-            payment_dummies = pd.get_dummies(df['payment_method'], prefix='payment')
-            device_dummies = pd.get_dummies(df['device_type'], prefix='device')
-            
-            # Combine features
-            features = pd.concat([features, location_dummies, txn_type_dummies, merchant_dummies, 
-                                 payment_dummies, device_dummies], axis=1)
-            
-            # Fill missing values
-            features = features.fillna(0)
-            
-            # Scale numerical features
-            numeric_features = ['amount', 'hour_of_day', 'day_of_week']
-            scaler = StandardScaler()
-            features[numeric_features] = scaler.fit_transform(features[numeric_features])
-            
-            # Train the model
-            model = IForest(
-                contamination=0.05,  # Lower contamination rate for user-specific models
-                n_estimators=100,
-                max_samples='auto',
-                random_state=42
-            )
-            model.fit(features)
-            
-            # Save the model and scaler
-            model_path = os.path.join(self.models_dir, f"user_{user_id}_model.pkl")
-            scaler_path = os.path.join(self.models_dir, f"user_{user_id}_scaler.pkl")
-            
-            with open(model_path, 'wb') as f:
-                pickle.dump(model, f)
-            
-            with open(scaler_path, 'wb') as f:
-                pickle.dump(scaler, f)
+            model, scaler, feature_columns = fit_user_model(df)
+            self.save_user_model(user_id, model, scaler, feature_columns)
+            self.mark_models_fitted([user_id])
             
             print(f"Trained and saved model for user {user_id}")
             return True
@@ -262,102 +484,229 @@ class UserProfileManager:
             print(f"Error training user model: {e}")
             return False
     
+    def get_training_histories(self, user_ids, limit=200):
+        """Fetch the training history of many users in one query
+        
+        Returns a DataFrame with a user_id column plus HISTORY_COLUMNS, holding
+        each user's latest ``limit`` normal transactions (the same window
+        train_user_model uses). Reads the Parquet archive when that is the
+        configured history source.
+        """
+        if self.archive:
+            return self.archive.training_histories(user_ids, limit)
+        
+        self.cursor.execute("""
+            SELECT user_id, amount, location, transaction_type, merchant_category,
+                   payment_method, device_type, timestamp,
+                   EXTRACT(HOUR FROM to_timestamp(timestamp)) as hour_of_day,
+                   EXTRACT(DOW FROM to_timestamp(timestamp)) as day_of_week
+            FROM (
+                SELECT *, ROW_NUMBER() OVER (
+                    PARTITION BY user_id ORDER BY timestamp DESC
+                ) AS rn
+                FROM transaction_history
+                WHERE user_id = ANY(%s) AND is_anomalous = FALSE
+            ) recent
+            WHERE rn <= %s
+        """, (list(user_ids), limit))
+        
+        return pd.DataFrame(self.cursor.fetchall(), columns=['user_id'] + HISTORY_COLUMNS)
+    
+    def iter_training_histories(self, user_ids, limit=200, chunk_size=50000):
+        """Yield (user_id, history frame) per user, for the same window as
+        get_training_histories
+        
+        Rows are streamed from a named (server-side) cursor ordered by user,
+        so only one chunk is held client-side at a time instead of the whole
+        result. The cursor runs on a connection of its own from the pool, so
+        the caller can keep writing and committing on this manager's
+        connection while it iterates.
+        """
+        if self.archive:
+            history = self.archive.training_histories(user_ids, limit)
+            for user_id, group in history.groupby('user_id', sort=False):
+                yield int(user_id), group.drop(columns='user_id')
+            return
+        
+        conn = self.pool.getconn()
+        cursor = conn.cursor(name="training_history_stream")
+        cursor.itersize = chunk_size
+        try:
+            cursor.execute("""
+                SELECT user_id, amount, location, transaction_type, merchant_category,
+                       payment_method, device_type, timestamp,
+                       EXTRACT(HOUR FROM to_timestamp(timestamp)) as hour_of_day,
+                       EXTRACT(DOW FROM to_timestamp(timestamp)) as day_of_week
+                FROM (
+                    SELECT *, ROW_NUMBER() OVER (
+                        PARTITION BY user_id ORDER BY timestamp DESC
+                    ) AS rn
+                    FROM transaction_history
+                    WHERE user_id = ANY(%s) AND is_anomalous = FALSE
+                ) recent
+                WHERE rn <= %s
+                ORDER BY user_id
+            """, (list(user_ids), limit))
+            
+            user_id, rows = None, []
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                for row in chunk:
+                    if row[0] != user_id and rows:
+                        yield int(user_id), pd.DataFrame(rows, columns=HISTORY_COLUMNS)
+                        rows = []
+                    user_id = row[0]
+                    rows.append(row[1:])
+                if not chunk:
+                    break
+            if rows:
+                yield int(user_id), pd.DataFrame(rows, columns=HISTORY_COLUMNS)
+        finally:
+            cursor.close()
+            conn.rollback()
+            self.pool.putconn(conn)
+    
+    def save_user_model(self, user_id, model, scaler, feature_columns):
+        """Save a trained user model together with its scaler and feature schema"""
+        save_model_bundle(self.models_dir, f"user_{user_id}", model, scaler, feature_columns)
+        self._model_cache.pop(f"user_{user_id}", None)
+    
+    def load_user_model(self, user_id):
+        """Load a user's model, scaler and feature schema, or None if unavailable"""
+        return load_model_bundle(self.models_dir, f"user_{user_id}", self._model_cache)
+    
+    def preload_models(self, limit=1000, owns=None):
+        """Load the models of the most active users (or all cohort models)
+        into the in-memory cache; returns the number loaded
+        
+        When owns(user_id) is given, users it rejects are skipped and the
+        limit counts only the users it accepts.
+        """
+        loaded = 0
+        try:
+            if self.cohorts is not None:
+                for cohort_id in {c for c, _ in self.cohorts.assignments.values()}:
+                    if self.cohorts.load_cohort_model(cohort_id) is not None:
+                        loaded += 1
+                return loaded
+            
+            if owns is None:
+                self.cursor.execute("""
+                    SELECT user_id FROM user_activity
+                    ORDER BY transaction_count DESC
+                    LIMIT %s
+                """, (limit,))
+                user_ids = [row[0] for row in self.cursor.fetchall()]
+            else:
+                # A named (server-side) cursor, so only the chunks needed to
+                # find limit owned users are fetched, not every user id
+                cursor = self.conn.cursor(name="preload_model_users")
+                cursor.itersize = 10000
+                try:
+                    cursor.execute("""
+                        SELECT user_id FROM user_activity
+                        ORDER BY transaction_count DESC
+                    """)
+                    user_ids = []
+                    while len(user_ids) < limit:
+                        rows = cursor.fetchmany(10000)
+                        if not rows:
+                            break
+                        user_ids.extend(row[0] for row in rows if owns(row[0]))
+                    user_ids = user_ids[:limit]
+                finally:
+                    cursor.close()
+            self.conn.commit()
+            for user_id in user_ids:
+                if self.load_user_model(user_id) is not None:
+                    loaded += 1
+        except Exception as e:
+            print(f"Error preloading models: {e}")
+            self.conn.rollback()
+        return loaded
+    
+    def evict_models(self, owns):
+        """Drop cached user models of users owns(user_id) rejects; returns
+        the number evicted"""
+        evicted = [name for name in self._model_cache
+                   if name.startswith("user_") and not owns(int(name[5:]))]
+        for name in evicted:
+            del self._model_cache[name]
+        return len(evicted)
+    
     def score_transaction(self, transaction):
         """Score a transaction based on user-specific model if available"""
-        user_id = transaction.get('user_id')
-        if not user_id:
+        if not transaction.get('user_id'):
             return None
+        return self.score_batch([transaction])[0]
+    
+    def score_batch(self, transactions):
+        """Score a micro-batch of transactions with the users' own models
         
-        model_path = os.path.join(self.models_dir, f"user_{user_id}_model.pkl")
-        scaler_path = os.path.join(self.models_dir, f"user_{user_id}_scaler.pkl")
+        Transactions are grouped by user_id and each group is scored with a
+        single decision_function call on a feature matrix built from the
+        schema saved at training time. In cohort mode the batch is grouped by
+        cohort instead and scored with the shared cohort models.
+        
+        Returns a list aligned with ``transactions``; entries are None when
+        the user has no model (the caller should use the global model).
+        """
+        results = [None] * len(transactions)
+        if not transactions:
+            return results
         
-        # If user model exists, use it. Otherwise return None to use global model
-        if not (os.path.exists(model_path) and os.path.exists(scaler_path)):
-            return None
-            
         try:
-            # Load model and scaler
-            with open(model_path, 'rb') as f:
-                model = pickle.load(f)
-                
-            with open(scaler_path, 'rb') as f:
-                scaler = pickle.load(f)
-            
-            # Extract features from the transaction
-            features = {}
-            features['amount'] = transaction['amount']
-            
-            # Get hour and day from timestamp
-            import datetime
-            dt = datetime.datetime.fromtimestamp(transaction['timestamp'])
-            features['hour_of_day'] = dt.hour
-            features['day_of_week'] = dt.weekday()
-            features['is_weekend'] = 1 if dt.weekday() >= 5 else 0
-            
-            # Categorical features
-            location = transaction.get('location', 'Unknown')
-            txn_type = transaction.get('transaction_type', 'Unknown')
-            
-            merchant_category = 'Unknown'
-            if 'merchant' in transaction and isinstance(transaction['merchant'], dict):
-                merchant_category = transaction['merchant'].get('category', 'Unknown')
+            df = transactions_to_history_frame(transactions)
+        except Exception as e:
+            print(f"Error preparing batch for user models: {e}")
+            return results
+        
+        if self.cohorts is not None:
+            try:
+                return self.cohorts.score_frame(df)
+            except Exception as e:
+                print(f"Error scoring transactions with cohort models: {e}")
+                return results
+        
+        for user_id, positions in df.groupby('user_id', sort=False).indices.items():
+            if pd.isna(user_id) or not user_id:
+                continue
+            
+            try:
+                loaded = self.load_user_model(int(user_id))
+                if loaded is None:
+                    continue
+                model, scaler, feature_columns = loaded
                 
-            payment_method = transaction.get('payment_method', 'Unknown')
-            
-            device_type = 'Unknown'
-            if 'device_info' in transaction and isinstance(transaction['device_info'], dict):
-                device_type = transaction['device_info'].get('type', 'Unknown')
-            
-            # We need to one-hot encode these features in exactly the same way as during training
-            # This is simplified for this example; in production, you'd want to save the encoders as well
-            # Here we'll use a simpler approach to demonstrate the concept
-            
-            # Get user's profile to see what features we need to encode
-            self.cursor.execute("SELECT * FROM user_profiles WHERE user_id = %s", (user_id,))
-            profile = self.cursor.fetchone()
-            
-            if not profile:
-                return None
+                features = build_user_features(df.iloc[positions], scaler, feature_columns)
+                scores = model.decision_function(features)
                 
-            # Create a limited feature vector (in production, would match exactly what was used in training)
-            feature_dict = {
-                'amount': scaler.transform([[features['amount'], features['hour_of_day'], features['day_of_week']]])[0][0],
-                'hour_of_day': scaler.transform([[features['amount'], features['hour_of_day'], features['day_of_week']]])[0][1],
-                'day_of_week': scaler.transform([[features['amount'], features['hour_of_day'], features['day_of_week']]])[0][2],
-                'is_weekend': features['is_weekend'],
-                f'loc_{location}': 1,
-                f'txn_type_{txn_type}': 1,
-                f'merch_{merchant_category}': 1,
-                f'payment_{payment_method}': 1,
-                f'device_{device_type}': 1
-            }
-            
-            # Convert to a format the model can use (simplified for demonstration)
-            # In production, you would match the exact feature vector used during training
-            # by saving the feature names and order during training
-            X = np.zeros(30)  # Assuming model was trained with 30 features
-            
-            # Get anomaly score
-            score = model.decision_function(np.array([X]))[0]
-            
-            # Normalize to 0-1 range (higher = more anomalous)
-            normalized_score = (score - model.threshold_) / (model.threshold_ * 2)
-            normalized_score = max(0, min(1, normalized_score))  # Clip to 0-1 range
-            
-            return {
-                'score': normalized_score,
-                'is_anomaly': model.predict(np.array([X]))[0] == 1,
-                'risk_level': 'high' if normalized_score > 0.8 else 'medium' if normalized_score > 0.6 else 'low'
-            }
-            
-        except Exception as e:
-            print(f"Error scoring transaction with user model: {e}")
-            return None
+                for position, result in zip(positions, score_results(model, scores)):
+                    results[position] = result
+            except Exception as e:
+                print(f"Error scoring transactions with model for user {user_id}: {e}")
+        
+        return results
+    
+    def reconnect(self):
+        """Roll back after an error, replacing the connection if it was lost"""
+        try:
+            self.conn.rollback()
+        except Exception:
+            pass
+        conn = self.pool.check(self.conn)
+        if conn is not self.conn:
+            self.conn = conn
+            self.cursor = conn.cursor()
+            if self.cohorts:
+                self.cohorts.conn = conn
+                self.cohorts.cursor = conn.cursor()
     
     def close(self):
-        """Close the database connection"""
-        if self.conn:
-            self.conn.close()
+        """Return the database connection to the pool"""
+        if getattr(self, 'conn', None):
+            self.pool.putconn(self.conn)
+            self.conn = None
     
     def __del__(self):
         """Clean up on object destruction"""
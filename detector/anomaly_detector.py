@@ -6,13 +6,21 @@ Kruti Bathani: Developed the transaction simulator to generate realistic synthet
 from kafka import KafkaConsumer
 from pyod.models.iforest import IForest
 import pandas as pd
-import psycopg2
 import json
 import time
 import os
 import sys
 import subprocess
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from components.db_connection import get_pool, execute_prepared
+from components.partitioning import create_table
+from components.rollups import create_rollup_tables, record_anomalies as record_rollups
+from components.dead_letter import DeadLetterQueue, InvalidRecord, parse_message
+from components.scored_stream import ScoredStream, scored_rows
+from components.dedupe import SeenFilter
+from components.graceful import GracefulShutdown, OffsetTracker, poll_messages
+
 # First, check if the database schema is correct
 def check_database_schema():
     """Check and initialize the database schema if needed"""
@@ -43,89 +51,62 @@ def check_database_schema():
 # Run schema check at startup
 check_database_schema()
 
-# Kafka consumer configuration
+# Kafka consumer configuration. Offsets are committed by hand, only past
+# batches that have been persisted; the tracker also forgets the partitions
+# a rebalance takes away
+offsets = OffsetTracker()
 consumer = KafkaConsumer(
-    'transactions',
     bootstrap_servers='localhost:9092',
-    value_deserializer=lambda m: json.loads(m.decode('utf-8')),
     auto_offset_reset='earliest',
-    enable_auto_commit=True,
+    enable_auto_commit=False,
     group_id='anomaly-detector-group'
 )
+consumer.subscribe(['transactions'], listener=offsets)
 
-# Connect to PostgreSQL with improved connection settings
-conn = psycopg2.connect(
-    dbname="anomalies",
-    user="user",
-    password="pass",
-    host="localhost",
-    port="5432",
-    # Add connection pool settings and timeout
-    connect_timeout=10
-)
-conn.set_session(autocommit=False)  # Explicit transaction control
+# Messages that fail decoding or validation are dead-lettered one by one
+# (DLQ_TOPIC or DLQ_FILE) so the rest of their batch is still scored
+dead_letters = DeadLetterQueue.from_env()
+
+# Redelivered transaction ids are dropped before they are stored or scored
+# again; ids are remembered once their batch is committed, and the filter is
+# checkpointed to Postgres and shared by the group
+DEDUPE_ENABLED = os.environ.get("DEDUPE", "1") != "0"
+DEDUPE_CHECKPOINT_SECONDS = int(os.environ.get("DEDUPE_CHECKPOINT_SECONDS", 60))
+seen_ids = SeenFilter(
+    'anomaly-detector-group',
+    window_seconds=int(os.environ.get("DEDUPE_WINDOW_SECONDS", 3600)),
+    capacity=int(os.environ.get("DEDUPE_CAPACITY", 1000000)),
+    error_rate=float(os.environ.get("DEDUPE_ERROR_RATE", 0.001))
+) if DEDUPE_ENABLED else None
+
+# Scored transactions are published for live dashboards (SCORED_CHANNEL,
+# SCORED_TOPIC)
+scored_stream = ScoredStream.from_env()
+
+# Take a connection from the shared pool
+db_pool = get_pool()
+conn = db_pool.getconn()
 cursor = conn.cursor()
 
 # Function to reconnect to database if connection is lost
 def reconnect_db():
     global conn, cursor
     try:
-        if conn.closed:
-            conn = psycopg2.connect(
-                dbname="anomalies",
-                user="user",
-                password="pass",
-                host="localhost",
-                port="5432",
-                connect_timeout=10
-            )
-            conn.set_session(autocommit=False)
-            cursor = conn.cursor()
-        else:
-            # Test if connection is still active
-            cursor.execute("SELECT 1")
+        conn.rollback()
+    except Exception:
+        pass
+    try:
+        conn = db_pool.check(conn)
+        cursor = conn.cursor()
     except Exception as e:
-        print(f"Reconnecting to database: {e}")
-        try:
-            if not conn.closed:
-                conn.close()
-            conn = psycopg2.connect(
-                dbname="anomalies",
-                user="user", 
-                password="pass",
-                host="localhost",
-                port="5432",
-                connect_timeout=10
-            )
-            conn.set_session(autocommit=False)
-            cursor = conn.cursor()
-        except Exception as e:
-            print(f"Failed to reconnect to database: {e}")
+        print(f"Failed to reconnect to database: {e}")
 
 # Create table if it doesn't exist for frauds with enhanced schema
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS frauds (
-        transaction_id TEXT PRIMARY KEY,
-        user_id INT,
-        amount FLOAT,
-        currency TEXT,
-        location TEXT,
-        timestamp FLOAT,
-        transaction_type TEXT,
-        merchant_id TEXT,
-        merchant_name TEXT,
-        merchant_category TEXT,
-        payment_method TEXT,
-        device_type TEXT,
-        ip_address TEXT,
-        is_confirmed_fraud BOOLEAN DEFAULT FALSE,
-        detection_score FLOAT,
-        risk_level TEXT,
-        detection_time TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-        detection_features JSONB,
-        notes TEXT
-    )
-""")
+create_table(cursor, "frauds")
+create_rollup_tables(cursor)
+if seen_ids is not None:
+    seen_ids.create_table(cursor)
+    seen_ids.restore(cursor)
 conn.commit()
 print("Verified frauds table schema")
 
@@ -154,38 +135,34 @@ print("Listening for transactions...")
 batch = []
 BATCH_SIZE = 10
 
-for msg in consumer:
-    txn = msg.value
-    batch.append(txn)
+# Whether the last batch failed to persist; the seen-id filter isn't
+# checkpointed on shutdown then
+last_batch_failed = False
 
-    if len(batch) >= BATCH_SIZE:
-        # Increment total processed transactions count and update timestamp
-        num_in_batch = len(batch)
+# SIGTERM/SIGINT stop the polling; the partial batch is then scored and
+# persisted, and offsets are committed only for persisted batches
+shutdown = GracefulShutdown(float(os.environ.get("DRAIN_TIMEOUT_SECONDS", 20)))
+
+# msg is None once, after a shutdown request, to flush the partial batch
+for msg in poll_messages(consumer, shutdown):
+    if msg is not None:
+        offsets.track(msg)
         try:
-            cursor.execute("""
-                UPDATE processing_stats
-                SET count_value = count_value + %s,
-                    last_updated_timestamp = NOW()
-                WHERE counter_name = 'total_transactions_processed'
-            """, (num_in_batch,))
-            conn.commit()
-            print(f"Incremented total_transactions_processed by {num_in_batch} and updated timestamp")
-        except Exception as e:
-            print(f"Failed to update transaction count: {e}")
-            conn.rollback()  # Rollback the failed transaction
-            # Try to reconnect if connection might be stale
-            try:
-                conn.close()
-                conn = psycopg2.connect(
-                    dbname="anomalies",
-                    user="user",
-                    password="pass",
-                    host="localhost",
-                    port="5432"
-                )
-                cursor = conn.cursor()
-            except:
-                print("Failed to reconnect to database")
+            txn = parse_message(msg.value)
+        except InvalidRecord as e:
+            dead_letters.record(msg, e)
+            continue
+        if seen_ids is not None and seen_ids.check_and_add(txn.get('transaction_id')):
+            continue
+        batch.append(txn)
+
+    if len(batch) >= BATCH_SIZE or (msg is None and batch):
+        num_in_batch = len(batch)
+        # The offsets behind this batch; they only become committable once
+        # the batch is in the database
+        batch_offsets = offsets.take()
+        batch_ids = [txn.get('transaction_id') for txn in batch]
+        last_batch_failed = True
 
         df = pd.DataFrame(batch)
         batch = []
@@ -286,6 +263,8 @@ for msg in consumer:
 
             # Get anomalies
             anomalies = df[df['anomaly'] == 1]
+            # Newly inserted frauds, counted into the dashboard rollups
+            new_anomalies = []
             
             for _, row in anomalies.iterrows():
                 # Extract merchant info if available
@@ -346,29 +325,7 @@ for msg in consumer:
                         print(f"Error: Missing columns in frauds table: {missing_columns}")
                         print("Attempting to recreate table with correct schema...")
                         cursor.execute("DROP TABLE IF EXISTS frauds")
-                        cursor.execute("""
-                            CREATE TABLE frauds (
-                                transaction_id TEXT PRIMARY KEY,
-                                user_id INT,
-                                amount FLOAT,
-                                currency TEXT,
-                                location TEXT,
-                                timestamp FLOAT,
-                                transaction_type TEXT,
-                                merchant_id TEXT,
-                                merchant_name TEXT,
-                                merchant_category TEXT,
-                                payment_method TEXT,
-                                device_type TEXT,
-                                ip_address TEXT,
-                                is_confirmed_fraud BOOLEAN DEFAULT FALSE,
-                                detection_score FLOAT,
-                                risk_level TEXT,
-                                detection_time TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                                detection_features JSONB,
-                                notes TEXT
-                            )
-                        """)
+                        create_table(cursor, "frauds")
                         conn.commit()
                         print("Recreated frauds table with correct schema")
                     
@@ -381,11 +338,12 @@ for msg in consumer:
                             detection_features
                         )
                         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (transaction_id) DO UPDATE SET
+                        ON CONFLICT (transaction_id, timestamp) DO UPDATE SET
                             detection_score = EXCLUDED.detection_score,
                             risk_level = EXCLUDED.risk_level,
                             detection_features = EXCLUDED.detection_features,
                             detection_time = NOW()
+                        RETURNING (xmax = 0) AS inserted
                     """, (
                         transaction_id,
                         int(row.user_id),  # Ensure proper type conversion
@@ -404,35 +362,14 @@ for msg in consumer:
                         risk_level,
                         json.dumps(feature_dict)
                     ))
+                    inserted = cursor.fetchone()[0]
                 except Exception as e:
                     print(f"Error during insert attempt: {e}")
                     # If the table is missing, let's recreate it
                     if "relation" in str(e) and "does not exist" in str(e):
                         try:
                             cursor.execute("DROP TABLE IF EXISTS frauds")
-                            cursor.execute("""
-                                CREATE TABLE frauds (
-                                    transaction_id TEXT PRIMARY KEY,
-                                    user_id INT,
-                                    amount FLOAT,
-                                    currency TEXT,
-                                    location TEXT,
-                                    timestamp FLOAT,
-                                    transaction_type TEXT,
-                                    merchant_id TEXT,
-                                    merchant_name TEXT,
-                                    merchant_category TEXT,
-                                    payment_method TEXT,
-                                    device_type TEXT,
-                                    ip_address TEXT,
-                                    is_confirmed_fraud BOOLEAN DEFAULT FALSE,
-                                    detection_score FLOAT,
-                                    risk_level TEXT,
-                                    detection_time TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                                    detection_features JSONB,
-                                    notes TEXT
-                                )
-                            """)
+                            create_table(cursor, "frauds")
                             conn.commit()
                             print("Created missing frauds table, retrying insert")
                             
@@ -463,14 +400,41 @@ for msg in consumer:
                                 risk_level,
                                 json.dumps(feature_dict)
                             ))
+                            inserted = True
                         except Exception as inner_e:
                             print(f"Second attempt also failed: {inner_e}")
-                            conn.rollback()
+                            raise
                     else:
-                        conn.rollback()
+                        # The batch is persisted whole or not at all: the
+                        # handler below rolls it back and holds its offsets
+                        raise
+
+                if inserted:
+                    new_anomalies.append({
+                        'timestamp': row.timestamp,
+                        'amount': row.amount,
+                        'detection_score': row.detection_score,
+                        'model_used': 'global',
+                        'risk_level': str(risk_level)
+                    })
 
             try:
+                # The batch is counted in the same commit as its anomalies,
+                # so a batch that fails (and is redelivered) isn't counted
+                execute_prepared(cursor, "increment_processed", (num_in_batch,))
+                dead_letters.report(cursor)
+                # Every scored transaction goes to the live stream; the
+                # notifications are delivered with this commit
+                scored = scored_rows(df)
+                scored_stream.notify(cursor, scored)
+                record_rollups(cursor, new_anomalies)
                 conn.commit()
+                offsets.persisted(batch_offsets)
+                last_batch_failed = False
+                if seen_ids is not None:
+                    seen_ids.confirm(batch_ids)
+                scored_stream.send(scored)
+                print(f"Incremented total_transactions_processed by {num_in_batch} and updated timestamp")
                 print(f"Inserted {len(anomalies)} anomalies")
                 
                 # Print detailed information about each detected anomaly
@@ -494,20 +458,11 @@ for msg in consumer:
                         print("-" * 90)
             except Exception as e:
                 print(f"Failed to insert anomalies: {e}")
-                conn.rollback()
-                # Try to reconnect if connection might be stale
-                try:
-                    conn.close()
-                    conn = psycopg2.connect(
-                        dbname="anomalies",
-                        user="user",
-                        password="pass",
-                        host="localhost",
-                        port="5432"
-                    )
-                    cursor = conn.cursor()
-                except:
-                    print("Failed to reconnect to database")
+                # Roll back, and reconnect if the connection went stale
+                reconnect_db()
+                offsets.failed(batch_offsets)
+                if seen_ids is not None:
+                    seen_ids.release(batch_ids)
                 continue
 
             # Update performance metrics
@@ -560,4 +515,44 @@ for msg in consumer:
                 conn.rollback()
             except:
                 pass
+            # Not persisted: hold its partitions so it is redelivered
+            offsets.failed(batch_offsets)
+            if seen_ids is not None:
+                seen_ids.release(batch_ids)
             continue
+
+        # The batch is persisted, so its offsets can be committed
+        offsets.commit(consumer)
+
+        # Checkpoint the seen-id filter and the suppressed-duplicate count;
+        # it only holds the ids of committed batches
+        if seen_ids is not None and time.time() - seen_ids.last_checkpoint >= DEDUPE_CHECKPOINT_SECONDS:
+            try:
+                seen_ids.checkpoint(cursor)
+                conn.commit()
+                if seen_ids.suppressed:
+                    print(f"Suppressed {seen_ids.suppressed} duplicate transactions so far")
+            except Exception as e:
+                print(f"Failed to checkpoint seen transaction ids: {e}")
+                seen_ids.last_checkpoint = time.time()
+                reconnect_db()
+
+# Drain: the last batch has been handled above. Anything consumed after it
+# was dead-lettered or a duplicate, so its offsets can go too; a hold left
+# by a batch that couldn't be persisted still applies.
+offsets.persisted(offsets.take())
+offsets.commit(consumer)
+try:
+    if seen_ids is not None and not last_batch_failed:
+        seen_ids.checkpoint(cursor)
+    dead_letters.report(cursor)
+    conn.commit()
+except Exception as e:
+    print(f"Failed to flush counters on shutdown: {e}")
+    conn.rollback()
+consumer.close(autocommit=False)
+scored_stream.close()
+dead_letters.close()
+db_pool.putconn(conn)
+shutdown.finish()
+print("Detector shut down cleanly")
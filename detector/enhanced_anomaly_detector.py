@@ -5,18 +5,36 @@ Kruti Bathani: Developed the core anomaly detector services and Kafka-based stre
 """
 
 from kafka import KafkaConsumer
+from kafka.structs import TopicPartition
 from pyod.models.iforest import IForest
 import pandas as pd
-import psycopg2
 import json
 import time
 import os
 import sys
 import subprocess
+import threading
 
 # Fix import path for components
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from components.user_profile_manager import UserProfileManager
+from components.user_profile_manager import UserProfileManager, transactions_to_history_frame
+from components.training_scheduler import TrainingScheduler
+from components.profile_rules import ProfileTable, ProfileRules, NORMAL, VIOLATION
+from components.health import HealthServer
+from components.db_connection import get_pool, execute_prepared
+from components.partitioning import create_table
+from components.rollups import create_rollup_tables, record_anomalies as record_rollups
+from components.user_partitions import UserPartitionListener
+from components.dead_letter import DeadLetterQueue, InvalidRecord, parse_message
+from components.scored_stream import ScoredStream, scored_rows
+from components.dedupe import SeenFilter
+from components.graceful import GracefulShutdown, OffsetTracker, poll_messages
+
+# Health endpoint comes up first so supervisors can see the detector is alive
+# while it warms up; /ready only succeeds once warm-up has finished
+startup_started = time.time()
+health = HealthServer(int(os.environ.get("HEALTH_PORT", 8085)))
+health.start()
 
 # First, check if the database schema is correct
 def check_database_schema():
@@ -66,91 +84,91 @@ check_database_schema()
 user_manager = UserProfileManager()
 print("Initialized user profile manager")
 
-# Kafka consumer configuration
+# User model training runs in a background thread on its own connection so it
+# never blocks scoring. Cohort models are trained offline by
+# scripts/train_cohort_models.py, so no scheduler runs in cohort mode.
+training_scheduler = None
+if user_manager.model_mode != "cohort":
+    trainer_manager = UserProfileManager()
+    training_scheduler = TrainingScheduler(
+        trainer_manager.train_user_model,
+        min_new_transactions=int(os.environ.get("TRAINING_MIN_NEW_TRANSACTIONS", 20)),
+        cpu_budget=float(os.environ.get("TRAINING_CPU_BUDGET", 0.25))
+    )
+    
+    # Resume from the persisted activity counters so users with untrained
+    # history are queued straight away after a restart
+    try:
+        for user_id, since_last_fit, last_fit in trainer_manager.get_activity_backlog():
+            training_scheduler.seed(user_id, new_transactions=since_last_fit, last_fit=last_fit)
+    except Exception as e:
+        print(f"Could not load user activity backlog: {e}")
+        trainer_manager.conn.rollback()
+    training_scheduler.start()
+    print("Started background model training scheduler")
+else:
+    print(f"Scoring with cohort models ({len(user_manager.cohorts.assignments)} users assigned)")
+
+# Kafka consumer configuration. Transactions are keyed by user_id, so each
+# detector in the group sees all transactions of the users on its partitions
+# and only keeps profiles and models for those users.
+TOPIC = 'transactions'
 consumer = KafkaConsumer(
-    'transactions',
     bootstrap_servers='localhost:9092',
-    value_deserializer=lambda m: json.loads(m.decode('utf-8')),
     auto_offset_reset='earliest',
-    enable_auto_commit=True,
+    enable_auto_commit=False,
     group_id='anomaly-detector-group'
 )
 
-# Connect to PostgreSQL with improved connection settings
-conn = psycopg2.connect(
-    dbname="anomalies",
-    user="user",
-    password="pass",
-    host="localhost",
-    port="5432",
-    connect_timeout=10
-)
-conn.set_session(autocommit=False)  # Explicit transaction control
+# Messages that fail decoding or validation are dead-lettered one by one
+# (DLQ_TOPIC or DLQ_FILE) so the rest of their batch is still scored
+dead_letters = DeadLetterQueue.from_env()
+
+# Redelivered transaction ids are dropped before they are stored or scored
+# again; ids are remembered once their batch is committed, and the filter is
+# checkpointed to Postgres and shared by the group
+DEDUPE_ENABLED = os.environ.get("DEDUPE", "1") != "0"
+DEDUPE_CHECKPOINT_SECONDS = int(os.environ.get("DEDUPE_CHECKPOINT_SECONDS", 60))
+seen_ids = SeenFilter(
+    'anomaly-detector-group',
+    window_seconds=int(os.environ.get("DEDUPE_WINDOW_SECONDS", 3600)),
+    capacity=int(os.environ.get("DEDUPE_CAPACITY", 1000000)),
+    error_rate=float(os.environ.get("DEDUPE_ERROR_RATE", 0.001))
+) if DEDUPE_ENABLED else None
+
+# Scored transactions are published for live dashboards (SCORED_CHANNEL,
+# SCORED_TOPIC)
+scored_stream = ScoredStream.from_env()
+
+# Take a connection from the shared pool for the detector's own writes
+db_pool = get_pool()
+conn = db_pool.getconn()
 cursor = conn.cursor()
 
 # Function to reconnect to database if connection is lost
 def reconnect_db():
     global conn, cursor
     try:
-        if conn.closed:
-            conn = psycopg2.connect(
-                dbname="anomalies",
-                user="user",
-                password="pass",
-                host="localhost",
-                port="5432",
-                connect_timeout=10
-            )
-            conn.set_session(autocommit=False)
-            cursor = conn.cursor()
-        else:
-            # Test if connection is still active
-            cursor.execute("SELECT 1")
+        conn.rollback()
+    except Exception:
+        pass
+    try:
+        conn = db_pool.check(conn)
+        cursor = conn.cursor()
     except Exception as e:
-        print(f"Reconnecting to database: {e}")
-        try:
-            if not conn.closed:
-                conn.close()
-            conn = psycopg2.connect(
-                dbname="anomalies",
-                user="user", 
-                password="pass",
-                host="localhost",
-                port="5432",
-                connect_timeout=10
-            )
-            conn.set_session(autocommit=False)
-            cursor = conn.cursor()
-        except Exception as e:
-            print(f"Failed to reconnect to database: {e}")
+        print(f"Failed to reconnect to database: {e}")
+    user_manager.reconnect()
 
-# Create table if it doesn't exist for frauds with enhanced schema
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS frauds (
-        transaction_id TEXT PRIMARY KEY,
-        user_id INT,
-        amount FLOAT,
-        currency TEXT,
-        location TEXT,
-        timestamp FLOAT,
-        transaction_type TEXT,
-        merchant_id TEXT,
-        merchant_name TEXT,
-        merchant_category TEXT,
-        payment_method TEXT,
-        device_type TEXT,
-        ip_address TEXT,
-        is_confirmed_fraud BOOLEAN DEFAULT FALSE,
-        detection_score FLOAT,
-        risk_level TEXT,
-        detection_time TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-        detection_features JSONB,
-        notes TEXT,
-        model_used TEXT DEFAULT 'global'
-    )
-""")
+# Create the (partitioned) frauds and history tables if they don't exist,
+# and make sure this month's and the upcoming partitions are in place
+create_table(cursor, "frauds")
+create_table(cursor, "transaction_history")
+create_rollup_tables(cursor)
+if seen_ids is not None:
+    seen_ids.create_table(cursor)
+    seen_ids.restore(cursor)
 conn.commit()
-print("Verified frauds table schema")
+print("Verified frauds and transaction_history table schema")
 
 # Create table for processing stats if it doesn't exist
 cursor.execute("""
@@ -170,63 +188,482 @@ cursor.execute("""
 """)
 conn.commit()
 
+# Profile rule prefilter: checks each batch against the stored user profiles
+# so clearly normal transactions skip the models and blatant violations are
+# flagged immediately
+PROFILE_RULES_ENABLED = os.environ.get("PROFILE_RULES", "1") != "0"
+PROFILE_REFRESH_SECONDS = int(os.environ.get("PROFILE_REFRESH_SECONDS", 300))
+profile_rules = None
+profile_refresh = None
+next_profile_refresh = 0.0
+
+def load_profile_rules(db_conn):
+    """Load the profile table on db_conn and swap it into the prefilter"""
+    global profile_rules
+    try:
+        table = ProfileTable.load(db_conn, owns=partitions.owns)
+        db_conn.commit()
+        profile_rules = ProfileRules(table)
+        health.update_stats(profiles_loaded=len(table))
+        print(f"Loaded {len(table)} user profiles for rule prefilter "
+              f"({table.nbytes / 1e6:.1f} MB)")
+    except Exception as e:
+        print(f"Failed to load user profiles for rule prefilter: {e}")
+        db_conn.rollback()
+
+def refresh_profile_rules(background=False):
+    """(Re)load the in-memory profile table used by the rule prefilter
+
+    In the background the table is built on a connection of its own and
+    swapped in when complete, so the consume loop keeps scoring with the
+    current one instead of stalling on a full user_profiles read.
+    """
+    global profile_refresh, next_profile_refresh
+    next_profile_refresh = time.time() + PROFILE_REFRESH_SECONDS
+    if not background:
+        load_profile_rules(conn)
+        return
+    if profile_refresh is not None and profile_refresh.is_alive():
+        # Run again once this one is done, e.g. for a new assignment
+        next_profile_refresh = 0.0
+        return
+
+    def run():
+        try:
+            with db_pool.connection() as refresh_conn:
+                load_profile_rules(refresh_conn)
+        except Exception as e:
+            print(f"Failed to refresh user profiles for rule prefilter: {e}")
+
+    profile_refresh = threading.Thread(target=run, name="profile-refresh", daemon=True)
+    profile_refresh.start()
+
+PRELOAD_MODELS = int(os.environ.get("PRELOAD_MODELS", 1000))
+
+def on_partitions_changed(listener, gained, lost):
+    """Rebalance: drop the state of users now on other detectors and warm
+    the profiles and models of the users on the new partitions"""
+    evicted = user_manager.evict_models(listener.owns)
+    # Whoever consumes the lost partitions next starts from their committed
+    # offsets, so nothing tracked for them applies any more
+    offsets.forget(TopicPartition(TOPIC, p) for p in lost)
+    if batch_in_flight is not None:
+        for p in lost:
+            batch_in_flight['offsets'].pop(TopicPartition(TOPIC, p), None)
+    if seen_ids is not None and gained:
+        # Pick up the ids the partitions' previous owner checkpointed
+        try:
+            seen_ids.restore(cursor)
+            conn.commit()
+        except Exception as e:
+            print(f"Failed to restore seen transaction ids: {e}")
+            conn.rollback()
+    if training_scheduler is not None:
+        training_scheduler.forget(listener.owns)
+    if PROFILE_RULES_ENABLED:
+        refresh_profile_rules(background=True)
+    loaded = user_manager.preload_models(PRELOAD_MODELS, owns=listener.owns) if gained else 0
+    print(f"Rebalanced: evicted {evicted} cached models, preloaded {loaded}")
+    health.update_stats(
+        partitions=sorted(listener.partitions),
+        models_preloaded=loaded
+    )
+
+partitions = UserPartitionListener(consumer, TOPIC, on_partitions_changed)
+consumer.subscribe([TOPIC], listener=partitions)
+
+# Warm-up: load all profiles in one streamed query and preload the models of
+# the most active users, so the first batches don't pay for cold caches. The
+# partitions aren't known until the first poll, so this covers every user and
+# the first assignment then trims it to this detector's share.
+if PROFILE_RULES_ENABLED:
+    refresh_profile_rules()
+
+preloaded = user_manager.preload_models(PRELOAD_MODELS)
+print(f"Preloaded {preloaded} {user_manager.model_mode} models")
+
+startup_seconds = time.time() - startup_started
+health.update_stats(
+    startup_seconds=round(startup_seconds, 2),
+    profiles_loaded=len(profile_rules.table) if profile_rules else 0,
+    models_preloaded=preloaded
+)
+health.set_ready()
+print(f"Detector ready after {startup_seconds:.2f}s warm-up")
+
 print("Listening for transactions...")
 
-# Buffer to hold incoming messages
+
+# Buffer to hold incoming messages, and the consumed messages behind them
 batch = []
+batch_messages = []
 BATCH_SIZE = 10  # We'll keep the batch processing but enhance it
 
-for msg in consumer:
-    txn = msg.value
-    
-    # First, store this transaction in the history for future model training
-    user_manager.store_transaction(txn)
-    
-    batch.append(txn)
+# A batch whose writes fail is retried this many times, with backoff, and
+# then dead-lettered, so one bad row can't hold up its partitions
+PERSIST_ATTEMPTS = int(os.environ.get("PERSIST_ATTEMPTS", 3))
 
-    if len(batch) >= BATCH_SIZE:
-        # Increment total processed transactions count
-        num_in_batch = len(batch)
+def persist_batch(df, anomalies, num_in_batch, features=None):
+    """Write a scored batch in one transaction: its frauds, the processed
+    count, the rollups and the live-stream notifications
+
+    Returns the anomalies the upsert newly inserted. Raises if any write
+    fails, leaving the transaction for the caller to roll back, so a failed
+    batch is neither half stored nor counted.
+    """
+    new_anomalies = []
+    for _, row in anomalies.iterrows():
+        # Extract merchant info if available
+        merchant_id = "unknown"
+        merchant_name = "unknown"
+        merchant_category = "unknown"
+        if 'merchant' in row and isinstance(row.merchant, dict):
+            merchant_id = row.merchant.get('merchant_id', "unknown")
+            merchant_name = row.merchant.get('name', "unknown")
+            merchant_category = row.merchant.get('category', "unknown")
+
+        # Extract device info if available
+        device_type = "unknown"
+        ip_address = "unknown"
+        if 'device_info' in row and isinstance(row.device_info, dict):
+            device_type = row.device_info.get('type', "unknown")
+            ip_address = row.device_info.get('ip_address', "unknown")
+
+        # Get transaction ID if available, otherwise generate one
+        transaction_id = row.get('transaction_id', f"AUTOGEN-{int(time.time())}-{row.user_id}")
+
+        # Get risk level and model used
+        risk_level = row.get('risk_level', 'medium')
+        model_used = row.get('model_used', 'global')
+
+        # Capture the most important features that contributed to the detection
+        feature_dict = {}
+        if isinstance(features, pd.DataFrame) and not features.empty:
+            # Get the row of features for this transaction
+            idx = df.index[df['transaction_id'] == transaction_id][0] if 'transaction_id' in df.columns else _
+            try:
+                row_features = features.iloc[idx].to_dict()
+                # Keep the top 5 most important features
+                sorted_features = sorted(row_features.items(), key=lambda x: abs(x[1]) if isinstance(x[1], (int, float)) else 0, reverse=True)
+                feature_dict = {k: float(v) if isinstance(v, (int, float)) else str(v) for k, v in sorted_features[:5]}
+            except:
+                # Can't get features, just use a placeholder
+                feature_dict = {"info": "Features not available"}
+
+        # Insert into frauds table with model used
+        execute_prepared(cursor, "upsert_fraud", (
+            transaction_id,
+            int(row.user_id),
+            float(row.amount),
+            row.get('currency', "USD"),
+            row.location,
+            float(row.timestamp),
+            row.get('transaction_type', "unknown"),
+            merchant_id,
+            merchant_name,
+            merchant_category,
+            row.get('payment_method', "unknown"),
+            device_type,
+            ip_address,
+            float(row.detection_score),
+            risk_level,
+            json.dumps(feature_dict),
+            model_used
+        ))
+        if cursor.fetchone()[0]:
+            new_anomalies.append({
+                'user_id': int(row.user_id),
+                'timestamp': row.timestamp,
+                'amount': row.amount,
+                'detection_score': row.detection_score,
+                'model_used': model_used,
+                'risk_level': str(risk_level)
+            })
+
+    execute_prepared(cursor, "increment_processed", (num_in_batch,))
+    dead_letters.report(cursor)
+    # Every scored transaction goes to the live stream; the notifications
+    # are delivered with this commit
+    scored = scored_rows(df)
+    scored_stream.notify(cursor, scored)
+    record_rollups(cursor, new_anomalies)
+    conn.commit()
+    scored_stream.send(scored)
+    return new_anomalies
+
+# Whether the last batch failed to persist; the seen-id filter isn't
+# checkpointed on shutdown then
+last_batch_failed = False
+
+# With ASYNC_DB=1 a batch's writes (history, frauds, rollups and counters,
+# pipelined in one transaction) go to a background event loop and the next
+# batch is scored while they are in flight. At most one batch is in flight;
+# its offsets are committed once it has landed. Since a batch's history rows
+# are only written with it, the profile refresh before scoring doesn't see
+# them, and the activity counts behind the retraining triggers trail by a
+# batch.
+ASYNC_DB = os.environ.get("ASYNC_DB", "0") == "1"
+async_writer = None
+batch_in_flight = None
+if ASYNC_DB:
+    from components.async_db import AsyncBatchWriter
+    async_writer = AsyncBatchWriter()
+
+def submit_batch(scored_batch):
+    """Hand a scored batch's writes to the async writer"""
+    df = scored_batch['df']
+    scored_batch['scored'] = scored_rows(df)
+    scored_batch['future'] = async_writer.submit(
+        scored_batch['transactions'],
+        # Fields missing from some transactions are NaN; write them as NULL
+        scored=df.astype(object).where(df.notna(), None).to_dict('records'),
+        notifications=scored_stream.notifications(scored_batch['scored']),
+    )
+
+def write_batch(scored_batch):
+    """Persist a scored batch and return the anomalies it newly inserted;
+    with the async writer, wait for (or retry) its submitted writes"""
+    if async_writer is None:
+        return persist_batch(scored_batch['df'], scored_batch['anomalies'],
+                             len(scored_batch['transactions']), scored_batch['features'])
+    if 'future' not in scored_batch:
+        submit_batch(scored_batch)
+    new_anomalies = scored_batch.pop('future').result()
+    # The dead-letter count is on this connection, not the async store's
+    try:
+        dead_letters.report(cursor)
+        conn.commit()
+    except Exception as e:
+        print(f"Failed to report dead letters: {e}")
+        reconnect_db()
+    scored_stream.send(scored_batch['scored'])
+    return new_anomalies
+
+def finish_batch(scored_batch):
+    """Write a scored batch, retrying PERSIST_ATTEMPTS times, then do its
+    bookkeeping and commit its offsets, or dead-letter it if it can't be
+    written"""
+    global last_batch_failed
+    df = scored_batch['df']
+    anomalies = scored_batch['anomalies']
+    batch_ids = scored_batch['ids']
+    num_in_batch = len(scored_batch['transactions'])
+
+    new_anomalies = None
+    for attempt in range(1, PERSIST_ATTEMPTS + 1):
         try:
+            new_anomalies = write_batch(scored_batch)
+            break
+        except Exception as e:
+            print(f"Failed to persist batch (attempt {attempt}/{PERSIST_ATTEMPTS}): {e}")
+            # Roll back, and reconnect if the connection went stale
+            reconnect_db()
+            if attempt < PERSIST_ATTEMPTS and not shutdown.requested:
+                time.sleep(min(2 ** (attempt - 1), 10))
+
+    if new_anomalies is None:
+        # Give up on the batch and dead-letter its messages so its
+        # partitions move on. If that fails as well, its offsets are held
+        # back and it is redelivered after a restart or rebalance. Its ids
+        # aren't remembered either way, so a redelivery or a replay from
+        # the dead-letter queue is processed.
+        last_batch_failed = True
+        if seen_ids is not None:
+            seen_ids.release(batch_ids)
+        error = InvalidRecord("persist_failed", f"batch could not be persisted after {PERSIST_ATTEMPTS} attempts")
+        written = [dead_letters.record(m, error) for m in scored_batch['messages']]
+        health.update_stats(dead_letters=dead_letters.total, dead_letter_reasons=dict(dead_letters.counts))
+        if all(written):
+            offsets.persisted(scored_batch['offsets'])
+        else:
+            offsets.failed(scored_batch['offsets'])
+        offsets.commit(consumer)
+        return
+
+    last_batch_failed = False
+    if seen_ids is not None:
+        seen_ids.confirm(batch_ids)
+    print(f"Incremented total_transactions_processed by {num_in_batch} and updated timestamp")
+    print(f"Inserted {len(new_anomalies)} anomalies")
+
+    # Only anomalies the upsert actually inserted count towards the users'
+    # anomaly counters; a redelivered batch finds its frauds already stored
+    user_manager.record_anomalies(a['user_id'] for a in new_anomalies)
+
+    # Print detailed information about each detected anomaly
+    if not anomalies.empty:
+        print("-" * 40 + " DETECTED ANOMALIES " + "-" * 40)
+        for _, anomaly in anomalies.iterrows():
+            merchant = anomaly.get('merchant')
+            anomaly_info = {
+                "transaction_id": anomaly.get('transaction_id', 'Unknown'),
+                "user_id": int(anomaly.user_id),
+                "amount": float(anomaly.amount),
+                "location": anomaly.get('location', 'Unknown'),
+                "timestamp": anomaly.get('timestamp', 'Unknown'),
+                "detection_score": float(anomaly.detection_score),
+                "risk_level": str(anomaly.risk_level),
+                "merchant_category": merchant.get('category', 'Unknown') if isinstance(merchant, dict) else 'Unknown',
+                "payment_method": anomaly.get('payment_method', 'unknown'),
+                "transaction_type": anomaly.get('transaction_type', 'unknown'),
+                "model_used": anomaly.get('model_used', 'global'),
+                "_anomalous": bool(anomaly.get('_anomalous', False))
+            }
+            print(json.dumps(anomaly_info, indent=2))
+            print("-" * 90)
+            
+            # If this is a ground truth anomaly, prioritise retraining the user model
+            # In production you'd handle user feedback separately
+            if anomaly.get('_anomalous', False) and training_scheduler:
+                training_scheduler.record_anomaly(int(anomaly.user_id))
+
+    # Update performance metrics if we have ground truth
+    try:
+        has_ground_truth = '_anomalous' in df.columns
+        
+        if has_ground_truth:
+            true_anomalies = df[df['_anomalous'] == True]
+            detected_anomalies = df[df['anomaly'] == 1]
+            
+            # Calculate metrics
+            true_positives = len(df[(df['_anomalous'] == True) & (df['anomaly'] == 1)])
+            false_positives = len(df[(df['_anomalous'] != True) & (df['anomaly'] == 1)])
+            false_negatives = len(df[(df['_anomalous'] == True) & (df['anomaly'] == 0)])
+            
+            # Calculate precision, recall, etc.
+            precision = true_positives / max(len(detected_anomalies), 1)
+            recall = true_positives / max(len(true_anomalies), 1)
+            f1_score = 2 * precision * recall / max((precision + recall), 0.001)
+            
+            # Save metrics to database
             cursor.execute("""
-                UPDATE processing_stats
-                SET count_value = count_value + %s,
+                INSERT INTO processing_stats 
+                (counter_name, count_value, last_updated_timestamp)
+                VALUES 
+                ('precision', %s, NOW()),
+                ('recall', %s, NOW()),
+                ('f1_score', %s, NOW())
+                ON CONFLICT (counter_name) DO UPDATE 
+                SET count_value = EXCLUDED.count_value,
                     last_updated_timestamp = NOW()
-                WHERE counter_name = 'total_transactions_processed'
-            """, (num_in_batch,))
+            """, (int(precision * 100), int(recall * 100), int(f1_score * 100)))
+            
+            try:
+                conn.commit()
+                print(f"Model Performance - Precision: {precision:.2f}, Recall: {recall:.2f}, F1: {f1_score:.2f}")
+            except Exception as e:
+                print(f"Failed to save performance metrics: {e}")
+                conn.rollback()
+    
+    except Exception as e:
+        print(f"Failed to compute performance metrics: {e}")
+        conn.rollback()
+    
+    # Queue users for background retraining based on their new activity
+    if training_scheduler:
+        training_scheduler.record_batch(scored_batch['transactions'])
+    
+    # The batch is persisted, so its offsets can be committed
+    offsets.persisted(scored_batch['offsets'])
+    offsets.commit(consumer)
+
+    # Checkpoint the seen-id filter and the suppressed-duplicate count;
+    # it only holds the ids of committed batches
+    if seen_ids is not None and time.time() - seen_ids.last_checkpoint >= DEDUPE_CHECKPOINT_SECONDS:
+        try:
+            seen_ids.checkpoint(cursor)
             conn.commit()
-            print(f"Incremented total_transactions_processed by {num_in_batch} and updated timestamp")
+            health.update_stats(duplicates_suppressed=seen_ids.suppressed,
+                                dedupe_fill_ratio=round(seen_ids.fill_ratio(), 4))
+            if seen_ids.suppressed:
+                print(f"Suppressed {seen_ids.suppressed} duplicate transactions so far")
         except Exception as e:
-            print(f"Failed to update transaction count: {e}")
-            conn.rollback()
+            print(f"Failed to checkpoint seen transaction ids: {e}")
+            seen_ids.last_checkpoint = time.time()
             reconnect_db()
 
+# SIGTERM/SIGINT stop the polling; the partial batch is then scored and
+# persisted, and offsets are committed only for persisted batches
+shutdown = GracefulShutdown(float(os.environ.get("DRAIN_TIMEOUT_SECONDS", 20)))
+offsets = OffsetTracker()
+
+# msg is None once, after a shutdown request, to flush the partial batch
+for msg in poll_messages(consumer, shutdown, on_poll=health.heartbeat):
+    if msg is not None:
+        health.heartbeat()
+        offsets.track(msg)
+        try:
+            txn = parse_message(msg.value)
+        except InvalidRecord as e:
+            dead_letters.record(msg, e)
+            health.update_stats(dead_letters=dead_letters.total, dead_letter_reasons=dict(dead_letters.counts))
+            continue
+        if seen_ids is not None and seen_ids.check_and_add(txn.get('transaction_id')):
+            continue
+        
+        # First, store this transaction in the history for future model
+        # training (the async writer stores it with its batch)
+        if async_writer is None:
+            user_manager.store_transaction(txn)
+        
+        batch.append(txn)
+        batch_messages.append(msg)
+
+    if len(batch) >= BATCH_SIZE or (msg is None and batch):
+        num_in_batch = len(batch)
+        batch_ids = [txn.get('transaction_id') for txn in batch]
+
         # Process each transaction - try user model first, fall back to batch model
         user_scored_txns = []
         batch_process_txns = []
         
-        for txn in batch:
-            user_id = txn.get('user_id')
-            
-            # Check if we need to update the user's profile and model
-            # In production, you might want to do this less frequently
-            user_manager.update_user_profile(user_id)
-            
-            # Try to score with user model
-            user_score = user_manager.score_transaction(txn)
-            
+        # Refresh the profiles of the batch's users in one statement
+        user_manager.update_user_profiles({txn['user_id'] for txn in batch})
+        
+        # Run the profile rules over the whole batch first; only uncertain
+        # transactions go on to the models
+        model_txns = batch
+        if PROFILE_RULES_ENABLED:
+            if time.time() >= next_profile_refresh:
+                refresh_profile_rules(background=True)
+        if profile_rules is not None:
+            try:
+                rule_risk, rule_decision = profile_rules.evaluate(transactions_to_history_frame(batch))
+                model_txns = []
+                for txn, risk, decision in zip(batch, rule_risk, rule_decision):
+                    if decision == NORMAL or decision == VIOLATION:
+                        txn['detection_score'] = float(risk)
+                        txn['risk_level'] = 'high' if decision == VIOLATION else 'low'
+                        txn['anomaly'] = 1 if decision == VIOLATION else 0
+                        txn['model_used'] = 'rules'
+                        user_scored_txns.append(txn)
+                    else:
+                        model_txns.append(txn)
+                if user_scored_txns:
+                    print(f"Profile rules decided {len(user_scored_txns)}/{len(batch)} transactions without a model")
+            except Exception as e:
+                print(f"Profile rule evaluation failed: {e}")
+                user_scored_txns = []
+                model_txns = batch
+        
+        # Score the remaining transactions with user models, one model call per user
+        user_scores = user_manager.score_batch(model_txns)
+        
+        for txn, user_score in zip(model_txns, user_scores):
             if user_score:
                 # User model available, use that result
                 txn['detection_score'] = user_score['score']
                 txn['risk_level'] = user_score['risk_level']
                 txn['anomaly'] = 1 if user_score['is_anomaly'] else 0
-                txn['model_used'] = 'user'
+                txn['model_used'] = user_manager.model_mode
                 user_scored_txns.append(txn)
             else:
                 # No user model available, add to batch for global model
                 batch_process_txns.append(txn)
                 
         # Now create DataFrame only for transactions that need global model
+        df = pd.DataFrame()
+        features = None
         if batch_process_txns:
             df = pd.DataFrame(batch_process_txns)
             
@@ -336,208 +773,59 @@ for msg in consumer:
             # Only user-scored transactions
             df = pd.DataFrame(user_scored_txns)
         # If only batch-processed, df is already set
-        
-        # Get anomalies
-        if not df.empty and 'anomaly' in df.columns:
-            anomalies = df[df['anomaly'] == 1]
-            
-            for _, row in anomalies.iterrows():
-                # Extract merchant info if available
-                merchant_id = "unknown"
-                merchant_name = "unknown"
-                merchant_category = "unknown"
-                if 'merchant' in row and isinstance(row.merchant, dict):
-                    merchant_id = row.merchant.get('merchant_id', "unknown")
-                    merchant_name = row.merchant.get('name', "unknown")
-                    merchant_category = row.merchant.get('category', "unknown")
-                
-                # Extract device info if available
-                device_type = "unknown"
-                ip_address = "unknown"
-                if 'device_info' in row and isinstance(row.device_info, dict):
-                    device_type = row.device_info.get('type', "unknown")
-                    ip_address = row.device_info.get('ip_address', "unknown")
-                
-                # Get payment method if available
-                payment_method = row.get('payment_method', "unknown")
-                
-                # Get transaction type if available
-                transaction_type = row.get('transaction_type', "unknown")
-                
-                # Get currency if available
-                currency = row.get('currency', "USD")
-                
-                # Get transaction ID if available, otherwise generate one
-                transaction_id = row.get('transaction_id', f"AUTOGEN-{int(time.time())}-{row.user_id}")
-                
-                # Get risk level if available
-                risk_level = row.get('risk_level', 'medium')
-                
-                # Get model used
-                model_used = row.get('model_used', 'global')
-                
-                # Capture the most important features that contributed to the detection
-                feature_dict = {}
-                if 'features' in locals() and isinstance(features, pd.DataFrame) and not features.empty:
-                    # Get the row of features for this transaction
-                    idx = df.index[df['transaction_id'] == transaction_id][0] if 'transaction_id' in df.columns else _
-                    try:
-                        row_features = features.iloc[idx].to_dict()
-                        # Keep the top 5 most important features
-                        sorted_features = sorted(row_features.items(), key=lambda x: abs(x[1]) if isinstance(x[1], (int, float)) else 0, reverse=True)
-                        feature_dict = {k: float(v) if isinstance(v, (int, float)) else str(v) for k, v in sorted_features[:5]}
-                    except:
-                        # Can't get features, just use a placeholder
-                        feature_dict = {"info": "Features not available"}
-                
-                try:
-                    # Insert into frauds table with model used
-                    cursor.execute("""
-                        INSERT INTO frauds (
-                            transaction_id, user_id, amount, currency, location, timestamp, 
-                            transaction_type, merchant_id, merchant_name, merchant_category,
-                            payment_method, device_type, ip_address, detection_score, risk_level,
-                            detection_features, model_used
-                        )
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (transaction_id) DO UPDATE SET
-                            detection_score = EXCLUDED.detection_score,
-                            risk_level = EXCLUDED.risk_level,
-                            detection_features = EXCLUDED.detection_features,
-                            detection_time = NOW(),
-                            model_used = EXCLUDED.model_used
-                    """, (
-                        transaction_id,
-                        int(row.user_id),
-                        float(row.amount),
-                        currency,
-                        row.location,
-                        float(row.timestamp),
-                        transaction_type,
-                        merchant_id,
-                        merchant_name,
-                        merchant_category,
-                        payment_method,
-                        device_type,
-                        ip_address,
-                        float(row.detection_score),
-                        risk_level,
-                        json.dumps(feature_dict),
-                        model_used
-                    ))
-                except Exception as e:
-                    print(f"Error inserting anomaly: {e}")
-                    conn.rollback()
-                    continue
+        # Nothing may have been scored (e.g. the global model failed); the
+        # batch is still counted
+        if 'anomaly' not in df.columns:
+            df = pd.DataFrame()
+        scored_batch = {
+            'transactions': batch,
+            'messages': batch_messages,
+            'ids': batch_ids,
+            'offsets': offsets.take(),
+            'df': df,
+            'anomalies': df[df['anomaly'] == 1] if not df.empty else df,
+            'features': features,
+        }
+        batch = []
+        batch_messages = []
 
-            try:
-                conn.commit()
-                print(f"Inserted {len(anomalies)} anomalies")
-                
-                # Print detailed information about each detected anomaly
-                if not anomalies.empty:
-                    print("-" * 40 + " DETECTED ANOMALIES " + "-" * 40)
-                    for _, anomaly in anomalies.iterrows():
-                        anomaly_info = {
-                            "transaction_id": anomaly.get('transaction_id', 'Unknown'),
-                            "user_id": int(anomaly.user_id),
-                            "amount": float(anomaly.amount),
-                            "location": anomaly.get('location', 'Unknown'),
-                            "timestamp": anomaly.get('timestamp', 'Unknown'),
-                            "detection_score": float(anomaly.detection_score),
-                            "risk_level": str(anomaly.risk_level),
-                            "merchant_category": merchant_category if merchant_category != "unknown" else "Unknown",
-                            "payment_method": payment_method,
-                            "transaction_type": transaction_type,
-                            "model_used": anomaly.get('model_used', 'global'),
-                            "_anomalous": bool(anomaly.get('_anomalous', False))
-                        }
-                        print(json.dumps(anomaly_info, indent=2))
-                        print("-" * 90)
-                        
-                        # If this is a ground truth anomaly, train the user model
-                        # In production you'd handle user feedback separately
-                        if anomaly.get('_anomalous', False):
-                            user_id = anomaly.user_id
-                            print(f"Training model for user {user_id} based on confirmed anomaly")
-                            user_manager.train_user_model(user_id)
-            except Exception as e:
-                print(f"Failed to insert anomalies: {e}")
-                conn.rollback()
-                reconnect_db()
-                continue
+        if async_writer is None:
+            finish_batch(scored_batch)
+        else:
+            # Settle the previous batch, whose writes were in flight while
+            # this one was scored, before handing off this one's
+            if batch_in_flight is not None:
+                finish_batch(batch_in_flight)
+            submit_batch(scored_batch)
+            batch_in_flight = scored_batch
 
-            # Update performance metrics if we have ground truth
-            try:
-                has_ground_truth = '_anomalous' in df.columns
-                
-                if has_ground_truth:
-                    true_anomalies = df[df['_anomalous'] == True]
-                    detected_anomalies = df[df['anomaly'] == 1]
-                    
-                    # Calculate metrics
-                    true_positives = len(df[(df['_anomalous'] == True) & (df['anomaly'] == 1)])
-                    false_positives = len(df[(df['_anomalous'] != True) & (df['anomaly'] == 1)])
-                    false_negatives = len(df[(df['_anomalous'] == True) & (df['anomaly'] == 0)])
-                    
-                    # Calculate precision, recall, etc.
-                    precision = true_positives / max(len(detected_anomalies), 1)
-                    recall = true_positives / max(len(true_anomalies), 1)
-                    f1_score = 2 * precision * recall / max((precision + recall), 0.001)
-                    
-                    # Save metrics to database
-                    cursor.execute("""
-                        INSERT INTO processing_stats 
-                        (counter_name, count_value, last_updated_timestamp)
-                        VALUES 
-                        ('precision', %s, NOW()),
-                        ('recall', %s, NOW()),
-                        ('f1_score', %s, NOW())
-                        ON CONFLICT (counter_name) DO UPDATE 
-                        SET count_value = EXCLUDED.count_value,
-                            last_updated_timestamp = NOW()
-                    """, (int(precision * 100), int(recall * 100), int(f1_score * 100)))
-                    
-                    try:
-                        conn.commit()
-                        print(f"Model Performance - Precision: {precision:.2f}, Recall: {recall:.2f}, F1: {f1_score:.2f}")
-                    except Exception as e:
-                        print(f"Failed to save performance metrics: {e}")
-                        conn.rollback()
-            
-            except Exception as e:
-                print(f"Failed to compute performance metrics: {e}")
-                conn.rollback()
-        
-        # Clear the batch
-        batch = []
-        
-        # Every 100 transactions, check if we can train models for users
-        total_processed = 0
-        try:
-            cursor.execute("SELECT count_value FROM processing_stats WHERE counter_name = 'total_transactions_processed'")
-            result = cursor.fetchone()
-            if result:
-                total_processed = result[0]
-        except:
-            pass
-            
-        if total_processed % 100 < BATCH_SIZE:
-            print("Checking for users who need model updates...")
-            try:
-                # Get users with enough transaction history but no model
-                cursor.execute("""
-                    SELECT DISTINCT user_id FROM transaction_history
-                    GROUP BY user_id
-                    HAVING COUNT(*) >= 30
-                    LIMIT 5
-                """)
-                
-                users_for_training = [row[0] for row in cursor.fetchall()]
-                
-                for user_id in users_for_training:
-                    print(f"Training model for user {user_id}")
-                    user_manager.train_user_model(user_id)
-                    
-            except Exception as e:
-                print(f"Error during model training: {e}")
+# The last batch's writes may still be in flight
+if batch_in_flight is not None:
+    finish_batch(batch_in_flight)
+    batch_in_flight = None
+
+# Drain: the last batch has been handled above. Anything consumed after it
+# was dead-lettered or a duplicate, so its offsets can go too; a hold left
+# by a batch that couldn't be persisted still applies.
+health.set_ready(False)
+offsets.persisted(offsets.take())
+offsets.commit(consumer)
+if training_scheduler:
+    training_scheduler.stop(timeout=5)
+try:
+    if seen_ids is not None and not last_batch_failed:
+        seen_ids.checkpoint(cursor)
+    dead_letters.report(cursor)
+    conn.commit()
+except Exception as e:
+    print(f"Failed to flush counters on shutdown: {e}")
+    conn.rollback()
+consumer.close(autocommit=False)
+if async_writer is not None:
+    async_writer.close()
+scored_stream.close()
+dead_letters.close()
+user_manager.close()
+db_pool.putconn(conn)
+shutdown.finish()
+print("Detector shut down cleanly")
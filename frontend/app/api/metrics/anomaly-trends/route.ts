@@ -58,7 +58,22 @@ export async function GET(request: NextRequest) {
 
     console.log(`Fetching anomaly trends with filters: date=${dateParam}, scoreThreshold=${scoreThreshold}, userId=${userId}`);
     
-    const trendQuery = `
+    // Without per-anomaly filters the day rollups (UTC days) answer the
+    // query from a few rows instead of scanning frauds
+    const useRollups = scoreThreshold <= 0 && !userId;
+    const trendQuery = useRollups ? `
+      SELECT 
+        DATE(to_timestamp(bucket_start) AT TIME ZONE 'UTC') as day,
+        SUM(anomaly_count) as count,
+        LEAST(SUM(amount_sum)/NULLIF(SUM(anomaly_count), 0)/5000, 1.0) as avg_score
+      FROM anomaly_rollups
+      WHERE granularity = 'day'
+      ${dateParam ? "AND DATE(to_timestamp(bucket_start) AT TIME ZONE 'UTC') = $1::date" : ''}
+      AND bucket_start >= EXTRACT(EPOCH FROM NOW() - INTERVAL '10 days')
+      GROUP BY day
+      ORDER BY day ASC
+      LIMIT 10
+    ` : `
       SELECT 
         DATE(to_timestamp(timestamp)) as day,
         COUNT(*) as count,
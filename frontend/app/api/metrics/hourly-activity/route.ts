@@ -15,12 +15,16 @@ export async function GET(request: NextRequest) {
     const timeRange = searchParams.get("timeRange") || "24h";
 
     let intervalSql: string;
+    // Minute buckets are kept for two days; longer ranges read hour buckets
+    let granularity = "minute";
     switch (timeRange) {
       case "7d":
         intervalSql = "INTERVAL '7 days'";
+        granularity = "hour";
         break;
       case "30d":
         intervalSql = "INTERVAL '30 days'";
+        granularity = "hour";
         break;
       case "1h":
         intervalSql = "INTERVAL '1 hour'";
@@ -43,17 +47,20 @@ export async function GET(request: NextRequest) {
         `Fetching anomalies for time range: ${timeRange}, current server time: ${new Date().toISOString()}`
       );
 
-      const hourlyAnomaliesResult = await client.query(`
+      const hourlyAnomaliesResult = await client.query(
+        `
         SELECT 
-          EXTRACT(HOUR FROM to_timestamp(timestamp)) AS hour,
-          COUNT(*) AS anomaly_count
-        FROM frauds
+          EXTRACT(HOUR FROM to_timestamp(bucket_start)) AS hour,
+          SUM(anomaly_count) AS anomaly_count
+        FROM anomaly_rollups
         WHERE 
-          timestamp IS NOT NULL
-          AND timestamp >= EXTRACT(EPOCH FROM NOW() - ${intervalSql})
+          granularity = $1
+          AND bucket_start >= EXTRACT(EPOCH FROM NOW() - ${intervalSql})
         GROUP BY hour
         ORDER BY hour ASC
-      `);
+      `,
+        [granularity]
+      );
 
       console.log(
         "Hourly anomalies result rows:",
@@ -63,7 +63,21 @@ export async function GET(request: NextRequest) {
     );
     console.log("Query params:", queryParams);
 
-    const histogramQuery = `
+    // Without per-anomaly filters read the daily amount histograms (UTC
+    // days) maintained by the detectors
+    const useRollups = scoreThreshold <= 0 && !userId;
+    const histogramQuery = useRollups
+      ? `
+      SELECT 
+        bucket,
+        SUM(anomaly_count)::text as count
+      FROM anomaly_histograms
+      WHERE histogram = 'amount'
+      ${dateParam ? "AND DATE(to_timestamp(day_start) AT TIME ZONE 'UTC') = $1::date" : ""}
+      GROUP BY bucket
+      ORDER BY bucket ASC
+    `
+      : `
       SELECT 
         width_bucket(amount, 0, 5000, 10) as bucket,
         COUNT(*)::text as count
@@ -17,8 +17,21 @@ export async function GET(request: NextRequest) {
         "SELECT count_value, last_updated_timestamp FROM processing_stats WHERE counter_name = 'total_transactions_processed'"
       );
 
-      const anomaliesResult = await client.query(
-        "SELECT COUNT(*) AS total_anomalies FROM frauds"
+      // Day rollups are maintained by the detectors; fall back to counting
+      // frauds on databases that predate them
+      let anomaliesResult;
+      try {
+        anomaliesResult = await client.query(
+          "SELECT COALESCE(SUM(anomaly_count), 0) AS total_anomalies FROM anomaly_rollups WHERE granularity = 'day'"
+        );
+      } catch (rollupError) {
+        anomaliesResult = await client.query(
+          "SELECT COUNT(*) AS total_anomalies FROM frauds"
+        );
+      }
+
+      const deadLettersResult = await client.query(
+        "SELECT count_value FROM processing_stats WHERE counter_name = 'dead_lettered_transactions'"
       );
 
       let totalTransactions = 0;
@@ -35,10 +48,15 @@ export async function GET(request: NextRequest) {
         totalAnomalies = parseInt(anomaliesResult.rows[0].total_anomalies, 10);
       }
 
+      const deadLetters = deadLettersResult.rows.length > 0
+        ? parseInt(deadLettersResult.rows[0].count_value, 10)
+        : 0;
+
       return NextResponse.json({
         totalTransactions,
         lastUpdatedTimestamp,
         totalAnomalies,
+        deadLetters,
       });
     } finally {
       client.release();
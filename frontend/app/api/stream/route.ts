@@ -1,28 +1,156 @@
+import { Client } from 'pg';
+
 export const dynamic = 'force-dynamic';
 export const runtime = 'nodejs';
 
-export async function GET() {
-  const responseInit = {
-    headers: {
-      'Content-Type': 'text/event-stream',
-      'Cache-Control': 'no-cache, no-transform',
-      'Connection': 'keep-alive',
-    },
+// The detectors NOTIFY this channel with JSON arrays of scored transactions
+const CHANNEL = process.env.SCORED_CHANNEL || 'scored_transactions';
+
+interface ScoredRow {
+  id: string;
+  userId: number;
+  amount: number;
+  location: string | null;
+  timestamp: number;
+  score: number | null;
+  riskLevel: string | null;
+  model: string;
+  anomaly: boolean;
+}
+
+function toTransaction(row: ScoredRow) {
+  return {
+    id: row.id,
+    userId: `user${row.userId}`,
+    amount: row.amount,
+    timestamp: new Date(row.timestamp * 1000).toISOString(),
+    location: row.location ?? 'Unknown',
+    isAnomaly: row.anomaly,
+    anomalyScore: row.score ?? undefined,
+    riskLevel: row.riskLevel ?? undefined,
+    modelUsed: row.model,
   };
+}
+
+type Subscriber = (event: string, data: unknown) => void;
+
+// One LISTEN connection per server process, shared by every open stream:
+// each notification is parsed once and fanned out to the subscribers
+const subscribers = new Set<Subscriber>();
+let listener: Promise<Client> | null = null;
+let listenerClient: Client | null = null;
+
+function broadcast(event: string, data: unknown) {
+  for (const subscriber of [...subscribers]) {
+    subscriber(event, data);
+  }
+}
+
+function dropListener(client: Client) {
+  if (client !== listenerClient) return;
+  listener = null;
+  listenerClient = null;
+  client.end().catch((error) => {
+    console.error('Error closing stream connection:', error);
+  });
+}
+
+function getListener(): Promise<Client> {
+  if (!listener) {
+    const client = new Client({
+      user: process.env.DB_USER || 'user',
+      host: process.env.DB_HOST || 'localhost',
+      database: process.env.DB_NAME || 'anomalies',
+      password: process.env.DB_PASSWORD || 'pass',
+      port: parseInt(process.env.DB_PORT || '5432', 10),
+    });
+    client.on('notification', (message) => {
+      if (!message.payload) return;
+      try {
+        const rows = JSON.parse(message.payload) as ScoredRow[];
+        // One event per coalesced batch
+        broadcast('transactions', rows.map(toTransaction));
+      } catch (error) {
+        console.error('Invalid scored transaction payload:', error);
+      }
+    });
+    client.on('error', (error) => {
+      console.error('Stream connection error:', error);
+      // The next stream to open reconnects
+      dropListener(client);
+      broadcast('error', { message: 'Stream connection lost' });
+    });
+    listenerClient = client;
+    listener = (async () => {
+      try {
+        await client.connect();
+        await client.query(`LISTEN ${client.escapeIdentifier(CHANNEL)}`);
+        return client;
+      } catch (error) {
+        dropListener(client);
+        throw error;
+      }
+    })();
+  }
+  return listener;
+}
 
-  let responseBody = '';
+export async function GET(request: Request) {
+  const encoder = new TextEncoder();
+  let heartbeat: NodeJS.Timeout | null = null;
+  let closed = false;
 
-  const transaction = {
-    id: `txn-${Math.random().toString(36).substring(2, 10)}`,
-    userId: `user${Math.floor(Math.random() * 1000)}`,
-    amount: parseFloat((Math.random() * 1000).toFixed(2)),
-    timestamp: new Date().toISOString(),
-    location: ['New York', 'London', 'Tokyo', 'Sydney', 'Berlin'][Math.floor(Math.random() * 5)],
-    isAnomaly: Math.random() > 0.8,
-    anomalyScore: parseFloat((Math.random()).toFixed(2))
+  let streamController: ReadableStreamDefaultController | null = null;
+
+  const close = () => {
+    if (closed) return;
+    closed = true;
+    if (heartbeat) clearInterval(heartbeat);
+    subscribers.delete(subscriber);
+    try {
+      streamController?.close();
+    } catch {
+      // Already closed or cancelled
+    }
+  };
+
+  const subscriber: Subscriber = (event, data) => {
+    if (closed) return;
+    streamController?.enqueue(encoder.encode(`event: ${event}\ndata: ${JSON.stringify(data)}\n\n`));
+    if (event === 'error') close();
   };
-  
-  responseBody = `event: transaction\ndata: ${JSON.stringify(transaction)}\n\n`;
 
-  return new Response(responseBody, responseInit);
-}
\ No newline at end of file
+  const stream = new ReadableStream({
+    async start(controller) {
+      streamController = controller;
+      request.signal.addEventListener('abort', close);
+
+      try {
+        await getListener();
+      } catch (error) {
+        console.error('Failed to subscribe to scored transactions:', error);
+        subscriber('error', { message: 'Failed to connect to the database' });
+        return;
+      }
+      if (closed) return;
+      subscribers.add(subscriber);
+
+      // Comment lines keep proxies from timing out idle streams
+      heartbeat = setInterval(() => {
+        if (!closed) controller.enqueue(encoder.encode(': keep-alive\n\n'));
+      }, 15000);
+    },
+    cancel() {
+      streamController = null;
+      close();
+    },
+  });
+
+  return new Response(stream, {
+    headers: {
+      'Content-Type': 'text/event-stream',
+      'Cache-Control': 'no-cache, no-transform',
+      'Connection': 'keep-alive',
+    },
+  });
+}
@@ -1,4 +1,4 @@
-import { useState, useEffect, useRef } from 'react';
+import { useState, useEffect } from 'react';
 
 export interface Transaction {
   id: string;
@@ -8,55 +8,44 @@ export interface Transaction {
   location: string;
   isAnomaly: boolean;
   anomalyScore?: number;
+  riskLevel?: string;
+  modelUsed?: string;
 }
 
 export function useLiveTransactions(maxItems: number = 50) {
   const [transactions, setTransactions] = useState<Transaction[]>([]);
   const [isConnected, setIsConnected] = useState<boolean>(false);
   const [error, setError] = useState<string | null>(null);
-  const pollingRef = useRef<NodeJS.Timeout | null>(null);
 
   useEffect(() => {
-    const fetchTransaction = async () => {
+    // The stream pushes batches of scored transactions as the detectors
+    // commit them; EventSource reconnects on its own after errors
+    const source = new EventSource('/api/stream');
+
+    source.onopen = () => {
+      setIsConnected(true);
+      setError(null);
+    };
+
+    source.addEventListener('transactions', (event) => {
       try {
-        const response = await fetch('/api/stream');
-        
-        if (!response.ok) {
-          throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        
-        const text = await response.text();
-        
-        const eventData = text.split('\n')
-          .find(line => line.startsWith('data:'))
-          ?.replace('data:', '')
-          .trim();
-          
-        if (eventData) {
-          const newTransaction = JSON.parse(eventData) as Transaction;
-          setTransactions(prev => [newTransaction, ...prev].slice(0, maxItems));
-          setIsConnected(true);
-          setError(null);
-        }
+        const batch = JSON.parse((event as MessageEvent).data) as Transaction[];
+        setTransactions(prev => [...batch.reverse(), ...prev].slice(0, maxItems));
       } catch (err) {
-        console.error('Error fetching transaction:', err);
-        setIsConnected(false);
-        setError('Connection error. Trying again...');
+        console.error('Error parsing transactions:', err);
       }
-    };
+    });
 
-    fetchTransaction();
-    setIsConnected(true);
-    
-    pollingRef.current = setInterval(fetchTransaction, 3000);
+    source.onerror = () => {
+      setIsConnected(false);
+      setError('Connection error. Trying again...');
+    };
 
     return () => {
-      if (pollingRef.current) {
-        clearInterval(pollingRef.current);
-        setIsConnected(false);
-      }
+      source.close();
+      setIsConnected(false);
     };
   }, [maxItems]);
 
   return { transactions, isConnected, error };
-}
\ No newline at end of file
+}
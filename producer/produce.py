@@ -1,80 +1,300 @@
 """
 Contributors:
 Kruti Bathani: Developed the transaction simulator to generate realistic synthetic financial data. Implemented the Kafka-based streaming pipeline, developed the core and enhanced anomaly detector services.
+
+Without arguments the producer sends one transaction every 0.5-2 seconds and
+prints each one. With --rate it runs as a load generator: transactions are
+generated in NumPy batches and sent asynchronously by --processes producer
+processes, paced to the target rate, and the achieved send/ack throughput is
+reported every few seconds. Every transaction is keyed by its user_id, so a
+user's transactions always land on the same partition and the same detector.
+With --replay it sends a scenario file from
+scripts/generate_scenario.py instead, so runs can repeat identical input.
+--encoding msgpack switches from JSON to the compact binary format in
+components/wire.py.
 """
 
 from kafka import KafkaProducer
 import json, random, time
+import os
+import sys
 import uuid
 import datetime
+import argparse
+import multiprocessing as mp
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from components.population import (
+    MERCHANT_CATEGORIES, PAYMENT_METHODS, DEVICE_TYPES, TRANSACTION_TYPES,
+    LOCATIONS, ANOMALOUS_LOCATIONS, ProfileArrays, generate_population, load_population,
+    transaction_columns, make_foreign_purchases, to_messages
+)
+from components.scenarios import read_scenario
+from components.user_partitions import user_key
+from components.wire import ENCODINGS, encoder
+
+NUM_USERS = 100
+ANOMALY_EVERY = 20
+
+def build_user_profiles(num_users=NUM_USERS):
+    """Random spending profiles for user ids 1..num_users"""
+    user_profiles = {}
+    for user_id in range(1, num_users + 1):
+        user_profiles[user_id] = {
+            "usual_locations": random.sample(LOCATIONS, k=random.randint(1, 3)),
+            "usual_merchants": random.sample(MERCHANT_CATEGORIES, k=random.randint(2, 5)),
+            "typical_min_amount": round(random.uniform(5, 200), 2),
+            "typical_max_amount": round(random.uniform(300, 2000), 2),
+            "typical_payment_methods": random.sample(PAYMENT_METHODS, k=random.randint(1, 3)),
+            "typical_transaction_times": [random.randint(8, 22) for _ in range(random.randint(3, 8))]
+        }
+    return user_profiles
+
+def generate_transactions(profiles, n, rng, first_index=0, now=None):
+    """Generate n transactions the way the interactive producer does, with
+    every ANOMALY_EVERY-th one (counting from first_index) anomalous"""
+    now = time.time() if now is None else now
+    users = rng.integers(0, len(profiles.user_ids), n)
+    columns = transaction_columns(profiles, users, rng)
+    anomalous = (np.arange(first_index, first_index + n) % ANOMALY_EVERY) == 0
+    make_foreign_purchases(columns, anomalous, profiles, users, rng)
+    return to_messages(columns, np.full(n, now), anomalous)
+
+def create_producer(args):
+    return KafkaProducer(
+        bootstrap_servers=args.bootstrap_servers,
+        key_serializer=user_key,
+        value_serializer=encoder(args.encoding),
+        linger_ms=args.linger_ms,
+        batch_size=args.batch_size,
+        compression_type=None if args.compression == "none" else args.compression,
+        acks="all" if args.acks == "all" else int(args.acks),
+        buffer_memory=args.buffer_memory,
+    )
+
+def run_interactive(args):
+    """Send one transaction every 0.5-2 seconds and print it"""
+    user_profiles = build_user_profiles(args.users)
+    producer = KafkaProducer(
+        bootstrap_servers=args.bootstrap_servers,
+        key_serializer=user_key,
+        value_serializer=encoder(args.encoding))
 
-MERCHANT_CATEGORIES = ["Retail", "Restaurant", "Travel", "Entertainment", "Grocery", "Electronics", "Healthcare", "Utilities", "Education", "Other"]
-PAYMENT_METHODS = ["Credit Card", "Debit Card", "Bank Transfer", "Digital Wallet", "Cryptocurrency"]
-DEVICE_TYPES = ["Mobile", "Desktop", "Tablet", "ATM", "POS Terminal"]
-TRANSACTION_TYPES = ["purchase", "withdrawal", "refund", "transfer", "payment", "deposit"]
-
-user_profiles = {}
-for user_id in range(1, 101):
-    user_profiles[user_id] = {
-        "usual_locations": random.sample(["US", "IN", "UK", "CA", "AU", "JP", "DE", "FR", "BR", "SG"], k=random.randint(1, 3)),
-        "usual_merchants": random.sample(MERCHANT_CATEGORIES, k=random.randint(2, 5)),
-        "typical_min_amount": round(random.uniform(5, 200), 2),
-        "typical_max_amount": round(random.uniform(300, 2000), 2),
-        "typical_payment_methods": random.sample(PAYMENT_METHODS, k=random.randint(1, 3)),
-        "typical_transaction_times": [random.randint(8, 22) for _ in range(random.randint(3, 8))]  
-    }
-
-producer = KafkaProducer(
-    bootstrap_servers='localhost:9092',
-    value_serializer=lambda v: json.dumps(v).encode('utf-8'))
-
-transaction_count = 0
-
-while True:
-    is_anomalous = (transaction_count % 20 == 0)
-    transaction_count += 1
-    
-    user_id = random.randint(1, 100)
-    user = user_profiles[user_id]
-    
-    current_time = time.time()
-    current_hour = datetime.datetime.fromtimestamp(current_time).hour
-    
-    if is_anomalous:
-        location = random.choice(["RU", "NG", "CN", "MX", "ZA"])
-        amount = round(random.uniform(3000, 10000), 2)
-        merchant_category = random.choice([cat for cat in MERCHANT_CATEGORIES if cat not in user["usual_merchants"]])
-        if current_hour in user["typical_transaction_times"]:
-            current_hour = (current_hour + 12) % 24
-    else:      
-        location = random.choice(user["usual_locations"])
-        amount = round(random.uniform(user["typical_min_amount"], user["typical_max_amount"]), 2)
-        merchant_category = random.choice(user["usual_merchants"])
-    
-    txn = {
-        "transaction_id": str(uuid.uuid4()),
-        "user_id": user_id,
-        "amount": amount,
-        "currency": "USD",
-        "location": location,
-        "timestamp": current_time,
-        "transaction_type": random.choice(TRANSACTION_TYPES),
-        "merchant": {
-            "merchant_id": f"MERCH{random.randint(1000, 9999)}",
-            "name": f"{merchant_category}_{random.randint(100, 999)}",
-            "category": merchant_category
-        },
-        "payment_method": random.choice(user["typical_payment_methods"] if not is_anomalous else PAYMENT_METHODS),
-        "device_info": {
-            "type": random.choice(DEVICE_TYPES),
-            "ip_address": f"192.168.{random.randint(1, 255)}.{random.randint(1, 255)}"
+    transaction_count = 0
+
+    while True:
+        is_anomalous = (transaction_count % ANOMALY_EVERY == 0)
+        transaction_count += 1
+
+        user_id = random.randint(1, args.users)
+        user = user_profiles[user_id]
+
+        current_time = time.time()
+        current_hour = datetime.datetime.fromtimestamp(current_time).hour
+
+        if is_anomalous:
+            location = random.choice(ANOMALOUS_LOCATIONS)
+            amount = round(random.uniform(3000, 10000), 2)
+            merchant_category = random.choice([cat for cat in MERCHANT_CATEGORIES if cat not in user["usual_merchants"]])
+            if current_hour in user["typical_transaction_times"]:
+                current_hour = (current_hour + 12) % 24
+        else:
+            location = random.choice(user["usual_locations"])
+            amount = round(random.uniform(user["typical_min_amount"], user["typical_max_amount"]), 2)
+            merchant_category = random.choice(user["usual_merchants"])
+
+        txn = {
+            "transaction_id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "amount": amount,
+            "currency": "USD",
+            "location": location,
+            "timestamp": current_time,
+            "transaction_type": random.choice(TRANSACTION_TYPES),
+            "merchant": {
+                "merchant_id": f"MERCH{random.randint(1000, 9999)}",
+                "name": f"{merchant_category}_{random.randint(100, 999)}",
+                "category": merchant_category
+            },
+            "payment_method": random.choice(user["typical_payment_methods"] if not is_anomalous else PAYMENT_METHODS),
+            "device_info": {
+                "type": random.choice(DEVICE_TYPES),
+                "ip_address": f"192.168.{random.randint(1, 255)}.{random.randint(1, 255)}"
+            }
         }
-    }
-    
-    txn["_anomalous"] = is_anomalous
-    producer.send("transactions", txn)
-    print(f"Sent {'ANOMALOUS' if is_anomalous else 'Normal'} Transaction:")
-    print(json.dumps(txn, indent=2))
-    print("-" * 80)  
-    
-    time.sleep(random.uniform(0.5, 2.0))
+
+        txn["_anomalous"] = is_anomalous
+        producer.send(args.topic, txn, key=txn["user_id"])
+        print(f"Sent {'ANOMALOUS' if is_anomalous else 'Normal'} Transaction:")
+        print(json.dumps(txn, indent=2))
+        print("-" * 80)
+
+        time.sleep(random.uniform(0.5, 2.0))
+
+def run_load_worker(worker, args, rate, counters, stop):
+    """Send generated transactions at rate/sec (unthrottled if rate <= 0)
+
+    counters holds (sent, acked, failed) per worker; acks and failures are
+    counted by the delivery callbacks on the producer's I/O thread.
+    """
+    seed = None if args.seed is None else args.seed + worker
+    random.seed(seed)
+    rng = np.random.default_rng(seed)
+    if args.population:
+        profiles = ProfileArrays(load_population(args.population))
+    else:
+        # Every worker generates the same population when --seed is given
+        profiles = ProfileArrays(generate_population(args.users, args.seed))
+    producer = create_producer(args)
+    base = worker * 3
+
+    def on_ack(_):
+        counters[base + 1] += 1
+
+    def on_error(e):
+        counters[base + 2] += 1
+
+    deadline = time.time() + args.duration if args.duration else None
+    start = time.time()
+    index = 0
+    try:
+        while not stop.is_set() and (deadline is None or time.time() < deadline):
+            chunk = args.chunk if rate <= 0 else max(1, min(args.chunk, int(rate * 0.1)))
+            for txn in generate_transactions(profiles, chunk, rng, index):
+                producer.send(args.topic, txn, key=txn["user_id"]).add_callback(on_ack).add_errback(on_error)
+            index += chunk
+            counters[base] += chunk
+            if rate > 0:
+                # Sleep until this worker is back on schedule
+                delay = start + index / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        producer.flush()
+        producer.close()
+
+def run_load(args):
+    """Run --processes load workers and report the combined throughput"""
+    counters = mp.RawArray('q', args.processes * 3)
+    stop = mp.Event()
+    workers = [
+        mp.Process(target=run_load_worker, args=(i, args, args.rate / args.processes, counters, stop))
+        for i in range(args.processes)
+    ]
+    for worker in workers:
+        worker.start()
+    print(f"Producing {'unthrottled' if args.rate <= 0 else f'{args.rate:.0f} transactions/sec'} "
+          f"to {args.topic} with {args.processes} processes "
+          f"(linger_ms={args.linger_ms}, batch_size={args.batch_size}, compression={args.compression})")
+
+    def totals():
+        return [sum(counters[i::3]) for i in range(3)]
+
+    start = last_time = time.time()
+    last = totals()
+    try:
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(args.report_interval)
+            now, current = time.time(), totals()
+            elapsed = max(now - last_time, 1e-9)
+            print(f"sent {current[0]} ({(current[0] - last[0]) / elapsed:.0f}/s), "
+                  f"acked {current[1]} ({(current[1] - last[1]) / elapsed:.0f}/s), failed {current[2]}")
+            last_time, last = now, current
+    except KeyboardInterrupt:
+        stop.set()
+    for worker in workers:
+        worker.join()
+
+    sent, acked, failed = totals()
+    elapsed = max(time.time() - start, 1e-9)
+    print(f"Sent {sent} transactions in {elapsed:.1f}s: {sent / elapsed:.0f}/s sent, "
+          f"{acked / elapsed:.0f}/s acked, {failed} failed")
+    return 0 if failed == 0 else 1
+
+def run_replay(args):
+    """Send the transactions of a scenario file in order, at --rate/sec if
+    given, otherwise as fast as possible"""
+    producer = create_producer(args)
+    counts = [0, 0, 0]  # sent, acked, failed
+
+    def on_ack(_):
+        counts[1] += 1
+
+    def on_error(e):
+        counts[2] += 1
+
+    rate = args.rate or 0
+    offset = None
+    start = last_report = time.time()
+    last_sent = 0
+    print(f"Replaying {args.replay} to {args.topic} "
+          f"{'unthrottled' if rate <= 0 else f'at {rate:.0f} transactions/sec'}")
+    try:
+        for batch in read_scenario(args.replay, args.chunk):
+            if args.retime:
+                # Shift the scenario so it starts now, keeping its spacing
+                if offset is None:
+                    offset = time.time() - batch[0]["timestamp"]
+                for txn in batch:
+                    txn["timestamp"] += offset
+            for txn in batch:
+                producer.send(args.topic, txn, key=txn["user_id"]).add_callback(on_ack).add_errback(on_error)
+            counts[0] += len(batch)
+            if rate > 0:
+                delay = start + counts[0] / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            now = time.time()
+            if now - last_report >= args.report_interval:
+                print(f"sent {counts[0]} ({(counts[0] - last_sent) / (now - last_report):.0f}/s), "
+                      f"acked {counts[1]}, failed {counts[2]}")
+                last_report, last_sent = now, counts[0]
+    except KeyboardInterrupt:
+        pass
+    finally:
+        producer.flush()
+        producer.close()
+
+    elapsed = max(time.time() - start, 1e-9)
+    print(f"Replayed {counts[0]} transactions in {elapsed:.1f}s: {counts[0] / elapsed:.0f}/s, "
+          f"{counts[1]} acked, {counts[2]} failed")
+    return 0 if counts[2] == 0 else 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated transaction producer")
+    parser.add_argument("--rate", type=float,
+                        help="Load-generator mode: target transactions/sec across all processes (0 = unthrottled)")
+    parser.add_argument("--processes", type=int, default=1, help="Producer processes in load-generator mode")
+    parser.add_argument("--duration", type=float, help="Stop after N seconds (load-generator mode)")
+    parser.add_argument("--users", type=int, default=NUM_USERS, help=f"Number of simulated users (default: {NUM_USERS})")
+    parser.add_argument("--seed", type=int, help="Random seed for the generated users and transactions")
+    parser.add_argument("--population", help="Load-generator mode: user population file from scripts/generate_population.py")
+    parser.add_argument("--replay", help="Send the transactions of a scenario file from scripts/generate_scenario.py")
+    parser.add_argument("--retime", action="store_true", help="With --replay, shift timestamps so the scenario starts now")
+    parser.add_argument("--encoding", default="json", choices=ENCODINGS,
+                        help="Message encoding: json, or the compact versioned msgpack format (detectors accept both)")
+    parser.add_argument("--topic", default="transactions")
+    parser.add_argument("--bootstrap-servers", default="localhost:9092")
+    parser.add_argument("--linger-ms", type=int, default=20, help="Producer linger_ms in load-generator mode")
+    parser.add_argument("--batch-size", type=int, default=256 * 1024, help="Producer batch_size in bytes")
+    parser.add_argument("--buffer-memory", type=int, default=128 * 1024 * 1024, help="Producer buffer_memory in bytes")
+    parser.add_argument("--compression", default="gzip", choices=["none", "gzip", "snappy", "lz4", "zstd"],
+                        help="Producer compression (snappy, lz4 and zstd need their codec packages)")
+    parser.add_argument("--acks", default="1", choices=["0", "1", "all"])
+    parser.add_argument("--chunk", type=int, default=1000, help="Transactions generated per NumPy batch")
+    parser.add_argument("--report-interval", type=float, default=5.0, help="Seconds between throughput reports")
+    args = parser.parse_args()
+
+    if args.replay:
+        return run_replay(args)
+    if args.rate is None:
+        if args.seed is not None:
+            random.seed(args.seed)
+        return run_interactive(args)
+    return run_load(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""Transaction History Archiver
+
+Copies new transaction_history rows into the partitioned Parquet archive
+(components/history_archive.py). Runs once by default; with --interval it
+keeps exporting every N seconds. Train from the archive with
+init_user_profiles.py --from-archive, train_cohort_models.py --from-archive
+or TRAINING_HISTORY_SOURCE=archive for the enhanced detector's scheduler.
+"""
+
+import sys
+import os
+import time
+import argparse
+
+# Add the parent directory to the path so we can import components
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components.db_connection import connect
+from components.history_archive import HistoryArchive, ARCHIVE_DIR, USER_BUCKETS
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive transaction_history to Parquet")
+    parser.add_argument("--path", default=ARCHIVE_DIR, help="Archive directory (default: HISTORY_ARCHIVE_DIR)")
+    parser.add_argument("--buckets", type=int, default=USER_BUCKETS,
+                        help=f"User buckets per date partition (default: {USER_BUCKETS})")
+    parser.add_argument("--interval", type=int, help="Keep running, exporting every N seconds")
+    args = parser.parse_args()
+
+    archive = HistoryArchive(args.path, args.buckets)
+    conn = None
+    try:
+        while True:
+            try:
+                if conn is None or conn.closed:
+                    conn = connect()
+                start = time.time()
+                written = archive.export(conn)
+                print(f"Archived {written} transactions to {archive.path} in {time.time() - start:.2f}s")
+            except Exception as e:
+                print(f"Error archiving transaction history: {e}")
+                if not args.interval:
+                    return 1
+            if not args.interval:
+                return 0
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        if conn is not None:
+            conn.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
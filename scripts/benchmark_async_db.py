@@ -0,0 +1,149 @@
+"""Async vs Sync Database Write Benchmark
+
+Writes the same synthetic scored batches through the current synchronous
+psycopg2 path (per-transaction history insert and commit, per-batch fraud
+inserts and counter update) and through the psycopg 3 pipelined
+AsyncDetectorStore, and reports transactions/sec for each.
+
+Runs against a local PostgreSQL in a scratch schema (anomaly_bench) that is
+dropped afterwards, so live tables are untouched.
+"""
+
+import sys
+import os
+import time
+import uuid
+import random
+import asyncio
+import argparse
+
+# All connections made by this script (psycopg2 and psycopg 3) use the scratch schema
+BENCH_SCHEMA = "anomaly_bench"
+os.environ["PGOPTIONS"] = f"-c search_path={BENCH_SCHEMA}"
+
+# Add the parent directory to the path so we can import components
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components.db_connection import connect, execute_prepared
+from components.user_profile_manager import UserProfileManager
+from components.async_db import AsyncDetectorStore, fraud_record
+from components.rollups import create_rollup_tables, record_anomalies as record_rollups
+
+TABLES = ["user_profiles", "transaction_history", "user_activity", "frauds", "processing_stats"]
+# Created in the scratch schema by create_rollup_tables(), which doesn't need
+# them to exist in public
+ROLLUP_TABLES = ["anomaly_rollups", "anomaly_histograms"]
+
+def setup_schema(conn):
+    cursor = conn.cursor()
+    cursor.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+    for table in TABLES:
+        cursor.execute(f"CREATE TABLE {BENCH_SCHEMA}.{table} (LIKE public.{table} INCLUDING ALL)")
+    create_rollup_tables(cursor)
+    cursor.execute(f"""
+        INSERT INTO {BENCH_SCHEMA}.processing_stats (counter_name, count_value, last_updated_timestamp)
+        VALUES ('total_transactions_processed', 0, NOW())
+    """)
+    conn.commit()
+
+def truncate(conn):
+    cursor = conn.cursor()
+    cursor.execute(f"TRUNCATE {', '.join(f'{BENCH_SCHEMA}.{t}' for t in TABLES[:4] + ROLLUP_TABLES)}")
+    conn.commit()
+
+def make_batches(total, batch_size, users, seed=42):
+    rng = random.Random(seed)
+    txns = []
+    for i in range(total):
+        anomalous = i % 20 == 0
+        txns.append({
+            "transaction_id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "user_id": rng.randint(1, users),
+            "amount": round(rng.uniform(3000, 10000) if anomalous else rng.uniform(5, 500), 2),
+            "currency": "USD",
+            "location": "RU" if anomalous else rng.choice(["US", "UK", "CA"]),
+            "timestamp": time.time() - rng.uniform(0, 86400),
+            "transaction_type": "purchase",
+            "merchant": {"merchant_id": "MERCH1000", "name": "Retail_100", "category": "Retail"},
+            "payment_method": "Credit Card",
+            "device_info": {"type": "Mobile", "ip_address": "192.168.1.1"},
+            "_anomalous": anomalous,
+            "anomaly": 1 if anomalous else 0,
+            "detection_score": 0.9 if anomalous else 0.1,
+            "risk_level": "high" if anomalous else "low",
+            "model_used": "user",
+        })
+    return [txns[i:i + batch_size] for i in range(0, total, batch_size)]
+
+def run_sync(batches):
+    user_manager = UserProfileManager(model_mode="user")
+    conn, cursor = user_manager.conn, user_manager.cursor
+    start = time.time()
+    for batch in batches:
+        for txn in batch:
+            user_manager.store_transaction(txn)
+        execute_prepared(cursor, "increment_processed", (len(batch),))
+        conn.commit()
+        new_anomalies = []
+        for txn in batch:
+            if txn["anomaly"] == 1:
+                execute_prepared(cursor, "upsert_fraud", fraud_record(txn))
+                if cursor.fetchone()[0]:
+                    new_anomalies.append(txn)
+        record_rollups(cursor, new_anomalies)
+        conn.commit()
+    elapsed = time.time() - start
+    user_manager.close()
+    return elapsed
+
+async def run_async(batches, overlap):
+    store = await AsyncDetectorStore().connect()
+    start = time.time()
+    pending = None
+    for batch in batches:
+        if overlap:
+            if pending is not None:
+                await pending
+            pending = asyncio.create_task(store.persist_batch(batch))
+        else:
+            await store.persist_batch(batch)
+    if pending is not None:
+        await pending
+    elapsed = time.time() - start
+    await store.close()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark async pipelined writes against the sync path")
+    parser.add_argument("--transactions", type=int, default=5000, help="Transactions to write (default: 5000)")
+    parser.add_argument("--batch-size", type=int, default=10, help="Transactions per batch (default: 10)")
+    parser.add_argument("--users", type=int, default=100, help="Distinct users (default: 100)")
+    parser.add_argument("--keep", action="store_true", help=f"Keep the {BENCH_SCHEMA} schema afterwards")
+    args = parser.parse_args()
+
+    admin = connect(retries=0)
+    batches = make_batches(args.transactions, args.batch_size, args.users)
+    try:
+        setup_schema(admin)
+        results = []
+
+        results.append(("sync psycopg2", run_sync(batches)))
+        truncate(admin)
+        results.append(("async pipeline", asyncio.run(run_async(batches, overlap=False))))
+        truncate(admin)
+        results.append(("async pipeline + overlap", asyncio.run(run_async(batches, overlap=True))))
+
+        print(f"\n{args.transactions} transactions in batches of {args.batch_size}\n")
+        print(f"{'path':<26} {'seconds':>9} {'txn/sec':>10}")
+        for name, elapsed in results:
+            print(f"{name:<26} {elapsed:>9.2f} {args.transactions / max(elapsed, 1e-9):>10,.0f}")
+    finally:
+        if not args.keep:
+            admin.cursor().execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+            admin.commit()
+        admin.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""Cohort vs Per-User Model Benchmark
+
+Compares per-user models with cohort models on the labelled transaction
+history: model memory (pickled size), training time and F1 on each user's
+most recent transactions, which are held out from training.
+"""
+
+import sys
+import os
+import time
+import pickle
+import argparse
+import numpy as np
+import pandas as pd
+
+# Add the parent directory to the path so we can import components
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components.user_profile_manager import (
+    UserProfileManager, HISTORY_COLUMNS, build_user_features, fit_user_model, score_results
+)
+from components.cohort_models import (
+    summarize_history_profiles, cluster_profiles, fit_cohort_models,
+    calibration_offsets, score_cohort_frame
+)
+
+def load_history(user_manager, max_users, per_user_limit):
+    """Latest labelled transactions of the most active users"""
+    user_manager.cursor.execute("""
+        SELECT user_id, amount, location, transaction_type, merchant_category,
+               payment_method, device_type, timestamp,
+               EXTRACT(HOUR FROM to_timestamp(timestamp)) as hour_of_day,
+               EXTRACT(DOW FROM to_timestamp(timestamp)) as day_of_week,
+               is_anomalous
+        FROM (
+            SELECT h.*, ROW_NUMBER() OVER (
+                PARTITION BY h.user_id ORDER BY h.timestamp DESC
+            ) AS rn
+            FROM transaction_history h
+            WHERE h.user_id IN (
+                SELECT user_id FROM user_activity
+                ORDER BY transaction_count DESC
+                LIMIT %s
+            )
+        ) recent
+        WHERE rn <= %s
+    """, (max_users, per_user_limit))
+    return pd.DataFrame(user_manager.cursor.fetchall(),
+                        columns=['user_id'] + HISTORY_COLUMNS + ['is_anomalous'])
+
+def split_history(history, test_fraction):
+    """Hold out each user's most recent transactions for evaluation"""
+    history = history.sort_values(['user_id', 'timestamp'])
+    rank = history.groupby('user_id').cumcount(ascending=False)
+    size = history.groupby('user_id')['timestamp'].transform('size')
+    is_test = rank < (size * test_fraction).round()
+    return history[~is_test], history[is_test]
+
+def f1(labels, predictions):
+    labels = np.asarray(labels, dtype=bool)
+    predictions = np.asarray(predictions, dtype=bool)
+    tp = np.sum(labels & predictions)
+    precision = tp / max(predictions.sum(), 1)
+    recall = tp / max(labels.sum(), 1)
+    return 2 * precision * recall / max(precision + recall, 1e-9)
+
+def model_bytes(models):
+    return sum(len(pickle.dumps(bundle)) for bundle in models.values())
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cohort models against per-user models")
+    parser.add_argument("--users", type=int, default=1000, help="Most active users to include (default: 1000)")
+    parser.add_argument("--per-user-limit", type=int, default=200, help="Transactions per user (default: 200)")
+    parser.add_argument("--cohorts", type=int, default=20, help="Number of cohorts (default: 20)")
+    parser.add_argument("--test-fraction", type=float, default=0.2, help="Held-out share per user (default: 0.2)")
+    args = parser.parse_args()
+
+    user_manager = UserProfileManager(model_mode="user")
+    history = load_history(user_manager, args.users, args.per_user_limit)
+    if history.empty:
+        print("No transaction history to benchmark on.")
+        return 1
+
+    train, test = split_history(history, args.test_fraction)
+    train = train[train['is_anomalous'] == False]
+    print(f"{history['user_id'].nunique()} users, {len(train)} training rows, "
+          f"{len(test)} test rows ({int(test['is_anomalous'].sum())} anomalous)")
+
+    # Per-user models
+    start = time.time()
+    user_models = {
+        user_id: fit_user_model(group[HISTORY_COLUMNS])
+        for user_id, group in train.groupby('user_id')
+        if len(group) >= 20
+    }
+    user_train_time = time.time() - start
+
+    user_predictions = np.zeros(len(test), dtype=bool)
+    user_covered = np.zeros(len(test), dtype=bool)
+    for user_id, positions in test.groupby('user_id').indices.items():
+        if user_id not in user_models:
+            continue
+        model, scaler, feature_columns = user_models[user_id]
+        scores = model.decision_function(build_user_features(test.iloc[positions], scaler, feature_columns))
+        user_predictions[positions] = [r['is_anomaly'] for r in score_results(model, scores)]
+        user_covered[positions] = True
+
+    # Cohort models
+    start = time.time()
+    profiles = summarize_history_profiles(train)
+    cohorts = dict(zip(profiles['user_id'], cluster_profiles(profiles, args.cohorts)))
+    cohort_models = fit_cohort_models(train, cohorts)
+    offsets = calibration_offsets(train, cohorts, cohort_models)
+    cohort_train_time = time.time() - start
+
+    results = {}
+    for name, use_offsets in (("cohort", False), ("cohort+calibration", True)):
+        assignments = {u: (c, offsets.get(u, 0.0) if use_offsets else 0.0) for u, c in cohorts.items()}
+        scored = score_cohort_frame(test, assignments, cohort_models)
+        results[name] = np.array([bool(r and r['is_anomaly']) for r in scored])
+
+    labels = test['is_anomalous'].to_numpy(dtype=bool)
+    print()
+    print(f"{'approach':<20} {'models':>7} {'memory (KB)':>12} {'train (s)':>10} {'F1 all':>8} {'F1 covered':>11}")
+    print(f"{'per-user':<20} {len(user_models):>7} {model_bytes(user_models) / 1024:>12.1f} "
+          f"{user_train_time:>10.2f} {f1(labels, user_predictions):>8.3f} "
+          f"{f1(labels[user_covered], user_predictions[user_covered]):>11.3f}")
+    for name, predictions in results.items():
+        print(f"{name:<20} {len(cohort_models):>7} {model_bytes(cohort_models) / 1024:>12.1f} "
+              f"{cohort_train_time:>10.2f} {f1(labels, predictions):>8.3f} "
+              f"{f1(labels[user_covered], predictions[user_covered]):>11.3f}")
+    print()
+    print("'covered' restricts F1 to users that have a per-user model; per-user "
+          "rows without a model count as not flagged in 'all'.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""Detector Warm-up Benchmark
+
+Measures how long it takes to build the in-memory profile table the enhanced
+detector loads at startup, and how much memory it takes, for several
+population sizes. By default profiles are synthetic and streamed in chunks
+exactly as the database load does; --from-db times the real streamed query
+against user_profiles instead.
+"""
+
+import sys
+import os
+import time
+import random
+import argparse
+
+# Add the parent directory to the path so we can import components
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components.profile_rules import ProfileTable
+
+LOCATIONS = ["US", "IN", "UK", "CA", "AU", "JP", "DE", "FR", "BR", "SG"]
+MERCHANT_CATEGORIES = ["Retail", "Restaurant", "Travel", "Entertainment", "Grocery",
+                       "Electronics", "Healthcare", "Utilities", "Education", "Other"]
+PAYMENT_METHODS = ["Credit Card", "Debit Card", "Bank Transfer", "Digital Wallet", "Cryptocurrency"]
+
+def synthetic_chunks(total, chunk_size, seed=42):
+    """Yield profile rows in chunks, shaped like the user_profiles query"""
+    rng = random.Random(seed)
+    template = [
+        (
+            0,
+            rng.sample(LOCATIONS, rng.randint(1, 3)),
+            rng.sample(MERCHANT_CATEGORIES, rng.randint(2, 5)),
+            rng.sample(PAYMENT_METHODS, rng.randint(1, 3)),
+            [rng.randint(8, 22) for _ in range(rng.randint(3, 8))],
+            round(rng.uniform(5, 200), 2),
+            round(rng.uniform(300, 2000), 2),
+        )
+        for _ in range(min(chunk_size, 10000))
+    ]
+    for start in range(0, total, chunk_size):
+        size = min(chunk_size, total - start)
+        yield [
+            (start + i + 1,) + template[i % len(template)][1:]
+            for i in range(size)
+        ]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark detector profile warm-up")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000],
+                        help="Profile counts to build (default: 100000 1000000)")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="Rows per streamed chunk")
+    parser.add_argument("--from-db", action="store_true",
+                        help="Time loading the real user_profiles table instead")
+    args = parser.parse_args()
+
+    if args.from_db:
+        from components.user_profile_manager import UserProfileManager
+        user_manager = UserProfileManager(model_mode="user")
+        start = time.time()
+        table = ProfileTable.load(user_manager.conn, chunk_size=args.chunk_size)
+        user_manager.conn.commit()
+        elapsed = time.time() - start
+        print(f"Loaded {len(table)} profiles from the database in {elapsed:.2f}s "
+              f"({table.nbytes / 1e6:.1f} MB, {len(table) / max(elapsed, 1e-9):,.0f} profiles/sec)")
+
+        start = time.time()
+        preloaded = user_manager.preload_models()
+        print(f"Preloaded {preloaded} user models in {time.time() - start:.2f}s")
+        return 0
+
+    print(f"{'profiles':>10} {'seconds':>9} {'MB':>8} {'profiles/sec':>14}")
+    for size in args.sizes:
+        start = time.time()
+        table = ProfileTable.from_chunks(synthetic_chunks(size, args.chunk_size))
+        elapsed = time.time() - start
+        print(f"{len(table):>10} {elapsed:>9.2f} {table.nbytes / 1e6:>8.1f} "
+              f"{len(table) / max(elapsed, 1e-9):>14,.0f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
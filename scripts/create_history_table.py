@@ -1,20 +1,16 @@
-import psycopg2
 import sys
 import os
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from components.db_connection import connect
+from components.partitioning import create_table
+from components.rollups import create_rollup_tables
+
 def create_transaction_history_table():
     """Create a table to store transaction history for user behavior analysis"""
     conn = None
     try:
-        conn = psycopg2.connect(
-            dbname="anomalies",
-            user="user",
-            password="pass",
-            host="localhost",
-            port="5432",
-            connect_timeout=10
-        )
-        conn.set_session(autocommit=False)
+        conn = connect()
         cursor = conn.cursor()
         
         # Create user profiles table first (must exist before transaction_history due to FK constraint)
@@ -35,37 +31,65 @@ def create_transaction_history_table():
             )
         """)
         
-        # Create table for transaction history
+        # Create table for transaction history, partitioned by month
+        create_table(cursor, "transaction_history")
+        
+        # Per-user activity counters, maintained incrementally by the ingestion
+        # path so candidate selection and stats don't scan transaction_history
+        cursor.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'user_activity')")
+        activity_exists = cursor.fetchone()[0]
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS transaction_history (
-                transaction_id TEXT PRIMARY KEY,
-                user_id INT NOT NULL,
-                amount FLOAT NOT NULL,
-                currency TEXT,
-                location TEXT,
-                timestamp FLOAT,
-                transaction_type TEXT,
-                merchant_category TEXT,
-                payment_method TEXT,
-                device_type TEXT,
-                is_anomalous BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+            CREATE TABLE IF NOT EXISTS user_activity (
+                user_id INT PRIMARY KEY,
+                transaction_count BIGINT NOT NULL DEFAULT 0,
+                since_last_fit BIGINT NOT NULL DEFAULT 0,
+                anomaly_count BIGINT NOT NULL DEFAULT 0,
+                last_seen FLOAT,
+                last_model_fit TIMESTAMP WITH TIME ZONE
             )
         """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_activity_txn_count ON user_activity(transaction_count DESC)")
         
-        # Populate user profiles table with IDs from simulation
-        print("Pre-populating user_profiles table with IDs...")
-        for user_id in range(1, 101):
+        if not activity_exists:
+            # One-time backfill from the existing history
+            print("Backfilling user_activity from transaction history...")
             cursor.execute("""
-                INSERT INTO user_profiles (user_id)
-                VALUES (%s)
+                INSERT INTO user_activity (user_id, transaction_count, since_last_fit, last_seen)
+                SELECT user_id, COUNT(*), COUNT(*), MAX(timestamp)
+                FROM transaction_history
+                GROUP BY user_id
                 ON CONFLICT (user_id) DO NOTHING
-            """, (user_id,))
-        print("Added 100 user profiles")
+            """)
+            cursor.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'frauds')")
+            if cursor.fetchone()[0]:
+                cursor.execute("""
+                    UPDATE user_activity a
+                    SET anomaly_count = f.count
+                    FROM (SELECT user_id, COUNT(*) AS count FROM frauds GROUP BY user_id) f
+                    WHERE a.user_id = f.user_id
+                """)
         
-        # Create indices for faster lookups
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_txn_history_user_id ON transaction_history(user_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_txn_history_timestamp ON transaction_history(timestamp)")
+        # Cohort assignments for shared cohort models (scripts/train_cohort_models.py)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS user_cohorts (
+                user_id INT PRIMARY KEY,
+                cohort_id INT NOT NULL,
+                calibration_offset FLOAT DEFAULT 0,
+                assigned_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+            )
+        """)
+        
+        # Pre-aggregated anomaly counts read by the dashboard metrics routes
+        create_rollup_tables(cursor)
+        
+        # Populate user profiles table with IDs from simulation
+        print("Pre-populating user_profiles table with IDs...")
+        cursor.execute("""
+            INSERT INTO user_profiles (user_id)
+            SELECT generate_series(1, 100)
+            ON CONFLICT (user_id) DO NOTHING
+        """)
+        print("Added 100 user profiles")
         
         conn.commit()
         print("Transaction history table created successfully")
@@ -0,0 +1,62 @@
+"""Synthetic Population Generator
+
+Generates a population of synthetic users as NumPy arrays, saves it to an
+.npz or .parquet file and (with --load-db) bulk-loads matching user_profiles
+rows with COPY. Feed the same file to the load generator with
+`producer/produce.py --rate N --population FILE` so the transactions come from
+the users in the database.
+"""
+
+import sys
+import os
+import time
+import argparse
+
+# Add the parent directory to the path so we can import components
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components.db_connection import connect
+from components.population import generate_population, save_population, load_population, copy_profiles
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic user population")
+    parser.add_argument("--users", type=int, default=1000000, help="Number of users (default: 1000000)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed (default: 42)")
+    parser.add_argument("--output", default="population.npz", help="Population file, .npz or .parquet")
+    parser.add_argument("--from-file", action="store_true", help="Load an existing --output file instead of generating")
+    parser.add_argument("--load-db", action="store_true", help="COPY the population into user_profiles")
+    parser.add_argument("--chunk-size", type=int, default=100000, help="Rows per COPY chunk")
+    args = parser.parse_args()
+
+    start = time.time()
+    if args.from_file:
+        population = load_population(args.output)
+        print(f"Loaded {len(population['user_ids'])} users from {args.output} in {time.time() - start:.2f}s")
+    else:
+        population = generate_population(args.users, args.seed)
+        save_population(args.output, population)
+        print(f"Generated {args.users} users to {args.output} in {time.time() - start:.2f}s")
+
+    if not args.load_db:
+        return 0
+
+    conn = None
+    try:
+        conn = connect()
+        start = time.time()
+        written = copy_profiles(conn, population, args.chunk_size)
+        conn.commit()
+        elapsed = max(time.time() - start, 1e-9)
+        print(f"Loaded {written} user profiles in {elapsed:.2f}s ({written / elapsed:.0f} rows/sec)")
+        return 0
+    except Exception as e:
+        print(f"Error loading user profiles: {e}")
+        if conn:
+            conn.rollback()
+        return 1
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
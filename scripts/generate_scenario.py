@@ -0,0 +1,53 @@
+"""Scenario Generator
+
+Writes a deterministic, labelled transaction stream (components/scenarios.py)
+to a .parquet or .jsonl.gz file. The same seed and config always produce the
+same file. Replay it with `producer/produce.py --replay FILE` so benchmarks and
+detector comparisons see identical input.
+"""
+
+import sys
+import os
+import json
+import time
+import argparse
+
+# Add the parent directory to the path so we can import components
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components.scenarios import load_config, generate_scenario, write_scenario
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a seeded transaction scenario")
+    parser.add_argument("--config", help="JSON file overriding the default scenario")
+    parser.add_argument("--seed", type=int, help="Random seed (default: 42)")
+    parser.add_argument("--users", type=int, help="Number of generated users (default: 10000)")
+    parser.add_argument("--population", help="Population file from generate_population.py to draw users from")
+    parser.add_argument("--hours", type=float, help="Scenario length in hours (default: 24)")
+    parser.add_argument("--rate", type=float, help="Mean transactions/sec (default: 20)")
+    parser.add_argument("--output", default="scenario.parquet", help="Output file, .parquet or .jsonl.gz")
+    parser.add_argument("--print-config", action="store_true", help="Print the effective config and exit")
+    args = parser.parse_args()
+
+    overrides = {
+        key: value for key, value in (
+            ("seed", args.seed), ("users", args.users), ("population", args.population),
+            ("duration_hours", args.hours), ("base_rate", args.rate),
+        ) if value is not None
+    }
+    config = load_config(args.config, overrides)
+    if args.print_config:
+        print(json.dumps(config, indent=2))
+        return 0
+
+    start = time.time()
+    frame = generate_scenario(config)
+    write_scenario(frame, args.output, config)
+    print(f"Wrote {len(frame)} transactions ({int(frame['_anomalous'].sum())} labelled anomalous) "
+          f"to {args.output} in {time.time() - start:.2f}s")
+    for pattern, count in frame["pattern"].value_counts().items():
+        print(f"  {pattern}: {count}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,43 +1,24 @@
 import psycopg2
 import sys
 import os
-import time
 
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from components.db_connection import connect
+from components.partitioning import create_table
 
 def init_database():
     """Initialize the database with the required tables and schema"""
     print("Initializing database...")
     
-    # Connection parameters - should match those in your application
-    conn_params = {
-        "dbname": "anomalies",
-        "user": "user",
-        "password": "pass",
-        "host": "localhost",
-        "port": "5432"
-    }
-    
     # Try to connect multiple times in case database is starting up
-    max_retries = 5
-    retry_delay = 3
-    
-    for attempt in range(max_retries):
-        try:
-            conn = psycopg2.connect(**conn_params)
-            conn.set_session(autocommit=False)
-            cursor = conn.cursor()
-            break
-        except psycopg2.Error as e:
-            if attempt < max_retries - 1:
-                print(f"Failed to connect (attempt {attempt+1}/{max_retries}): {e}")
-                print(f"Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
-            else:
-                print(f"Failed to connect after {max_retries} attempts: {e}")
-                print("Ensure PostgreSQL is running and the credentials are correct.")
-                return False
+    try:
+        conn = connect(retries=4, backoff=3)
+        cursor = conn.cursor()
+    except psycopg2.Error as e:
+        print(f"Failed to connect to database: {e}")
+        print("Ensure PostgreSQL is running and the credentials are correct.")
+        return False
     
     try:
         # Check if tables exist first
@@ -52,30 +33,8 @@ def init_database():
         
         # Create frauds table if it doesn't exist
         if not frauds_exists:
-            print("Creating frauds table...")
-            cursor.execute("""
-                CREATE TABLE frauds (
-                    transaction_id TEXT PRIMARY KEY,
-                    user_id INT,
-                    amount FLOAT,
-                    currency TEXT,
-                    location TEXT,
-                    timestamp FLOAT,
-                    transaction_type TEXT,
-                    merchant_id TEXT,
-                    merchant_name TEXT,
-                    merchant_category TEXT,
-                    payment_method TEXT,
-                    device_type TEXT,
-                    ip_address TEXT,
-                    is_confirmed_fraud BOOLEAN DEFAULT FALSE,
-                    detection_score FLOAT,
-                    risk_level TEXT,
-                    detection_time TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                    detection_features JSONB,
-                    notes TEXT
-                )
-            """)
+            print("Creating partitioned frauds table...")
+            create_table(cursor, "frauds")
         else:
             print("Frauds table already exists, checking schema...")
             # Check if all required columns exist
@@ -109,6 +68,10 @@ def init_database():
                     cursor.execute(f"ALTER TABLE frauds ADD COLUMN {col} FLOAT")
                 else:
                     cursor.execute(f"ALTER TABLE frauds ADD COLUMN {col} TEXT")
+            
+            # Keep upcoming partitions (or, for an unpartitioned table, the
+            # ON CONFLICT index) in place
+            create_table(cursor, "frauds")
         
         # Create processing_stats table
         if not stats_exists:
@@ -8,28 +8,101 @@ import os
 import pandas as pd
 import json
 import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
 
 # Add the parent directory to the path so we can import components
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from components.user_profile_manager import UserProfileManager
+from components.user_profile_manager import UserProfileManager, fit_user_model
+
+MIN_TRANSACTIONS = 20
+
+def fit_user_histories(jobs):
+    """Fit a model for each (user_id, history frame) job (runs in a worker
+    process); returns (user_id, fitted model or None, error or None) each"""
+    results = []
+    for user_id, history in jobs:
+        if len(history) < MIN_TRANSACTIONS:
+            results.append((user_id, None, None))
+            continue
+        try:
+            results.append((user_id, fit_user_model(history), None))
+        except Exception as e:
+            results.append((user_id, None, str(e)))
+    return results
+
+def train_models_parallel(user_manager, users, workers, jobs_per_task=8):
+    """Stream all histories from one query and fit user models across a
+    process pool
+
+    Histories are handed to the workers as they arrive, with a bounded
+    number of tasks queued, and each model is saved as soon as its task
+    completes, so neither the histories nor the fitted models have to fit in
+    memory at once.
+    """
+    histories = user_manager.iter_training_histories(users)
+
+    start = time.time()
+    trained = 0
+    failed = 0
+    rows = 0
+
+    def collect(futures):
+        nonlocal trained, failed
+        for future in futures:
+            saved = []
+            for user_id, result, error in future.result():
+                if result is None:
+                    failed += 1
+                    if error:
+                        print(f"  Failed to train model for user {user_id}: {error}")
+                    continue
+                model, scaler, feature_columns = result
+                user_manager.save_user_model(user_id, model, scaler, feature_columns)
+                saved.append(user_id)
+            if saved:
+                user_manager.mark_models_fitted(saved)
+                trained += len(saved)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+        while True:
+            jobs = list(islice(histories, jobs_per_task))
+            if not jobs:
+                break
+            rows += sum(len(history) for _, history in jobs)
+            if len(in_flight) >= workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight.add(executor.submit(fit_user_histories, jobs))
+        collect(in_flight)
+    print(f"Streamed {rows} history rows for {len(users)} users")
+
+    elapsed = max(time.time() - start, 1e-9)
+    print(f"Trained {trained} user models ({failed} skipped) with {workers} workers "
+          f"in {elapsed:.2f}s ({trained / elapsed:.1f} users/sec)")
 
 def main():
     """Initialize user profiles from existing transaction history"""
+    parser = argparse.ArgumentParser(description="Initialize user profiles and models")
+    parser.add_argument("--parallel", action="store_true",
+                        help="Fetch history in bulk and train user models across a process pool")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes for --parallel (default: CPU count)")
+    parser.add_argument("--from-archive", action="store_true",
+                        help="Read training history from the Parquet archive instead of the database")
+    args = parser.parse_args()
+
     print("Initializing user profiles from transaction history...")
     
     try:
         # Initialize the user profile manager
-        user_manager = UserProfileManager()
+        user_manager = UserProfileManager(history_source="archive" if args.from_archive else None)
         
         # Get all users with at least 20 transactions
-        user_manager.cursor.execute("""
-            SELECT DISTINCT user_id FROM transaction_history
-            GROUP BY user_id
-            HAVING COUNT(*) >= 20
-        """)
-        
-        users = [row[0] for row in user_manager.cursor.fetchall()]
+        users = user_manager.get_training_candidates(MIN_TRANSACTIONS)
         
         if not users:
             print("No users found with sufficient transaction history.")
@@ -38,16 +111,21 @@ def main():
         
         print(f"Found {len(users)} users with sufficient transaction history.")
         
+        # Profiles of every user with history are computed in one statement
+        start = time.time()
+        updated = user_manager.update_user_profiles()
+        if updated is None:
+            print("Failed to update user profiles.")
+            return 1
+        print(f"Updated {updated} user profiles in {time.time() - start:.2f}s")
+
+        if args.parallel:
+            train_models_parallel(user_manager, users, max(1, args.workers))
+            print("User profile initialization complete.")
+            return 0
+
         for i, user_id in enumerate(users):
             print(f"Processing user {user_id} ({i+1}/{len(users)})...")
-            
-            # Update the user's profile
-            updated = user_manager.update_user_profile(user_id)
-            if updated:
-                print(f"  Updated profile for user {user_id}")
-            else:
-                print(f"  Failed to update profile for user {user_id}")
-                continue
                 
             # Train a model for the user
             trained = user_manager.train_user_model(user_id)
@@ -13,21 +13,16 @@ import os
 import sys
 import subprocess
 import time
-import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from components.db_connection import connect
+from components import partitioning
+from components.rollups import prune_minute_rollups
 
 def connect_to_db():
     """Connect to the database"""
     try:
-        conn = psycopg2.connect(
-            dbname="anomalies",
-            user="user",
-            password="pass",
-            host="localhost",
-            port="5432",
-            connect_timeout=10
-        )
-        conn.set_session(autocommit=False)
-        return conn
+        return connect(retries=0)
     except Exception as e:
         print(f"Error connecting to database: {e}")
         return None
@@ -67,7 +62,7 @@ def init_database():
     print("Database schema initialized successfully.")
     return True
 
-def init_user_profiles():
+def init_user_profiles(parallel=False, workers=None):
     """Initialize user profiles from existing transaction history"""
     print("Initializing user profiles...")
     
@@ -76,11 +71,11 @@ def init_user_profiles():
     if conn:
         try:
             cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM transaction_history")
-            count = cursor.fetchone()[0]
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM transaction_history)")
+            has_history = cursor.fetchone()[0]
             conn.close()
             
-            if count == 0:
+            if not has_history:
                 print("No transactions found in history table.")
                 print("You need to run the system first to collect transaction data.")
                 return False
@@ -92,10 +87,15 @@ def init_user_profiles():
             return False
     
     # Run the init_user_profiles script
-    success = run_command([
+    cmd = [
         sys.executable, 
         os.path.join(os.path.dirname(os.path.abspath(__file__)), "init_user_profiles.py")
-    ])
+    ]
+    if parallel:
+        cmd.append("--parallel")
+        if workers:
+            cmd.extend(["--workers", str(workers)])
+    success = run_command(cmd)
     
     if not success:
         print("Failed to initialize user profiles.")
@@ -104,6 +104,200 @@ def init_user_profiles():
     print("User profiles initialized successfully.")
     return True
 
+def train_cohort_models(cohorts=None):
+    """Cluster users into cohorts and train one model per cohort"""
+    print("Training cohort models...")
+    
+    cmd = [
+        sys.executable,
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "train_cohort_models.py")
+    ]
+    if cohorts:
+        cmd.extend(["--cohorts", str(cohorts)])
+    
+    if not run_command(cmd):
+        print("Failed to train cohort models.")
+        return False
+    
+    print("Cohort models trained. Run the enhanced system with USER_MODEL_MODE=cohort to use them.")
+    return True
+
+def archive_history():
+    """Export new transaction history to the Parquet archive"""
+    print("Archiving transaction history...")
+    
+    if not run_command([
+        sys.executable,
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive_history.py")
+    ]):
+        print("Failed to archive transaction history.")
+        return False
+    
+    return True
+
+def maintain_partitions(months_ahead, history_retention, fraud_retention, drop=False, migrate=False):
+    """Pre-create upcoming partitions, expire old ones and prune minute rollups"""
+    conn = connect_to_db()
+    if not conn:
+        print("Failed to connect to database.")
+        return False
+    
+    retention = {"transaction_history": history_retention, "frauds": fraud_retention}
+    try:
+        cursor = conn.cursor()
+        for table, months in retention.items():
+            partitioned = partitioning.is_partitioned(cursor, table)
+            if partitioned is None:
+                print(f"{table}: table does not exist, run --init-db first")
+                continue
+            if not partitioned:
+                if not migrate:
+                    print(f"{table}: not partitioned (use --migrate to convert it)")
+                    continue
+                print(f"{table}: converting to a partitioned table...")
+                moved = partitioning.migrate_to_partitioned(cursor, table, months_ahead)
+                conn.commit()
+                print(f"{table}: moved {moved} rows into monthly partitions")
+            
+            created = partitioning.create_partitions(cursor, table, months_ahead)
+            expired = []
+            if months:
+                expired = partitioning.expire_partitions(cursor, table, months, drop=drop)
+            conn.commit()
+            
+            print(f"{table}: created {len(created)} partitions{': ' + ', '.join(created) if created else ''}")
+            if expired:
+                action = "dropped" if drop else "detached"
+                print(f"{table}: {action} {len(expired)} partitions older than {months} months: {', '.join(expired)}")
+            partitions = partitioning.list_partitions(cursor, table)
+            if partitions:
+                print(f"{table}: {len(partitions)} partitions from {partitions[0][1]:%Y-%m} to {partitions[-1][1]:%Y-%m}")
+        
+        cursor.execute("SELECT to_regclass('anomaly_rollups') IS NOT NULL")
+        if cursor.fetchone()[0]:
+            pruned = prune_minute_rollups(cursor)
+            conn.commit()
+            print(f"anomaly_rollups: pruned {pruned} expired minute buckets")
+        conn.close()
+        return True
+    except Exception as e:
+        print(f"Error maintaining partitions: {e}")
+        conn.rollback()
+        conn.close()
+        return False
+
+def migrate_indexes():
+    """Build missing indexes without blocking writes and drop superseded ones"""
+    try:
+        conn = connect(retries=0, autocommit=True)
+    except Exception as e:
+        print(f"Error connecting to database: {e}")
+        return False
+    
+    try:
+        cursor = conn.cursor()
+        ok = True
+        for table in partitioning.TABLE_INDEXES:
+            if partitioning.is_partitioned(cursor, table) is None:
+                print(f"{table}: table does not exist, run --init-db first")
+                continue
+            start = time.time()
+            built, dropped, invalid = partitioning.migrate_indexes(cursor, table)
+            print(f"{table}: built {len(built)} indexes{': ' + ', '.join(built) if built else ''} "
+                  f"in {time.time() - start:.1f}s")
+            if dropped:
+                print(f"{table}: dropped superseded indexes: {', '.join(dropped)}")
+            if invalid:
+                print(f"{table}: indexes still missing or INVALID: {', '.join(invalid)}")
+                ok = False
+            cursor.execute(f"ANALYZE {table}")
+        conn.close()
+        return ok
+    except Exception as e:
+        print(f"Error migrating indexes: {e}")
+        conn.close()
+        return False
+
+# The queries the detectors, training and dashboard run most, as (name,
+# scanned table, SQL); %(user_id)s is the most active user and %(since)s is
+# one day ago
+HOT_QUERIES = [
+    ("Profile update history", "transaction_history", """
+        SELECT location, merchant_category, amount, payment_method,
+            EXTRACT(HOUR FROM to_timestamp(timestamp)) as hour
+        FROM transaction_history
+        WHERE user_id = %(user_id)s AND is_anomalous = FALSE
+        ORDER BY timestamp DESC
+        LIMIT 100
+    """),
+    ("User model training history", "transaction_history", """
+        SELECT amount, location, transaction_type, merchant_category,
+            payment_method, device_type, timestamp
+        FROM transaction_history
+        WHERE user_id = %(user_id)s AND is_anomalous = FALSE
+        ORDER BY timestamp DESC
+        LIMIT 200
+    """),
+    ("History time range", "transaction_history", """
+        SELECT COUNT(*) FROM transaction_history WHERE timestamp >= %(since)s
+    """),
+    ("Archive export", "transaction_history", """
+        SELECT COUNT(*) FROM transaction_history WHERE created_at > to_timestamp(%(since)s)
+    """),
+    ("Recent frauds", "frauds", """
+        SELECT * FROM frauds WHERE timestamp >= %(since)s ORDER BY timestamp DESC LIMIT 100
+    """),
+    ("Frauds by user", "frauds", """
+        SELECT * FROM frauds WHERE user_id = %(user_id)s ORDER BY timestamp DESC LIMIT 100
+    """),
+    ("Frauds by score", "frauds", """
+        SELECT * FROM frauds WHERE detection_score >= 0.9
+    """),
+]
+
+def explain_hot_queries(verbose=False):
+    """Run EXPLAIN ANALYZE on the hot queries and report their access paths"""
+    conn = connect_to_db()
+    if not conn:
+        print("Failed to connect to database.")
+        return False
+    
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT user_id FROM user_activity ORDER BY transaction_count DESC LIMIT 1")
+        row = cursor.fetchone()
+        params = {"user_id": row[0] if row else 1, "since": time.time() - 86400}
+        print(f"Explaining hot queries for user {params['user_id']} over the last day\n")
+        
+        sequential = 0
+        for name, table, query in HOT_QUERIES:
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, params)
+            plan = [line for (line,) in cursor.fetchall()]
+            conn.rollback()
+            scans = sorted({
+                node.split("(")[0].strip().lstrip("-> ").strip()
+                for node in plan
+                if ("Scan" in node and f" on {table}" in node) or "Bitmap Index Scan" in node
+            })
+            runtime = next((line.split(":", 1)[1].strip() for line in plan if line.startswith("Execution Time")), "?")
+            seq_scan = any("Seq Scan" in scan for scan in scans)
+            sequential += seq_scan
+            print(f"{'SEQ ' if seq_scan else 'OK  '} {name}: {', '.join(scans) or 'no scan'} ({runtime})")
+            if verbose or seq_scan:
+                for line in plan:
+                    print(f"       {line}")
+        
+        if sequential:
+            print(f"\n{sequential} queries used sequential scans. On small tables that is the planner's "
+                  "choice; otherwise run --indexes.")
+        conn.close()
+        return True
+    except Exception as e:
+        print(f"Error explaining queries: {e}")
+        conn.rollback()
+        conn.close()
+        return False
+
 def reset_database():
     """Reset the database by dropping all tables"""
     print("WARNING: This will delete ALL data in the database.")
@@ -128,6 +322,11 @@ def reset_database():
             DROP TABLE IF EXISTS processing_stats CASCADE;
             DROP TABLE IF EXISTS transaction_history CASCADE;
             DROP TABLE IF EXISTS user_profiles CASCADE;
+            DROP TABLE IF EXISTS user_activity CASCADE;
+            DROP TABLE IF EXISTS user_cohorts CASCADE;
+            DROP TABLE IF EXISTS anomaly_rollups CASCADE;
+            DROP TABLE IF EXISTS anomaly_histograms CASCADE;
+            DROP TABLE IF EXISTS seen_transaction_filters CASCADE;
         """)
         
         conn.commit()
@@ -156,24 +355,36 @@ def show_stats():
         cursor.execute("""
             SELECT table_name FROM information_schema.tables 
             WHERE table_schema = 'public'
+              AND table_name NOT IN (SELECT relname FROM pg_class WHERE relispartition)
         """)
         tables = [row[0] for row in cursor.fetchall()]
         print(f"Tables: {', '.join(tables)}")
         
         # Count transactions
-        if 'transaction_history' in tables:
-            cursor.execute("SELECT COUNT(*) FROM transaction_history")
-            txn_count = cursor.fetchone()[0]
+        if 'user_activity' in tables or 'transaction_history' in tables:
+            if 'user_activity' in tables:
+                # Maintained per-user counters: no scan of transaction_history
+                cursor.execute("SELECT COALESCE(SUM(transaction_count), 0) FROM user_activity")
+                txn_count = cursor.fetchone()[0]
+                cursor.execute("""
+                    SELECT user_id, transaction_count 
+                    FROM user_activity 
+                    ORDER BY transaction_count DESC 
+                    LIMIT 5
+                """)
+            else:
+                cursor.execute("SELECT COUNT(*) FROM transaction_history")
+                txn_count = cursor.fetchone()[0]
+                cursor.execute("""
+                    SELECT user_id, COUNT(*) as count 
+                    FROM transaction_history 
+                    GROUP BY user_id 
+                    ORDER BY count DESC 
+                    LIMIT 5
+                """)
             print(f"Total Transactions: {txn_count}")
             
             # Count transactions per user (top 5)
-            cursor.execute("""
-                SELECT user_id, COUNT(*) as count 
-                FROM transaction_history 
-                GROUP BY user_id 
-                ORDER BY count DESC 
-                LIMIT 5
-            """)
             results = cursor.fetchall()
             if results:
                 print("\nTop 5 Users by Transaction Count:")
@@ -240,7 +451,7 @@ def show_stats():
             conn.close()
         return False
 
-def run_system(enhanced=False):
+def run_system(enhanced=False, replicas=None):
     """Run the system with the specified mode"""
     print(f"Starting the {'enhanced' if enhanced else 'standard'} system...")
     
@@ -258,6 +469,8 @@ def run_system(enhanced=False):
     
     if enhanced:
         cmd.append("--enhanced")
+    if replicas:
+        cmd.extend(["--replicas", str(replicas)])
     
     try:
         # Use os.execv to replace the current process
@@ -298,6 +511,11 @@ def main():
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('--init-db', action='store_true', help='Initialize the database schema')
     group.add_argument('--init-profiles', action='store_true', help='Initialize user profiles from existing data')
+    group.add_argument('--train-cohorts', action='store_true', help='Cluster users into cohorts and train cohort models')
+    group.add_argument('--archive-history', action='store_true', help='Export new transaction history to the Parquet archive')
+    group.add_argument('--partitions', action='store_true', help='Create upcoming partitions and expire old ones')
+    group.add_argument('--indexes', action='store_true', help='Build missing indexes concurrently and drop superseded ones')
+    group.add_argument('--explain', action='store_true', help='EXPLAIN ANALYZE the hot queries to check their indexes')
     group.add_argument('--reset', action='store_true', help='Reset the database (delete all data)')
     group.add_argument('--stats', action='store_true', help='Show system statistics')
     group.add_argument('--run', action='store_true', help='Run the standard system')
@@ -306,6 +524,23 @@ def main():
     
     # Add optional arguments that can be used with --run or --run-enhanced
     parser.add_argument('--with-frontends', action='store_true', help='Also start the frontend components')
+    parser.add_argument('--replicas', type=int, help='With --run or --run-enhanced, number of detector processes')
+    parser.add_argument('--parallel', action='store_true', help='With --init-profiles, train user models across a process pool')
+    parser.add_argument('--workers', type=int, help='Number of worker processes for --parallel (default: CPU count)')
+    parser.add_argument('--cohorts', type=int, help='Number of cohorts for --train-cohorts (default: 20)')
+    parser.add_argument('--months-ahead', type=int, default=partitioning.MONTHS_AHEAD,
+                        help=f'With --partitions, months to pre-create (default: {partitioning.MONTHS_AHEAD})')
+    parser.add_argument('--history-retention-months', type=int,
+                        default=int(os.environ.get('HISTORY_RETENTION_MONTHS', 12)),
+                        help='With --partitions, months of transaction history to keep, 0 keeps all (default: 12)')
+    parser.add_argument('--fraud-retention-months', type=int,
+                        default=int(os.environ.get('FRAUD_RETENTION_MONTHS', 24)),
+                        help='With --partitions, months of frauds to keep, 0 keeps all (default: 24)')
+    parser.add_argument('--drop-expired', action='store_true',
+                        help='With --partitions, drop expired partitions instead of detaching them')
+    parser.add_argument('--migrate', action='store_true',
+                        help='With --partitions, convert unpartitioned tables (locks them while copying)')
+    parser.add_argument('--verbose', action='store_true', help='With --explain, print every query plan')
 
     
     args = parser.parse_args()
@@ -313,7 +548,19 @@ def main():
     if args.init_db:
         return 0 if init_database() else 1
     elif args.init_profiles:
-        return 0 if init_user_profiles() else 1
+        return 0 if init_user_profiles(parallel=args.parallel, workers=args.workers) else 1
+    elif args.train_cohorts:
+        return 0 if train_cohort_models(args.cohorts) else 1
+    elif args.archive_history:
+        return 0 if archive_history() else 1
+    elif args.partitions:
+        return 0 if maintain_partitions(args.months_ahead, args.history_retention_months,
+                                        args.fraud_retention_months, drop=args.drop_expired,
+                                        migrate=args.migrate) else 1
+    elif args.indexes:
+        return 0 if migrate_indexes() else 1
+    elif args.explain:
+        return 0 if explain_hot_queries(verbose=args.verbose) else 1
     elif args.reset:
         return 0 if reset_database() else 1
     elif args.stats:
@@ -328,14 +575,14 @@ def main():
             pid = os.fork()
             if pid == 0:
                 # Child process - start the backend
-                run_system(enhanced=False)
+                run_system(enhanced=False, replicas=args.replicas)
             else:
                 # Parent process - start the frontends and then exit
                 time.sleep(3)  # Give backend time to start
                 return run_frontends()
         else:
             # Just start the backend
-            return run_system(enhanced=False)
+            return run_system(enhanced=False, replicas=args.replicas)
     elif args.run_enhanced:
         # If with-frontends is specified, we need to start both backend and frontend
         if args.with_frontends:
@@ -344,14 +591,14 @@ def main():
             pid = os.fork()
             if pid == 0:
                 # Child process - start the backend
-                run_system(enhanced=True)
+                run_system(enhanced=True, replicas=args.replicas)
             else:
                 # Parent process - start the frontends and then exit
                 time.sleep(3)  # Give backend time to start
                 return run_frontends()
         else:
             # Just start the backend
-            return run_system(enhanced=True)
+            return run_system(enhanced=True, replicas=args.replicas)
     
     return 0
 
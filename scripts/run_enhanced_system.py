@@ -1,44 +1,45 @@
 #!/usr/bin/env python3
+"""Runs the producer, the detector replicas and the frontend under a
+supervisor (components/supervisor.py): crashed processes are restarted with
+exponential backoff, enhanced detectors are health-checked on their
+HEALTH_PORT (--health-port + replica index), and Ctrl+C or SIGTERM stops the
+producer first and lets the detectors drain before exiting.
+"""
 import subprocess
 import sys
 import os
-import time
 import signal
 import argparse
 
-# Process handlers
-processes = {}
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from components.supervisor import ManagedProcess, Supervisor
 
-def signal_handler(sig, frame):
-    """Handle Ctrl+C and gracefully terminate all processes"""
-    print("\nShutting down all components...")
-    for name, process in processes.items():
-        if process and process.poll() is None:
-            print(f"Terminating {name}...")
-            process.terminate()
-    
-    # Give processes a moment to terminate gracefully
-    time.sleep(2)
-    
-    # Force kill any remaining processes
-    for name, process in processes.items():
-        if process and process.poll() is None:
-            print(f"Forcefully killing {name}...")
-            process.kill()
-    
-    print("All components shut down.")
-    sys.exit(0)
+# Shutdown order: stop the input first, then let the detectors drain
+PRODUCER_GROUP, DETECTOR_GROUP, FRONTEND_GROUP = 0, 1, 2
 
 def main():
     parser = argparse.ArgumentParser(description="Run the Real-Time Anomaly Detection System")
     parser.add_argument("--enhanced", action="store_true", help="Use the enhanced anomaly detector with user profiles")
     parser.add_argument("--init-user-profiles", action="store_true", help="Initialize user profiles from existing data")
     parser.add_argument("--init-db", action="store_true", help="Initialize database schema")
+    parser.add_argument("--replicas", type=int, default=1, help="Number of detector processes (they share the consumer group)")
+    parser.add_argument("--health-port", type=int, default=8085, help="HEALTH_PORT of the first enhanced detector; replicas use the following ports")
+    parser.add_argument("--max-backoff", type=float, default=60.0, help="Longest delay in seconds between restarts of a crashing process")
+    parser.add_argument("--ready-timeout", type=float, default=300.0, help="Seconds a detector may take to become ready before it is restarted")
+    parser.add_argument("--max-heartbeat-age", type=float, help="Restart a detector whose main loop hasn't beaten for this many seconds")
+    parser.add_argument("--drain-timeout", type=float, default=30.0, help="Seconds each component gets to shut down before it is killed")
     args = parser.parse_args()
     
-    # Set up signal handler for Ctrl+C
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+    supervisor = Supervisor(
+        max_backoff=args.max_backoff,
+        ready_timeout=args.ready_timeout,
+        max_heartbeat_age=args.max_heartbeat_age,
+        drain_timeout=args.drain_timeout
+    )
+    
+    # Ctrl+C and SIGTERM start a coordinated shutdown
+    signal.signal(signal.SIGINT, supervisor.request_stop)
+    signal.signal(signal.SIGTERM, supervisor.request_stop)
     
     # Get the base directory of the project
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -81,33 +82,34 @@ def main():
             print(f"Could not find init_user_profiles.py at {init_profiles_script}")
             return 1
     
-    # Start the Kafka producer
-    print("Starting transaction producer...")
+    # The Kafka producer
     producer_script = os.path.join(base_dir, "producer", "produce.py")
     if os.path.exists(producer_script):
-        processes['producer'] = subprocess.Popen([sys.executable, producer_script])
+        supervisor.add(ManagedProcess("producer", [sys.executable, producer_script], group=PRODUCER_GROUP))
     else:
         print(f"Could not find produce.py at {producer_script}")
         return 1
     
-    # Wait a bit for the producer to start
-    time.sleep(2)
-    
-    # Start the anomaly detector (enhanced or regular)
-    print(f"Starting {'enhanced ' if args.enhanced else ''}anomaly detector...")
+    # The anomaly detector replicas (enhanced or regular)
     if args.enhanced:
         detector_script = os.path.join(base_dir, "detector", "enhanced_anomaly_detector.py")
     else:
         detector_script = os.path.join(base_dir, "detector", "anomaly_detector.py")
         
-    if os.path.exists(detector_script):
-        processes['detector'] = subprocess.Popen([sys.executable, detector_script])
-    else:
+    if not os.path.exists(detector_script):
         print(f"Could not find anomaly detector at {detector_script}")
         return 1
+    for replica in range(args.replicas):
+        name = "detector" if args.replicas == 1 else f"detector-{replica + 1}"
+        # Only the enhanced detector serves /health and /ready
+        health_port = args.health_port + replica if args.enhanced else None
+        env = dict(os.environ, HEALTH_PORT=str(health_port)) if health_port else None
+        supervisor.add(ManagedProcess(
+            name, [sys.executable, detector_script], env=env,
+            health_port=health_port, group=DETECTOR_GROUP
+        ))
     
-    # Start the Next.js frontend
-    print("Starting Next.js frontend...")
+    # The Next.js frontend
     frontend_dir = os.path.join(base_dir, "frontend")
     if os.path.exists(frontend_dir):
         # Check if npm is installed
@@ -130,13 +132,11 @@ def main():
                     print(f"Error installing dependencies: {e.stderr.decode() if e.stderr else 'Unknown error'}")
                     print("You may need to install dependencies manually: cd frontend && npm install")
             
-            # Start Next.js using npm
-            processes['frontend'] = subprocess.Popen(
-                ["npm", "run", "dev"],
-                cwd=frontend_dir,
-                env=dict(os.environ, PORT="3000")
-            )
-            print("Next.js frontend is running on http://localhost:3000")
+            supervisor.add(ManagedProcess(
+                "frontend", ["npm", "run", "dev"], cwd=frontend_dir,
+                env=dict(os.environ, PORT="3000"), group=FRONTEND_GROUP
+            ))
+            print("Next.js frontend will run on http://localhost:3000")
         except (subprocess.SubprocessError, FileNotFoundError):
             print("Error: npm not found. Please install Node.js and npm to run the Next.js frontend.")
             return 1
@@ -146,37 +146,14 @@ def main():
     
     print("\n" + "=" * 80)
     print("Real-Time Anomaly Detection System is running!")
+    print(f"- {args.replicas} {'enhanced ' if args.enhanced else ''}detector process(es)")
     print("- Press Ctrl+C to shut down all components")
     print("=" * 80 + "\n")
     
-    # Keep the script running and monitoring the processes
-    while True:
-        # Check if any process has terminated
-        for name, process in list(processes.items()):
-            if process.poll() is not None:
-                print(f"\n{name} has terminated with exit code {process.returncode}")
-                
-                # Restart the process
-                if name == 'producer':
-                    print("Restarting producer...")
-                    processes['producer'] = subprocess.Popen([sys.executable, producer_script])
-                elif name == 'detector':
-                    print("Restarting detector...")
-                    if args.enhanced:
-                        processes['detector'] = subprocess.Popen([sys.executable, detector_script])
-                    else:
-                        processes['detector'] = subprocess.Popen([sys.executable, detector_script])
-                elif name == 'frontend':
-                    print("Restarting Next.js frontend...")
-                    frontend_dir = os.path.join(base_dir, "frontend")
-                    processes['frontend'] = subprocess.Popen(
-                        ["npm", "run", "dev"],
-                        cwd=frontend_dir,
-                        env=dict(os.environ, PORT="3000")
-                    )
-        
-        # Sleep for a bit to avoid CPU overuse
-        time.sleep(1)
+    # Start everything, then keep restarting crashed or unhealthy processes
+    # until asked to stop
+    supervisor.run()
+    return 0
 
 if __name__ == "__main__":
     sys.exit(main())
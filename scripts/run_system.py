@@ -3,19 +3,14 @@ import sys
 import subprocess
 import time
 import signal
-import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from components.db_connection import connect
 
 def check_db_connection():
     """Check if the database is accessible"""
     try:
-        conn = psycopg2.connect(
-            dbname="anomalies",
-            user="user",
-            password="pass",
-            host="localhost",
-            port="5432",
-            connect_timeout=5
-        )
+        conn = connect(retries=0, connect_timeout=5)
         conn.close()
         return True
     except:
@@ -0,0 +1,52 @@
+"""Cohort Model Training Script
+
+Clusters users into cohorts from their stored profiles and trains one model
+per cohort. Run the enhanced detector with USER_MODEL_MODE=cohort to score
+with these models.
+"""
+
+import sys
+import os
+import time
+import argparse
+
+# Add the parent directory to the path so we can import components
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components.user_profile_manager import UserProfileManager
+from components.cohort_models import CohortModelManager
+
+def main():
+    parser = argparse.ArgumentParser(description="Assign users to cohorts and train cohort models")
+    parser.add_argument("--cohorts", type=int, default=20, help="Number of cohorts (default: 20)")
+    parser.add_argument("--per-user-limit", type=int, default=50,
+                        help="Latest normal transactions per user used for training (default: 50)")
+    parser.add_argument("--no-calibration", action="store_true",
+                        help="Don't compute per-user calibration offsets")
+    parser.add_argument("--from-archive", action="store_true",
+                        help="Read training history from the Parquet archive instead of the database")
+    args = parser.parse_args()
+
+    try:
+        user_manager = UserProfileManager(model_mode="user")
+        cohorts = CohortModelManager(user_manager.conn, user_manager.models_dir)
+        cohorts.ensure_schema()
+
+        start = time.time()
+        if not cohorts.assign_cohorts(args.cohorts):
+            print("Initialize user profiles first: python scripts/maintain.py --init-profiles")
+            return 1
+        archive = None
+        if args.from_archive:
+            from components.history_archive import HistoryArchive
+            archive = HistoryArchive()
+        trained = cohorts.train(per_user_limit=args.per_user_limit, calibrate=not args.no_calibration,
+                                archive=archive)
+        print(f"Cohort training complete: {trained} models in {time.time() - start:.2f}s")
+        return 0
+    except Exception as e:
+        print(f"Error training cohort models: {e}")
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+import os
+import sys
+
+import psycopg2
+import pytest
+from psycopg2 import extensions
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components import db_connection
+from components.db_connection import execute_prepared
+
+class RecordingCursor:
+    """Stands in for a cursor on a real (unconnected) psycopg2 connection"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.statements = []
+
+    def execute(self, query, params=None):
+        self.statements.append((query, params))
+
+def test_execute_prepared_on_psycopg2_connection_object():
+    # A bare psycopg2 connection rejects new attributes, so the prepared
+    # names must not be stored on it
+    conn = extensions.connection.__new__(extensions.connection)
+    with pytest.raises(AttributeError):
+        conn.prepared_statements = set()
+
+    cursor = RecordingCursor(conn)
+    execute_prepared(cursor, "increment_processed", (3,))
+    execute_prepared(cursor, "increment_processed", (4,))
+
+    prepares = [q for q, _ in cursor.statements if q.startswith("PREPARE")]
+    assert len(prepares) == 1
+    assert "$1" in prepares[0]
+    assert cursor.statements[-1] == ("EXECUTE increment_processed (%s)", (4,))
+
+    # Another connection prepares its own copy
+    other = RecordingCursor(extensions.connection.__new__(extensions.connection))
+    execute_prepared(other, "increment_processed", (1,))
+    assert other.statements[0][0].startswith("PREPARE increment_processed")
+
+def test_execute_prepared_on_live_connection():
+    try:
+        conn = db_connection.connect(retries=0, connect_timeout=2)
+    except psycopg2.OperationalError:
+        pytest.skip("PostgreSQL is not reachable")
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("CREATE TEMP TABLE processing_stats "
+                           "(counter_name TEXT, count_value BIGINT, last_updated_timestamp TIMESTAMP)")
+            cursor.execute("INSERT INTO processing_stats VALUES ('total_transactions_processed', 0, NOW())")
+            execute_prepared(cursor, "increment_processed", (2,))
+            execute_prepared(cursor, "increment_processed", (5,))
+            cursor.execute("SELECT count_value FROM processing_stats")
+            assert cursor.fetchone()[0] == 7
+    finally:
+        conn.rollback()
+        conn.close()
@@ -0,0 +1,80 @@
+import json
+import os
+import sys
+from collections import namedtuple
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components.dead_letter import DeadLetterQueue, InvalidRecord, parse_message, validate_transaction
+
+Message = namedtuple("Message", "topic partition offset key value")
+
+def txn(**changes):
+    message = {
+        "transaction_id": "t-1",
+        "user_id": 42,
+        "amount": 19.5,
+        "timestamp": 1760000000,
+        "location": "Berlin",
+        "merchant": {"category": "fuel"},
+        "device_info": {"type": "mobile"},
+    }
+    message.update(changes)
+    return message
+
+def reason(value):
+    with pytest.raises(InvalidRecord) as raised:
+        validate_transaction(value)
+    return raised.value.reason
+
+def test_valid_transaction_is_normalised():
+    message = validate_transaction(txn(user_id="42", amount="19.50", timestamp="1760000000.5"))
+    assert message["user_id"] == 42
+    assert message["amount"] == 19.5
+    assert message["timestamp"] == 1760000000.5
+
+def test_not_an_object():
+    assert reason([1, 2, 3]) == "not_an_object"
+    assert reason("text") == "not_an_object"
+
+@pytest.mark.parametrize("user_id", [None, True, "abc", 0, -3, 4.5])
+def test_bad_user_id(user_id):
+    assert reason(txn(user_id=user_id)) == "bad_user_id"
+
+@pytest.mark.parametrize("amount", [None, False, "ten", float("nan"), float("inf")])
+def test_bad_amount(amount):
+    assert reason(txn(amount=amount)) == "bad_amount"
+
+@pytest.mark.parametrize("timestamp", [None, "yesterday", 0, 1760000000000])
+def test_bad_timestamp(timestamp):
+    assert reason(txn(timestamp=timestamp)) == "bad_timestamp"
+
+def test_bad_nested_objects():
+    assert reason(txn(merchant="Corner Shop")) == "bad_merchant"
+    assert reason(txn(device_info=["mobile"])) == "bad_device_info"
+
+@pytest.mark.parametrize("key", ["transaction_id", "location", "currency", "transaction_type", "payment_method"])
+def test_bad_string_fields(key):
+    assert reason(txn(**{key: 7})) == f"bad_{key}"
+
+def test_undecodable():
+    with pytest.raises(InvalidRecord) as raised:
+        parse_message(b"{not json")
+    assert raised.value.reason == "undecodable"
+    assert parse_message(json.dumps(txn()).encode("utf-8"))["user_id"] == 42
+
+def test_record_appends_to_the_file(tmp_path):
+    path = tmp_path / "dead_letters" / "transactions.jsonl"
+    queue = DeadLetterQueue(path=str(path))
+    error = InvalidRecord("bad_amount", "amount is not a number: 'ten'")
+    assert queue.record(Message("transactions", 1, 7, b"42", b'{"amount": "ten"}'), error)
+    assert queue.record(Message("transactions", 1, 8, None, b"\xff\xfe"), ValueError("boom"))
+
+    first, second = [json.loads(line) for line in path.read_text().splitlines()]
+    assert (first["partition"], first["offset"], first["key"]) == (1, 7, "42")
+    assert (first["value"], first["value_encoding"], first["reason"]) == ('{"amount": "ten"}', "text", "bad_amount")
+    assert (second["value"], second["value_encoding"], second["reason"]) == ("//4=", "base64", "invalid")
+    assert queue.counts == {"bad_amount": 1, "invalid": 1}
+    assert queue.total == 2
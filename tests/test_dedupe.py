@@ -0,0 +1,78 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components import dedupe
+from components.dedupe import BloomFilter, SeenFilter
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def test_bloom_filter_membership_and_merge():
+    bloom = BloomFilter.for_capacity(1000, 0.001)
+    for i in range(1000):
+        bloom.add(f"txn-{i}".encode())
+    assert all(f"txn-{i}".encode() in bloom for i in range(1000))
+    false_positives = sum(f"other-{i}".encode() in bloom for i in range(10000))
+    assert false_positives < 50
+
+    other = BloomFilter(bloom.num_bits, bloom.num_hashes)
+    other.merge(bytes(bloom.bits))
+    assert b"txn-7" in other
+    assert other.fill_ratio() == bloom.fill_ratio()
+
+def test_duplicates_within_a_batch_and_after_confirm(monkeypatch):
+    monkeypatch.setattr(dedupe.time, "time", Clock(10_000.0))
+    seen = SeenFilter("detectors", window_seconds=3600, capacity=1000)
+    assert not seen.check_and_add("a")
+    assert seen.check_and_add("a")  # pending in the same batch
+    seen.confirm(["a"])
+    assert not seen.pending
+    assert seen.check_and_add("a")
+    assert not seen.check_and_add(None)
+    assert seen.suppressed == 2
+
+def test_released_batch_is_processed_again(monkeypatch):
+    monkeypatch.setattr(dedupe.time, "time", Clock(10_000.0))
+    seen = SeenFilter("detectors", window_seconds=3600, capacity=1000)
+    batch = ["a", "b", "c"]
+    assert not any(seen.check_and_add(txn) for txn in batch)
+    seen.release(batch)
+    assert not seen.pending
+
+    # The redelivery isn't a duplicate
+    assert not any(seen.check_and_add(txn) for txn in batch)
+    assert seen.suppressed == 0
+
+def test_generations_rotate_with_the_window(monkeypatch):
+    clock = Clock(0.0)
+    monkeypatch.setattr(dedupe.time, "time", clock)
+    seen = SeenFilter("detectors", window_seconds=3600, capacity=1000)
+    seen.check_and_add("a")
+    seen.confirm(["a"])
+
+    # Next half-window slot: the previous generation is still checked
+    clock.now = 1800.0
+    assert seen.check_and_add("a")
+    assert sorted(seen.generations) == [0, 1]
+
+    # Two slots on, generation 0 is dropped and "a" is forgotten
+    clock.now = 3600.0
+    assert not seen.check_and_add("a")
+    assert sorted(seen.generations) == [1, 2]
+
+def test_confirm_goes_into_the_current_generation(monkeypatch):
+    clock = Clock(1700.0)
+    monkeypatch.setattr(dedupe.time, "time", clock)
+    seen = SeenFilter("detectors", window_seconds=3600, capacity=1000)
+    seen.check_and_add("late")
+    # The batch commits after the slot boundary
+    clock.now = 1900.0
+    seen.confirm(["late"])
+    assert "late".encode() in seen.generations[1]
+    assert "late".encode() not in seen.generations[0]
@@ -0,0 +1,80 @@
+import os
+import sys
+from collections import namedtuple
+
+from kafka.structs import OffsetAndMetadata, TopicPartition
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components.graceful import OffsetTracker
+
+Message = namedtuple("Message", "topic partition offset")
+
+TP0 = TopicPartition("transactions", 0)
+TP1 = TopicPartition("transactions", 1)
+
+class FakeConsumer:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.commits = []
+
+    def commit(self, offsets):
+        if self.fail:
+            raise RuntimeError("rebalanced")
+        self.commits.append(offsets)
+
+def track(tracker, partition, *offsets):
+    for offset in offsets:
+        tracker.track(Message("transactions", partition, offset))
+
+def test_commit_sends_next_offsets_of_persisted_batches():
+    tracker = OffsetTracker()
+    consumer = FakeConsumer()
+    track(tracker, 0, 0, 1, 2)
+    track(tracker, 1, 7)
+    tracker.persisted(tracker.take())
+
+    assert tracker.commit(consumer)
+    assert consumer.commits == [{TP0: OffsetAndMetadata(3, None, -1), TP1: OffsetAndMetadata(8, None, -1)}]
+    assert all(isinstance(value, OffsetAndMetadata) for value in consumer.commits[0].values())
+
+    # Nothing new to commit
+    assert tracker.commit(consumer)
+    assert len(consumer.commits) == 1
+
+def test_failed_batch_holds_its_partition_until_persisted():
+    tracker = OffsetTracker()
+    consumer = FakeConsumer()
+    track(tracker, 0, 0, 1)
+    failed = tracker.take()
+    tracker.failed(failed)
+
+    # A later batch doesn't move partition 0 past the failed one
+    track(tracker, 0, 2, 3)
+    track(tracker, 1, 0)
+    tracker.persisted(tracker.take())
+    tracker.commit(consumer)
+    assert consumer.commits[-1] == {TP1: OffsetAndMetadata(1, None, -1)}
+
+    # The redelivered batch lifts the hold
+    track(tracker, 0, 0, 1, 2, 3)
+    tracker.persisted(tracker.take())
+    tracker.commit(consumer)
+    assert consumer.commits[-1] == {TP0: OffsetAndMetadata(4, None, -1)}
+
+def test_revoked_partitions_are_forgotten():
+    tracker = OffsetTracker()
+    consumer = FakeConsumer()
+    track(tracker, 0, 5)
+    tracker.failed(tracker.take())
+    track(tracker, 1, 5)
+    tracker.persisted(tracker.take())
+    tracker.on_partitions_revoked([TP0, TP1])
+    assert tracker.commit(consumer)
+    assert consumer.commits == []
+
+def test_failed_commit_returns_false():
+    tracker = OffsetTracker()
+    track(tracker, 0, 0)
+    tracker.persisted(tracker.take())
+    assert not tracker.commit(FakeConsumer(fail=True))
@@ -0,0 +1,81 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components.profile_rules import NORMAL, UNCERTAIN, VIOLATION, ProfileRules, ProfileTable
+
+# (user_id, locations, merchants, payment_methods, hours, min, max)
+ROWS = [
+    (2, ["Berlin"], ["groceries", "fuel"], ["credit_card"], [9, 10, 11], 5.0, 120.0),
+    (1, ["Paris", "Lyon"], ["travel"], ["debit_card"], [20, 21], 10.0, 900.0),
+    # A new user's profile: nothing can be checked yet
+    (3, [], [], [], [], None, None),
+]
+
+def frame(*rows):
+    return pd.DataFrame(rows, columns=["user_id", "location", "merchant_category", "payment_method", "hour_of_day", "amount"])
+
+def evaluate(*rows):
+    return ProfileRules(ProfileTable.from_rows(ROWS)).evaluate(frame(*rows))
+
+def test_table_is_sorted_and_looked_up_by_user_id():
+    table = ProfileTable.from_rows(ROWS)
+    assert list(table.user_ids) == [1, 2, 3]
+    positions, found = table.lookup([2, 4, 1])
+    assert list(found) == [True, False, True]
+    assert table.max_amount[positions[0]] == np.float32(120.0)
+
+def test_usual_transaction_is_normal():
+    risk, decision = evaluate(
+        (2, "Berlin", "fuel", "credit_card", 10, 60.0),
+        # The bounds themselves are inside the range
+        (1, "Lyon", "travel", "debit_card", 21, 900.0),
+        (1, "Paris", "travel", "debit_card", 20, 10.0),
+    )
+    assert list(risk) == [0.0, 0.0, 0.0]
+    assert list(decision) == [NORMAL, NORMAL, NORMAL]
+
+def test_single_deviation_is_uncertain():
+    risk, decision = evaluate(
+        (2, "Madrid", "fuel", "credit_card", 10, 60.0),
+        (2, "Berlin", "fuel", "credit_card", 10, 200.0),
+        # An unusual hour on its own is below normal_below
+        (2, "Berlin", "fuel", "credit_card", 3, 60.0),
+    )
+    assert np.allclose(risk, [0.25, 0.20, 0.10])
+    assert list(decision) == [UNCERTAIN, UNCERTAIN, NORMAL]
+
+def test_amount_below_the_usual_range_is_not_cleared():
+    risk, decision = evaluate((2, "Berlin", "fuel", "credit_card", 10, 0.5))
+    assert risk[0] > 0
+    assert decision[0] == UNCERTAIN
+
+def test_everything_unusual_is_a_violation():
+    risk, decision = evaluate(
+        (2, "Madrid", "travel", "crypto", 3, 1000.0),
+        # Far above the range in a new place
+        (1, "Tokyo", "travel", "debit_card", 20, 5000.0),
+    )
+    assert risk[0] == 1.0
+    assert np.isclose(risk[1], 0.65)
+    assert list(decision) == [VIOLATION, UNCERTAIN]
+
+    risk, decision = evaluate((1, "Tokyo", "groceries", "debit_card", 20, 5000.0))
+    assert decision[0] == VIOLATION
+
+def test_users_without_a_usable_profile_are_uncertain():
+    risk, decision = evaluate(
+        (4, "Berlin", "fuel", "credit_card", 10, 60.0),
+        (3, "Berlin", "fuel", "credit_card", 10, 60.0),
+    )
+    assert list(risk) == [0.0, 0.0]
+    assert list(decision) == [UNCERTAIN, UNCERTAIN]
+
+def test_empty_table_leaves_everything_uncertain():
+    rules = ProfileRules(ProfileTable.from_rows([]))
+    risk, decision = rules.evaluate(frame((1, "Paris", "travel", "debit_card", 20, 50.0)))
+    assert list(decision) == [UNCERTAIN]
@@ -0,0 +1,62 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components import wire
+
+msgpack = pytest.importorskip("msgpack")
+
+MESSAGE = {
+    "transaction_id": "0b6f2c52-3d4e-4f5a-9b1c-2d3e4f5a6b7c",
+    "user_id": 1042,
+    "amount": 129.99,
+    "currency": "EUR",
+    "location": "Berlin",
+    "timestamp": "2026-10-19T12:30:00",
+    "transaction_type": "purchase",
+    "merchant": {"merchant_id": "M-17", "name": "Corner Shop", "category": "groceries"},
+    "payment_method": "credit_card",
+    "device_info": {"type": "mobile", "ip_address": "10.0.0.7"},
+    "_anomalous": False,
+}
+
+def test_json_round_trip():
+    value = wire.encoder("json")(MESSAGE)
+    assert json.loads(value) == MESSAGE
+    assert wire.decode(value) == MESSAGE
+
+def test_msgpack_round_trip():
+    value = wire.encoder("msgpack")(MESSAGE)
+    assert value.startswith(wire.MAGIC + bytes([wire.VERSION]))
+    assert len(value) < len(wire.encode_json(MESSAGE))
+    assert wire.decode(value) == MESSAGE
+
+def test_msgpack_keeps_missing_and_extra_fields():
+    message = {
+        "transaction_id": "not-a-uuid",
+        "user_id": 7,
+        "amount": 5.0,
+        "merchant": {"category": "fuel", "country": "DE"},
+        "channel": "web",
+    }
+    assert wire.decode(wire.encode_msgpack(message)) == message
+
+def test_unsupported_version_is_rejected():
+    value = wire.encode_msgpack(MESSAGE)
+    bumped = wire.MAGIC + bytes([wire.VERSION + 1]) + value[len(wire.MAGIC) + 1:]
+    with pytest.raises(ValueError, match="Unsupported message version"):
+        wire.decode(bumped)
+
+def test_bad_magic_is_not_mistaken_for_msgpack():
+    value = wire.encode_msgpack(MESSAGE)
+    # Without the full header the value is read as JSON and fails to parse
+    with pytest.raises(ValueError):
+        wire.decode(b"\x00TY" + value[len(wire.MAGIC):])
+
+def test_unknown_encoding():
+    with pytest.raises(ValueError, match="Unknown encoding"):
+        wire.encoder("avro")